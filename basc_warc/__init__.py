@@ -11,7 +11,9 @@
 # with this software. If not, see
 # <http://creativecommons.org/publicdomain/zero/1.0/>.
 """Create and manage WARC files."""
+import collections
 import datetime
+import os
 import sys
 import threading
 
@@ -25,8 +27,10 @@ WARC_SOFTWARE = (b'BASC-WARC/' + __version__.encode('utf8') +
 WARC_FORMAT = b'WARC File Format 1.0'
 WARC_CONFORMS_TO = b'http://bibnum.bnf.fr/WARC/WARC_ISO_28500_version1_latestdraft.pdf'
 CRLF = b'\r\n'
+CHUNK_SIZE = 64 * 1024
 
-warc_sort_keyfn = utils.sort_manual_keys(
+# standard fields, in the order they're written out
+WARC_FIELDS = (
     'WARC-Type', 'WARC-Record-ID', 'WARC-Date',
     'Content-Type', 'Content-Length', 'WARC-Concurrent-To',
     'WARC-Block-Digest', 'WARC-Payload-Digest',
@@ -37,6 +41,9 @@ warc_sort_keyfn = utils.sort_manual_keys(
     'WARC-Segment-Origin-ID', 'WARC-Segment-Number',
     'WARC-Segment-Total-Length')
 
+# sorts field names in the order WarcFields writes them, kept for code that sorts fields
+warc_sort_keyfn = utils.sort_manual_keys(*WARC_FIELDS)
+
 
 class WarcFile(object):
     """A WARC (Web ARChive) file."""
@@ -46,25 +53,60 @@ class WarcFile(object):
         self.records_lock = threading.Lock()
 
     # output
-    def bytes(self, compress_records=False):
+    def bytes(self, compress_records=False, compression_level=6):
         """Return bytes to write.
 
+        This builds the entire WARC file in memory. For large files, use
+        :meth:`basc_warc.WarcFile.write_to` or a :class:`basc_warc.WarcWriter` instead.
+
         Args:
             compress_records (bool): Whether to apply gzip compression to records.
+            compression_level (int): gzip compression level, from 1 (fastest) to 9 (smallest).
 
         Returns:
             Bytes that represent this WARC file.
         """
-        warc = bytes()
+        warc = []
 
+        # only hold the lock long enough to take a snapshot of our records, so other
+        # threads can keep adding records while we serialize
         with self.records_lock:
-            for record in self.records:
-                if compress_records:
-                    print('Cannot compress records yet.')
-                else:
-                    warc += record.bytes()
+            records = list(self.records)
+
+        for record in records:
+            if compress_records:
+                warc.append(utils.gzip_member(record.bytes(), compression_level))
+            else:
+                warc.append(record.bytes())
+
+        return bytes().join(warc)
+
+    def write_to(self, fileobj, compress_records=False, compression_level=6,
+                 executor=None, on_write=None):
+        """Write this WARC file to the given file object, one record at a time.
 
-        return warc
+        Args:
+            fileobj: Binary file-like object to write to.
+            compress_records (bool): Whether to apply gzip compression to records.
+            compression_level (int): gzip compression level, from 1 (fastest) to 9 (smallest).
+            executor (concurrent.futures.Executor): Thread or process pool to compress
+                records on.
+            on_write (callable): Called as ``on_write(record, offset, length)`` after each
+                record is written.
+
+        Returns:
+            Offsets of the written records.
+        """
+        writer = WarcWriter(fileobj, compress_records=compress_records,
+                            compression_level=compression_level, executor=executor,
+                            on_write=on_write)
+
+        with self.records_lock:
+            records = list(self.records)
+
+        offsets = writer.add_records(*records)
+        writer.flush()
+        return offsets
 
     # adding records
     def create_record(self, record_type, defaults=True):
@@ -82,7 +124,7 @@ class WarcFile(object):
 
         if defaults:
             record_header.record_id = utils.uuid_urn()
-            record_header.date = datetime.datetime.now()
+            record_header.date = datetime.datetime.utcnow()
 
         # assemble record
         new_record = Record(record_type, header=record_header)
@@ -123,7 +165,8 @@ class WarcFile(object):
 
     def add_warcinfo_record(self, fields={}, operator=None, software=None,
                             robots=None, hostname=None, ip=None,
-                            http_header_user_agent=None, http_header_from=None):
+                            http_header_user_agent=None, http_header_from=None,
+                            filename=None):
         """Add a warcinfo record to this file.
 
         Args:
@@ -144,6 +187,7 @@ class WarcFile(object):
                 verbatim requests, this information is redundant.
             http_header_from (string): The HTTP 'From' header usually sent by the harvester
                 along with each request (redundant when 'request' records are used, as above).
+            filename (string): Filename of this WARC file, for the ``WARC-Filename`` field.
 
         Returns:
             Index of the new added record.
@@ -151,7 +195,14 @@ class WarcFile(object):
         # assemble header fields
         header_fields = {
             'Content-Type': 'application/warc-fields',
+            'WARC-Record-ID': utils.uuid_urn(),
+            'WARC-Date': datetime.datetime.utcnow(),
         }
+        if filename:
+            header_fields['WARC-Filename'] = filename
+
+        # don't modify the given (or default) dict
+        fields = dict(fields)
 
         # assemble content fields
         if operator:
@@ -182,6 +233,202 @@ class WarcFile(object):
         return record_index
 
 
+class WarcWriter(WarcFile):
+    """A WARC file that is written straight to a file object as records are added.
+
+    Records are serialized as soon as they're added and are not kept around, so
+    memory use stays flat no matter how large the WARC file grows.
+
+    When compressing records, an :class:`concurrent.futures.Executor` may be given to
+    compress records in parallel. Records are still written in the order they're added.
+
+    Args:
+        fileobj: Binary file-like object (file, socket file, etc) to write to.
+        flush_records (int): Flush ``fileobj`` after this many records are written.
+        flush_bytes (int): Flush ``fileobj`` after this many bytes are written.
+        compress_records (bool): Write each record as its own gzip member.
+        compression_level (int): gzip compression level, from 1 (fastest) to 9 (smallest).
+        executor (concurrent.futures.Executor): Thread or process pool to compress records on.
+        max_pending (int): Maximum number of records waiting on ``executor`` at once.
+        on_write (callable): Called as ``on_write(record, offset, length)`` after each
+            record is written, with the (compressed) offset and length of that record.
+    """
+
+    def __init__(self, fileobj, flush_records=None, flush_bytes=None,
+                 compress_records=False, compression_level=6, executor=None,
+                 max_pending=32, on_write=None):
+        super(WarcWriter, self).__init__(records=[])
+        self.fileobj = fileobj
+        self.flush_records = flush_records
+        self.flush_bytes = flush_bytes
+        self.compress_records = compress_records
+        self.compression_level = compression_level
+        self.executor = executor
+        self.max_pending = max_pending
+        self.on_write = on_write
+
+        try:
+            self.offset = fileobj.tell()
+        except (AttributeError, IOError, OSError):
+            self.offset = 0
+        self.record_count = 0
+
+        self._unflushed_records = 0
+        self._unflushed_bytes = 0
+
+        # records submitted to executor, in output order
+        self._pending = collections.deque()
+        self._submit_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # output
+    def bytes(self, compress_records=False, compression_level=6):
+        """Not supported, because a writer doesn't keep its records.
+
+        Raises:
+            TypeError: Always. Records have already been written to ``fileobj``.
+        """
+        raise TypeError('WarcWriter does not keep its records, they have already been '
+                        'written to its file object')
+
+    def write_to(self, fileobj, compress_records=False, compression_level=6,
+                 executor=None, on_write=None):
+        """Not supported, because a writer doesn't keep its records.
+
+        Raises:
+            TypeError: Always. Records have already been written to ``fileobj``.
+        """
+        raise TypeError('WarcWriter does not keep its records, they have already been '
+                        'written to its file object')
+
+    def flush(self):
+        """Write any records still being compressed and flush the underlying file object."""
+        with self.records_lock:
+            self._write_pending()
+            self._flush()
+
+    def close(self):
+        """Flush and close the underlying file object."""
+        self.flush()
+        self.fileobj.close()
+
+    def _flush(self):
+        if hasattr(self.fileobj, 'flush'):
+            self.fileobj.flush()
+        self._unflushed_records = 0
+        self._unflushed_bytes = 0
+
+    def _written(self, record, length):
+        offset = self.offset
+
+        self.offset += length
+        self.record_count += 1
+        self._unflushed_records += 1
+        self._unflushed_bytes += length
+
+        if self.on_write is not None:
+            self.on_write(record, offset, length)
+
+        if self.flush_records and self._unflushed_records >= self.flush_records:
+            self._flush()
+        elif self.flush_bytes and self._unflushed_bytes >= self.flush_bytes:
+            self._flush()
+
+        return offset
+
+    def _write_member(self, record, member):
+        self.fileobj.write(member)
+        return self._written(record, len(member))
+
+    def _write_record(self, record):
+        return self._written(record, record.write_to(self.fileobj))
+
+    def _write_streamed_member(self, record):
+        length = utils.write_gzip_member(record.chunks(), self.fileobj,
+                                         self.compression_level)
+        return self._written(record, length)
+
+    def _write_pending(self, until=None, keep=0):
+        """Write pending records in order.
+
+        Stops once the ``until`` entry has been written, or when only ``keep`` records
+        are left pending.
+        """
+        while len(self._pending) > keep and (until is None or until.offset is None):
+            entry = self._pending.popleft()
+            if entry.future is None:
+                entry.offset = self._write_streamed_member(entry.record)
+            else:
+                entry.offset = self._write_member(entry.record, entry.future.result())
+
+    # adding records
+    def add_records(self, *records):
+        """Write the given Records to our file object.
+
+        Args:
+            record (list of :class:`basc_warc.Record`): Records to write to this WARC file.
+
+        Returns:
+            Offsets of the written records.
+        """
+        if not self.compress_records:
+            with self.records_lock:
+                return [self._write_record(record) for record in records]
+
+        # file-backed records are compressed as they're streamed out, under the lock
+        if self.executor is None:
+            members = [None if record.is_streamed() else
+                       utils.gzip_member(record.bytes(), self.compression_level)
+                       for record in records]
+
+            with self.records_lock:
+                return [self._write_streamed_member(record) if member is None else
+                        self._write_member(record, member)
+                        for record, member in zip(records, members)]
+
+        entries = []
+
+        with self._submit_lock:
+            for record in records:
+                if len(self._pending) >= self.max_pending:
+                    with self.records_lock:
+                        self._write_pending(keep=self.max_pending - 1)
+
+                if record.is_streamed():
+                    future = None
+                else:
+                    future = self.executor.submit(utils.gzip_member, record.bytes(),
+                                                  self.compression_level)
+                entry = _PendingRecord(record, future)
+                entries.append(entry)
+                self._pending.append(entry)
+
+        if entries:
+            with self.records_lock:
+                self._write_pending(until=entries[-1])
+
+        return [entry.offset for entry in entries]
+
+
+class _PendingRecord(object):
+    """A record waiting to be compressed and written by a :class:`basc_warc.WarcWriter`.
+
+    ``future`` is None for file-backed records, which are compressed as they're written.
+    """
+
+    __slots__ = ('record', 'future', 'offset')
+
+    def __init__(self, record, future):
+        self.record = record
+        self.future = future
+        self.offset = None
+
+
 class Record(object):
     """A record in a WARC file.
 
@@ -189,21 +436,137 @@ class Record(object):
         record_type (string): Name of this type of record. ie: ``'warcinfo'``.
         header (RecordHeader): A :class:`basc_warc.RecordHeader` object.
         block (RecordBlock): A :class:`basc_warc.RecordBlock` object.
+        digest_algorithm (string): Algorithm for ``WARC-Block-Digest`` and
+            ``WARC-Payload-Digest``, see :func:`basc_warc.utils.new_hash`.
     """
 
-    def __init__(self, record_type, header=None, block=None):
-        self.record_type = record_type
+    __slots__ = ('record_type', 'header', 'block', 'digest_algorithm', 'offset', 'length',
+                 '_digest_key', '_digests')
+
+    def __init__(self, record_type, header=None, block=None, digest_algorithm='sha1'):
+        self.record_type = utils.intern(record_type)
         self.header = header
         self.block = block
+        self.digest_algorithm = digest_algorithm
+
+        # where this record was read from, see basc_warc.reader.WarcReader
+        self.offset = None
+        self.length = None
+
+        # (block content, algorithm, payload) the cached digests were calculated for
+        self._digest_key = None
+        self._digests = None
+
+    def has_http_payload(self):
+        """Return True if this record's block is an HTTP message with a payload."""
+        content_type = self.header.fields.get('Content-Type', '')
+        if isinstance(content_type, bytes):
+            content_type = content_type.decode('utf8', 'replace')
+        return content_type.lower().startswith('application/http')
+
+    def is_streamed(self):
+        """Return True if this record's block is streamed from a file when written."""
+        return hasattr(self.block, 'write_to')
+
+    def prepare(self):
+        """Fill in the header fields that are calculated from the block.
+
+        This sets ``WARC-Type``, ``Content-Length`` and the block and payload digests.
+        It happens automatically when the record is written, but calling it beforehand
+        (for example, on the thread that created the record) moves the work of
+        calculating digests off the thread doing the writing.
+        """
+        self._update_header()
 
-    def bytes(self):
-        """Return bytes to write."""
+    def _update_header(self):
         self.header.set_field('WARC-Type', self.record_type)
         self.header.set_field('Content-Length', self.block.length())
-        if self.block.bytes():
-            self.header.set_field('WARC-Block-Digest',
-                                  utils.content_digest(self.block.bytes()))
-        return self.header.bytes() + CRLF + self.block.bytes() + CRLF + CRLF
+        if self.block.length():
+            block_digest, payload_digest = self._block_digests()
+
+            self.header.set_field('WARC-Block-Digest', block_digest)
+            if payload_digest is not None:
+                self.header.set_field('WARC-Payload-Digest', payload_digest)
+
+    def _block_digests(self):
+        """Return block and payload digests, only recalculating them if the block changed."""
+        # revisit and segmented records' blocks don't hold the whole payload, so their
+        # payload digest is the one they were given
+        payload = (self.has_http_payload() and self.record_type != 'revisit' and
+                   'WARC-Segment-Number' not in self.header.fields)
+
+        # blocks that aren't in memory work out (and cache) their own digests
+        if hasattr(self.block, 'digests'):
+            return self.block.digests(self.digest_algorithm, payload)
+
+        block = self.block.bytes()
+        key = self._digest_key
+
+        if key is None or key[0] is not block or key[1:] != (self.digest_algorithm, payload):
+            digester = utils.Digester(self.digest_algorithm, payload=payload)
+            digester.update(block)
+
+            self._digest_key = (block, self.digest_algorithm, payload)
+            self._digests = (digester.block_digest(), digester.payload_digest())
+
+        return self._digests
+
+    def set_digests(self, digester):
+        """Use the digests of a :class:`basc_warc.utils.Digester` that's already seen the
+        block, such as one that was updated while the block was being downloaded.
+        """
+        if hasattr(self.block, 'set_digests'):
+            self.block.set_digests(digester)
+            return
+
+        self._digest_key = (self.block.bytes(), digester.algorithm,
+                            digester.calculates_payload)
+        self._digests = (digester.block_digest(), digester.payload_digest())
+
+    def bytes(self):
+        """Return bytes to write."""
+        self._update_header()
+        return bytes().join((self.header.bytes(), CRLF, self.block.bytes(), CRLF, CRLF))
+
+    def chunks(self, size=CHUNK_SIZE):
+        """Yield bytes to write in chunks, without reading file-backed blocks into memory.
+
+        Args:
+            size (int): Maximum size of block chunks.
+        """
+        self._update_header()
+        yield self.header.bytes() + CRLF
+
+        if hasattr(self.block, 'chunks'):
+            for chunk in self.block.chunks(size):
+                yield chunk
+        else:
+            yield self.block.bytes()
+
+        yield CRLF + CRLF
+
+    def write_to(self, fileobj):
+        """Write this record to the given file object.
+
+        Args:
+            fileobj: Binary file-like object to write to.
+
+        Returns:
+            Number of bytes written.
+        """
+        self._update_header()
+        header = self.header.bytes()
+
+        fileobj.write(header + CRLF)
+        if self.is_streamed():
+            length = self.block.write_to(fileobj)
+        else:
+            block = self.block.bytes()
+            fileobj.write(block)
+            length = len(block)
+        fileobj.write(CRLF + CRLF)
+
+        return len(header) + len(CRLF) + length + 4
 
 
 class RecordHeader(object):
@@ -211,10 +574,38 @@ class RecordHeader(object):
 
     Args:
         fields (dict): Fields to create this header with.
+        warc_version (bytes): Version line of the header, such as ``b'WARC/1.1'``.
+            Headers read from a file keep the version line they were read with. Dates
+            in ``WARC/1.1`` headers are written with microseconds.
     """
 
-    def __init__(self, fields={}):
-        self.fields = utils.CaseInsensitiveDict(fields)
+    __slots__ = ('_fields', '_warc_version', '_cache', '_cache_version')
+
+    def __init__(self, fields={}, warc_version=WARC_VERSION):
+        self._fields = WarcFields(fields)
+        self._warc_version = warc_version
+        self._cache = None
+        self._cache_version = None
+
+    @property
+    def fields(self):
+        """The header's :class:`basc_warc.WarcFields`."""
+        return self._fields
+
+    @fields.setter
+    def fields(self, fields):
+        self._fields = fields
+        self._cache = None
+
+    @property
+    def warc_version(self):
+        """Version line of the header, such as ``b'WARC/1.0'``."""
+        return self._warc_version
+
+    @warc_version.setter
+    def warc_version(self, warc_version):
+        self._warc_version = warc_version
+        self._cache = None
 
     def set_field(self, name, value):
         """Set field to the given value.
@@ -226,16 +617,23 @@ class RecordHeader(object):
         self.fields[name] = value
 
     def bytes(self):
-        """Return bytes to write."""
-        field_bytes = bytes()
+        """Return bytes to write.
 
-        for key, value in sorted(self.fields.items(), key=warc_sort_keyfn):
-            key = utils.writable_field_name(key)
-            value = utils.writable_field_value(value)
+        The serialized header is cached until one of its fields changes.
+        """
+        if self._cache is None or self._cache_version != self.fields.version:
+            lines = [self._warc_version, CRLF]
+            # WARC 1.0 dates are only precise to the second
+            subsecond = self._warc_version >= b'WARC/1.1'
+
+            for key, value in self.fields._items():
+                lines.extend((utils.writable_field_name(key), b': ',
+                              utils.writable_field_value(value, subsecond), CRLF))
 
-            field_bytes += key + b': ' + value
+            self._cache = bytes().join(lines)
+            self._cache_version = self.fields.version
 
-        return WARC_VERSION + CRLF + field_bytes + CRLF
+        return self._cache
 
     # convenience
     @property
@@ -245,16 +643,369 @@ class RecordHeader(object):
 
     @record_id.setter
     def record_id(self, new_id):
-        self.fields['WARC-Record-ID'] = new_id
+        self.set_field('WARC-Record-ID', new_id)
 
     @property
     def date(self):
-        """Datetime the data capture that created this Record started."""
-        return self.fields.get('WARC-Date')
+        """Datetime the data capture that created this Record started.
+
+        Dates read from a file are kept as timestamps, and only converted when this is
+        used.
+        """
+        date = self.fields.get('WARC-Date')
+        if date is None or isinstance(date, datetime.datetime):
+            return date
+        return utils.ts_to_datetime(date)
 
     @date.setter
     def date(self, new_date):
-        self.fields['WARC-Date'] = new_date
+        self.set_field('WARC-Date', new_date)
+
+
+def _field_slot(name):
+    return '_' + name.lower().replace('-', '_')
+
+
+# field name (as given, and lowercased) -> (canonical name, slot)
+_FIELD_SLOTS = {}
+for _name in WARC_FIELDS:
+    _FIELD_SLOTS[_name] = _FIELD_SLOTS[_name.lower()] = (_name, _field_slot(_name))
+
+# the same, for field names read from a file
+_RAW_FIELD_SLOTS = {}
+for _name in WARC_FIELDS:
+    _RAW_FIELD_SLOTS[_name.encode('ascii')] = _FIELD_SLOTS[_name]
+    _RAW_FIELD_SLOTS[_name.lower().encode('ascii')] = _FIELD_SLOTS[_name]
+_MISSING = object()
+
+# marks a repeated field as the one a continuation line belongs to
+_REPEAT = object()
+
+
+def _decoded(value):
+    """Decode a value as it was read, replacing bytes that aren't valid UTF-8."""
+    return value.decode('utf8', 'replace') if isinstance(value, bytes) else value
+
+
+class WarcFields(utils.MutableMapping):
+    """Fields of a :class:`basc_warc.RecordHeader`, a case-insensitive ``dict``-like object.
+
+    The standard WARC fields are stored in slots rather than a dict, and always use
+    their canonical names (ie: ``'WARC-Record-ID'``). Other fields are kept in a dict
+    that's only created when needed, and keep the case of the name they were last set
+    with.
+
+    Some fields, such as ``WARC-Concurrent-To``, may appear more than once. Indexing
+    returns the first value, :meth:`get_all` returns every one, and :meth:`add` adds
+    another. Setting or deleting a field replaces or removes all of its values.
+
+    ``version`` changes whenever a field does, so serialized headers can be cached.
+
+    Fields parsed with :meth:`from_bytes` keep their values as the bytes they were read
+    as, and each one is only decoded when it's accessed. Values that aren't valid UTF-8
+    are kept as they were read, so they're written back unaltered.
+    """
+
+    __slots__ = ('version', '_extra', '_repeats', '_raw') + tuple(
+        _field_slot(name) for name in WARC_FIELDS)
+
+    def __init__(self, data=None, **kwargs):
+        self.version = 0
+        self._extra = None
+        # lowercased name -> [(name, value)] of the values after the first, if any
+        self._repeats = None
+        # whether bytes values are undecoded ones from from_bytes
+        self._raw = False
+        if isinstance(data, WarcFields):
+            self._copy_from(data)
+        elif data:
+            self.update(data)
+        if kwargs:
+            self.update(kwargs)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Parse header field lines, ie: ``b'WARC-Type: response\\r\\n...'``.
+
+        Standard field names are recognized without being decoded, and values are left
+        as bytes until they're accessed.
+
+        Args:
+            data (bytes): Field lines, without the ``WARC/1.0`` line or the blank line
+                ending the header.
+
+        Raises:
+            ValueError: A line isn't a valid field.
+        """
+        fields = cls()
+        fields._raw = True
+        slots = _RAW_FIELD_SLOTS
+        # slots already set, so repeated fields can be told apart
+        seen = set()
+        seen_add = seen.add
+        last = None
+
+        for line in data.splitlines():
+            name, sep, value = line.partition(b':')
+
+            # the usual case, a standard field name as it's normally written
+            field = slots.get(name)
+            if field is not None:
+                if field[1] in seen:
+                    last = fields._add_repeat(field[0], value.strip())
+                else:
+                    setattr(fields, field[1], value.strip())
+                    seen_add(field[1])
+                    last = field
+                continue
+
+            if not line:
+                continue
+
+            # continuation of the previous field's value
+            if line[:1] in (b' ', b'\t') and last is not None:
+                fields._continue(last, line.strip())
+                continue
+
+            if not sep:
+                raise ValueError('Invalid header line: {!r}'.format(line))
+
+            name = name.strip()
+            field = slots.get(name) or slots.get(name.lower())
+            if field is not None:
+                if field[1] in seen:
+                    last = fields._add_repeat(field[0], value.strip())
+                else:
+                    setattr(fields, field[1], value.strip())
+                    seen_add(field[1])
+                    last = field
+                continue
+
+            if fields._extra is None:
+                fields._extra = {}
+            key = utils.intern(name.decode('utf8', 'replace'))
+            lowered = utils.intern(key.lower())
+            if lowered in fields._extra:
+                last = fields._add_repeat(key, value.strip())
+            else:
+                fields._extra[lowered] = (key, value.strip())
+                last = (None, lowered)
+
+        return fields
+
+    def _add_repeat(self, name, value):
+        """Add another value of a field that already has one."""
+        if self._repeats is None:
+            self._repeats = {}
+        lowered = name.lower()
+        self._repeats.setdefault(lowered, []).append((name, value))
+        return (_REPEAT, lowered)
+
+    def _continue(self, last, more):
+        """Add a continuation line to the value of the field last read."""
+        kind, key = last
+        if kind is None:
+            name, value = self._extra[key]
+            self._extra[key] = (name, value + b' ' + more)
+        elif kind is _REPEAT:
+            name, value = self._repeats[key][-1]
+            self._repeats[key][-1] = (name, value + b' ' + more)
+        else:
+            setattr(self, key, getattr(self, key) + b' ' + more)
+
+    def _decode_all(self):
+        """Decode every value that's still as it was read, and is valid UTF-8."""
+        undecoded = False
+
+        for name in WARC_FIELDS:
+            slot = _FIELD_SLOTS[name][1]
+            value = getattr(self, slot, None)
+            if isinstance(value, bytes):
+                try:
+                    setattr(self, slot, value.decode('utf8'))
+                except UnicodeDecodeError:
+                    undecoded = True
+
+        for values in (self._extra or {}, self._repeats or {}):
+            for lowered, entries in values.items():
+                if isinstance(entries, tuple):
+                    entries = [entries]
+                decoded = []
+                for key, value in entries:
+                    if isinstance(value, bytes):
+                        try:
+                            value = value.decode('utf8')
+                        except UnicodeDecodeError:
+                            undecoded = True
+                    decoded.append((key, value))
+                values[lowered] = decoded if values is self._repeats else decoded[0]
+
+        self._raw = undecoded
+
+    def __setitem__(self, key, value):
+        field = _FIELD_SLOTS.get(key)
+        if field is None:
+            field = _FIELD_SLOTS.get(key.lower())
+
+        if self._repeats and self._repeats.pop(key.lower(), None):
+            self.version += 1
+
+        if field is not None:
+            if getattr(self, field[1], _MISSING) != value:
+                setattr(self, field[1], value)
+                self.version += 1
+            return
+
+        if self._extra is None:
+            self._extra = {}
+        lowered = key.lower()
+        if self._extra.get(lowered) != (key, value):
+            self._extra[utils.intern(lowered)] = (utils.intern(key), value)
+            self.version += 1
+
+    def __getitem__(self, key):
+        field = _FIELD_SLOTS.get(key)
+        if field is None:
+            field = _FIELD_SLOTS.get(key.lower())
+
+        if field is not None:
+            value = getattr(self, field[1], _MISSING)
+            if value is _MISSING:
+                raise KeyError(key)
+            if self._raw and isinstance(value, bytes):
+                try:
+                    value = value.decode('utf8')
+                except UnicodeDecodeError:
+                    # kept as read, so it's written back unaltered
+                    return _decoded(value)
+                setattr(self, field[1], value)
+            return value
+
+        if self._extra is None:
+            raise KeyError(key)
+        lowered = key.lower()
+        name, value = self._extra[lowered]
+        if self._raw and isinstance(value, bytes):
+            try:
+                value = value.decode('utf8')
+            except UnicodeDecodeError:
+                return _decoded(value)
+            self._extra[lowered] = (name, value)
+        return value
+
+    def get_all(self, key):
+        """Return a list of every value of a field, empty if it isn't set."""
+        if key not in self:
+            return []
+        values = [self[key]]
+        if self._repeats:
+            values.extend(_decoded(value) if self._raw else value
+                          for name, value in self._repeats.get(key.lower(), ()))
+        return values
+
+    def add(self, key, value):
+        """Add a value for a field, after any values it already has."""
+        if key not in self:
+            self[key] = value
+            return
+        field = _FIELD_SLOTS.get(key) or _FIELD_SLOTS.get(key.lower())
+        self._add_repeat(field[0] if field is not None else key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        field = _FIELD_SLOTS.get(key)
+        if field is None:
+            field = _FIELD_SLOTS.get(key.lower())
+
+        if field is not None:
+            try:
+                delattr(self, field[1])
+            except AttributeError:
+                raise KeyError(key)
+        else:
+            if self._extra is None:
+                raise KeyError(key)
+            del self._extra[key.lower()]
+
+        if self._repeats:
+            self._repeats.pop(key.lower(), None)
+        self.version += 1
+
+    def __iter__(self):
+        return (key for key, value in self._items(repeats=False))
+
+    def __len__(self):
+        return sum(1 for item in self._items(repeats=False))
+
+    def __contains__(self, key):
+        field = _FIELD_SLOTS.get(key)
+        if field is None:
+            field = _FIELD_SLOTS.get(key.lower())
+
+        if field is not None:
+            return hasattr(self, field[1])
+        return self._extra is not None and key.lower() in self._extra
+
+    def cased_items(self):
+        """Yield ``(name, value)`` pairs, standard fields first in the order they're written.
+
+        Fields with several values are yielded once for each.
+        """
+        if self._raw:
+            self._decode_all()
+        if self._raw:
+            return ((name, _decoded(value)) for name, value in self._items())
+        return self._items()
+
+    def _items(self, repeats=True):
+        """Like :meth:`cased_items`, but values that haven't been decoded are left as bytes."""
+        repeated = self._repeats if repeats else None
+
+        for name in WARC_FIELDS:
+            value = getattr(self, _FIELD_SLOTS[name][1], _MISSING)
+            if value is not _MISSING:
+                yield name, value
+                if repeated:
+                    for item in repeated.get(name.lower(), ()):
+                        yield item
+
+        if self._extra:
+            for lowered in sorted(self._extra):
+                yield self._extra[lowered]
+                if repeated:
+                    for item in repeated.get(lowered, ()):
+                        yield item
+
+    def lower_items(self):
+        """Like iteritems(), but with all lowercase keys."""
+        return ((key.lower(), value) for key, value in self.cased_items())
+
+    def __eq__(self, other):
+        if isinstance(other, utils.Mapping):
+            other = WarcFields(other)
+        else:
+            return NotImplemented
+        # Compare insensitively
+        return dict(self.lower_items()) == dict(other.lower_items())
+
+    def copy(self):
+        return WarcFields(self)
+
+    def _copy_from(self, other):
+        # copies slots directly, so repeated fields and undecoded values are kept
+        for name in WARC_FIELDS:
+            value = getattr(other, _FIELD_SLOTS[name][1], _MISSING)
+            if value is not _MISSING:
+                setattr(self, _FIELD_SLOTS[name][1], value)
+        if other._extra:
+            self._extra = dict(other._extra)
+        if other._repeats:
+            self._repeats = dict((lowered, list(values))
+                                 for lowered, values in other._repeats.items())
+        self._raw = other._raw
+
+    def __repr__(self):
+        return str(dict(self.cased_items()))
 
 
 class RecordBlock(object):
@@ -274,11 +1025,134 @@ class RecordBlock(object):
         """Return bytes to write."""
         return self.content
 
+    def chunks(self, size=CHUNK_SIZE):
+        """Yield the content in chunks of at most ``size`` bytes."""
+        view = memoryview(self.content)
+        for start in range(0, len(view), size):
+            yield view[start:start + size]
+
     def length(self):
         """Return length in bytes."""
         return len(self.content)
 
 
+class FileBlock(object):
+    """Block whose content is read from a file when written, rather than kept in memory.
+
+    Content is written in chunks, or copied directly between files by the kernel with
+    :func:`os.copy_file_range` or :func:`os.sendfile` where possible. Digests are
+    calculated by streaming through the file once, and are cached.
+
+    Args:
+        path (string): Path of the file to read content from.
+        fileobj: Binary file object to read content from, instead of ``path``.
+        offset (int): Offset in the file the content starts at.
+        length (int): Length of the content, defaults to the rest of the file.
+    """
+
+    def __init__(self, path=None, fileobj=None, offset=0, length=None):
+        if (path is None) == (fileobj is None):
+            raise ValueError('Exactly one of path and fileobj must be given')
+
+        self.path = path
+        self.fileobj = fileobj
+        self.offset = offset
+
+        if length is None:
+            if path is not None:
+                size = os.stat(path).st_size
+            else:
+                size = os.fstat(fileobj.fileno()).st_size
+            length = size - offset
+        self._length = length
+
+        self._digests = {}
+
+    def _open(self):
+        if self.fileobj is not None:
+            return self.fileobj, False
+        return open(self.path, 'rb'), True
+
+    def chunks(self, size=CHUNK_SIZE):
+        """Yield the content in chunks of at most ``size`` bytes."""
+        fileobj, close = self._open()
+        try:
+            fileobj.seek(self.offset)
+            remaining = self._length
+            while remaining:
+                chunk = fileobj.read(min(size, remaining))
+                if not chunk:
+                    raise IOError('File is shorter than the block length')
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            if close:
+                fileobj.close()
+
+    def write_to(self, fileobj):
+        """Write the content to the given file object.
+
+        Args:
+            fileobj: Binary file-like object to write to.
+
+        Returns:
+            Number of bytes written.
+        """
+        try:
+            out_fd = fileobj.fileno()
+        except (AttributeError, IOError, OSError, ValueError):
+            out_fd = None
+
+        if out_fd is not None:
+            fileobj.flush()
+            source, close = self._open()
+            try:
+                if utils.copy_fd_range(source.fileno(), out_fd, self.offset, self._length):
+                    return self._length
+            finally:
+                if close:
+                    source.close()
+
+        for chunk in self.chunks():
+            fileobj.write(chunk)
+        return self._length
+
+    def digests(self, algorithm, payload):
+        """Return the ``(block digest, payload digest)`` of the content.
+
+        Args:
+            algorithm (string): Digest algorithm, see :func:`basc_warc.utils.new_hash`.
+            payload (bool): Whether to also calculate the payload digest.
+        """
+        key = (algorithm, payload)
+        if key not in self._digests:
+            digester = utils.Digester(algorithm, payload=payload)
+            for chunk in self.chunks():
+                digester.update(chunk)
+            self.set_digests(digester)
+        return self._digests[key]
+
+    def set_digests(self, digester):
+        """Use the digests of a :class:`basc_warc.utils.Digester` that's already seen the
+        content, such as one that was updated while the file was being downloaded.
+        """
+        payload = digester.payload_digest()
+        key = (digester.algorithm, digester.calculates_payload)
+        self._digests[key] = (digester.block_digest(), payload)
+
+    def bytes(self):
+        """Return bytes to write.
+
+        This reads the whole file into memory, so :meth:`chunks` should be used instead
+        where possible.
+        """
+        return bytes().join(self.chunks())
+
+    def length(self):
+        """Return length in bytes."""
+        return self._length
+
+
 class WarcinfoBlock(object):
     """Block for a warcinfo record.
 
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC asyncio support
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Read and write WARC files from asyncio coroutines.
+
+Blocking work (disk I/O, compression and digesting) is run on executors, so a slow disk
+doesn't stall the event loop. This module requires Python 3.6 or later.
+"""
+import asyncio
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from basc_warc import CHUNK_SIZE, FileBlock, WarcWriter, utils
+from basc_warc.reader import WarcReader
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+class AsyncWarcWriter(object):
+    """Writes records from coroutines.
+
+    Records are written by a single thread, in the order :meth:`add_records` calls get
+    one of ``max_pending`` slots, which is the order they're made. Digests are
+    calculated on ``executor`` beforehand, for several calls at once, but a call whose
+    digests are ready first still waits for earlier calls to be queued. Once every slot
+    is taken, callers wait, so memory use stays bounded when the disk can't keep up.
+
+    Args:
+        writer: Writer to write records with, such as a :class:`basc_warc.WarcWriter`
+            or :class:`basc_warc.queued.QueuedWarcWriter`. A binary file object may also
+            be given, to write to with a new :class:`basc_warc.WarcWriter`.
+        executor (concurrent.futures.Executor): Executor to calculate digests on,
+            defaults to the event loop's default executor.
+        max_pending (int): Maximum number of :meth:`add_records` calls in progress.
+        loop: Event loop to use, defaults to the running loop.
+    """
+
+    def __init__(self, writer, executor=None, max_pending=64, loop=None):
+        if not hasattr(writer, 'add_records'):
+            writer = WarcWriter(writer)
+
+        self.writer = writer
+        self.executor = executor
+        self._loop = loop
+        self._write_executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = asyncio.Semaphore(max_pending)
+        # resolved once the latest add_records call has queued its write
+        self._last_queued = None
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        return self._loop
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def add_record(self, record):
+        """Write the given Record, see :meth:`add_records`."""
+        results = await self.add_records(record)
+        return results[0]
+
+    async def add_records(self, *records):
+        """Write the given Records together.
+
+        Returns:
+            The result of the writer's ``add_records`` call (ie: the offsets of the records).
+            If that's a :class:`concurrent.futures.Future`, as it is for a
+            :class:`basc_warc.queued.QueuedWarcWriter`, its result once it's written.
+        """
+        async with self._pending:
+            # take a place in the write order before preparing, which may finish out of order
+            previous = self._last_queued
+            queued = self._last_queued = self.loop.create_future()
+            try:
+                for record in records:
+                    await self.loop.run_in_executor(self.executor, record.prepare)
+
+                if previous is not None:
+                    await previous
+                write = self.loop.run_in_executor(self._write_executor,
+                                                  self.writer.add_records, *records)
+            finally:
+                queued.set_result(None)
+
+            result = await write
+            if isinstance(result, Future):
+                result = await asyncio.wrap_future(result)
+            return result
+
+    async def add_streamed_record(self, record, body):
+        """Write a Record whose block comes from an async iterable of chunks.
+
+        The body is spooled to a temporary file (never held in memory all at once) and
+        digested as it arrives, then written as a :class:`basc_warc.FileBlock`. The
+        temporary file is closed once the record has been written.
+
+        Args:
+            record (:class:`basc_warc.Record`): Record to write, its block is replaced.
+            body: Async iterable of :class:`bytes` chunks making up the block.
+
+        Returns:
+            The result of the writer's ``add_records`` call.
+        """
+        spool = tempfile.TemporaryFile()
+        digester = utils.Digester(record.digest_algorithm, payload=record.has_http_payload())
+
+        def spool_chunk(chunk):
+            spool.write(chunk)
+            digester.update(chunk)
+
+        try:
+            pending = []
+            pending_size = 0
+            async for chunk in body:
+                pending.append(chunk)
+                pending_size += len(chunk)
+                if pending_size >= SPOOL_CHUNK_SIZE:
+                    await self.loop.run_in_executor(self.executor, spool_chunk,
+                                                    b''.join(pending))
+                    pending = []
+                    pending_size = 0
+            if pending:
+                await self.loop.run_in_executor(self.executor, spool_chunk,
+                                                b''.join(pending))
+            await self.loop.run_in_executor(self.executor, spool.flush)
+
+            record.block = FileBlock(fileobj=spool, offset=0, length=spool.tell())
+            record.block.set_digests(digester)
+
+            results = await self.add_records(record)
+        finally:
+            spool.close()
+
+        return results[0]
+
+    async def flush(self):
+        """Wait for queued writes, then flush the writer."""
+        await self.loop.run_in_executor(self._write_executor, self.writer.flush)
+
+    async def close(self):
+        """Wait for queued writes, then close the writer."""
+        await self.loop.run_in_executor(self._write_executor, self.writer.close)
+        self._write_executor.shutdown(wait=False)
+
+
+class AsyncBlock(object):
+    """Async wrapper around the block of a record read by an :class:`AsyncWarcReader`.
+
+    Args:
+        block (:class:`basc_warc.reader.StreamBlock`): Block to wrap.
+        reader (AsyncWarcReader): Reader the block was read with.
+    """
+
+    def __init__(self, block, reader):
+        self.block = block
+        self._reader = reader
+
+    def length(self):
+        """Return length in bytes."""
+        return self.block.length()
+
+    async def read(self, size=-1):
+        """Read up to ``size`` bytes from the block, or the rest of it if ``size`` is -1."""
+        return await self._reader._run(self.block.read, size)
+
+    async def chunks(self, size=CHUNK_SIZE):
+        """Asynchronously yield the rest of the block in chunks."""
+        while True:
+            chunk = await self.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class AsyncWarcReader(object):
+    """Reads records from a WARC file in coroutines.
+
+    Use ``async for record in reader``. Parsing and reading happen on a dedicated thread,
+    and each record's block is an :class:`AsyncBlock`, with ``await block.read()``.
+
+    Args:
+        fileobj: Binary file-like object to read from.
+        loop: Event loop to use, defaults to the running loop.
+    """
+
+    def __init__(self, fileobj, loop=None):
+        self.fileobj = fileobj
+        self._loop = loop
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._reader = None
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        return self._loop
+
+    def _run(self, fn, *args):
+        return self.loop.run_in_executor(self._executor, fn, *args)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        record = await self.read_record()
+        if record is None:
+            raise StopAsyncIteration
+        return record
+
+    async def read_record(self):
+        """Read the next record.
+
+        Returns:
+            The next :class:`basc_warc.Record`, or None at the end of the file.
+        """
+        if self._reader is None:
+            self._reader = await self._run(WarcReader, self.fileobj)
+
+        record = await self._run(self._reader.read_record)
+        if record is not None:
+            record.block = AsyncBlock(record.block, self)
+        return record
+
+    async def close(self):
+        """Close the underlying file object."""
+        await self._run(self.fileobj.close)
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC batch processing
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Run a task over the records of many WARC files at once, on a process pool."""
+import base64
+import binascii
+import collections
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from basc_warc import cdx, utils
+from basc_warc.reader import read_range
+
+
+class FileResult(object):
+    """Result of running a task over one WARC file, or one range of a file.
+
+    Attributes:
+        path (str): Path of the file.
+        start (int): Offset the range started at.
+        end (int): Offset the range ended at, or None for the end of the file.
+        result: What the task returned, or None if it raised an exception.
+        error (Exception): Exception the task raised, or None.
+        records (int): Number of records the task read.
+        bytes (int): Size of the range in the file.
+        seconds (float): Time spent running the task.
+    """
+
+    __slots__ = ('path', 'start', 'end', 'result', 'error', 'records', 'bytes', 'seconds')
+
+    def __init__(self, path, start=0, end=None):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.result = None
+        self.error = None
+        self.records = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return '<FileResult {} {}-{} records={} error={!r}>'.format(
+            self.path, self.start, '' if self.end is None else self.end, self.records,
+            self.error)
+
+
+def _run_task(task, path, start, end):
+    """Run a task over the records in one range of a file, in a worker process."""
+    file_result = FileResult(path, start, end)
+    started = time.time()
+
+    def counted(records):
+        for record in records:
+            file_result.records += 1
+            yield record
+
+    try:
+        file_result.bytes = (os.path.getsize(path) if end is None else end) - start
+        file_result.result = task(path, counted(read_range(path, start, end)))
+    except Exception as e:
+        file_result.error = e
+
+    file_result.seconds = time.time() - started
+
+    return file_result
+
+
+class BatchProcessor(object):
+    """Runs a task over the records of many WARC files, one file (or range) at a time.
+
+    A task is a function called as ``task(path, records)`` for each file, where
+    ``records`` iterates over the records in the file (or range). Whatever it returns
+    is sent back as the ``result`` of a :class:`basc_warc.batch.FileResult`. Tasks run
+    on a process pool, so they (and any arguments bound with
+    :func:`functools.partial`) must be picklable, ie: defined at the top level of a
+    module. See :class:`PerRecordTask` to run a function on every record instead.
+
+    Built-in tasks are :func:`count_records`, :func:`record_stats`,
+    :func:`validate_records` and :func:`cdx_file`::
+
+        processor = BatchProcessor(validate_records, jobs=8)
+        for file_result in processor.run(paths):
+            if file_result.error or file_result.result:
+                print(file_result.path, file_result.error, file_result.result)
+        print(processor.stats())
+
+    Args:
+        task (callable): Task to run on each file.
+        jobs (int): Number of worker processes, defaults to the number of CPUs. With
+            ``1``, tasks run in this process.
+        executor (concurrent.futures.Executor): Executor to run tasks on, instead of
+            creating a process pool.
+        ordered (bool): Yield results in the order files were given, rather than as
+            they finish.
+        max_pending (int): Maximum number of tasks submitted but not yet yielded,
+            defaults to four per job.
+    """
+
+    def __init__(self, task, jobs=None, executor=None, ordered=True, max_pending=None):
+        self.task = task
+        self.jobs = jobs or os.cpu_count() or 1
+        self.executor = executor
+        self.ordered = ordered
+        self.max_pending = max_pending or self.jobs * 4
+
+        self._stats_lock = threading.Lock()
+        self._started = None
+        self._stats = {
+            'files': 0,
+            'errors': 0,
+            'records': 0,
+            'bytes': 0,
+            'task_seconds': 0.0,
+        }
+
+    def _add_stats(self, file_result):
+        with self._stats_lock:
+            self._stats['files'] += 1
+            self._stats['errors'] += 1 if file_result.error is not None else 0
+            self._stats['records'] += file_result.records
+            self._stats['bytes'] += file_result.bytes
+            self._stats['task_seconds'] += file_result.seconds
+
+    def stats(self):
+        """Return a dict of counters and throughput for the files processed so far.
+
+        ``records_per_second`` and ``bytes_per_second`` are over the time since
+        :meth:`run` started, across all workers.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        seconds = time.time() - self._started if self._started is not None else 0.0
+        stats['seconds'] = seconds
+        stats['records_per_second'] = stats['records'] / seconds if seconds else 0.0
+        stats['bytes_per_second'] = stats['bytes'] / seconds if seconds else 0.0
+        return stats
+
+    def run(self, files):
+        """Run the task over the given files, yielding a result for each one.
+
+        Args:
+            files (iterable): Paths of WARC files, or ``(path, start, end)`` tuples to
+                only process the records starting in that range of a file.
+
+        Yields:
+            A :class:`basc_warc.batch.FileResult` for each file.
+        """
+        self._started = time.time()
+
+        ranges = (_as_range(item) for item in files)
+
+        if self.executor is None and self.jobs == 1:
+            for path, start, end in ranges:
+                file_result = _run_task(self.task, path, start, end)
+                self._add_stats(file_result)
+                yield file_result
+            return
+
+        executor = self.executor
+        if executor is None:
+            executor = ProcessPoolExecutor(self.jobs)
+
+        try:
+            for file_result in self._run_on(executor, ranges):
+                self._add_stats(file_result)
+                yield file_result
+        finally:
+            if self.executor is None:
+                executor.shutdown(wait=True)
+
+    def _run_on(self, executor, ranges):
+        pending = collections.deque()
+
+        for path, start, end in ranges:
+            pending.append(executor.submit(_run_task, self.task, path, start, end))
+            if len(pending) >= self.max_pending:
+                for file_result in self._finished(pending):
+                    yield file_result
+
+        while pending:
+            for file_result in self._finished(pending):
+                yield file_result
+
+    def _finished(self, pending):
+        """Yield results for the next task to finish, or the oldest task if ordered."""
+        if self.ordered:
+            yield pending.popleft().result()
+            return
+
+        done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+        pending.clear()
+        pending.extend(not_done)
+        for future in done:
+            yield future.result()
+
+
+def _as_range(item):
+    if isinstance(item, (tuple, list)):
+        path, start, end = item
+        return path, start, end
+    return item, 0, None
+
+
+def process_files(files, task, jobs=None, ordered=True):
+    """Run a task over the given WARC files, see :class:`BatchProcessor`.
+
+    Yields:
+        A :class:`basc_warc.batch.FileResult` for each file.
+    """
+    return BatchProcessor(task, jobs=jobs, ordered=ordered).run(files)
+
+
+# tasks
+class PerRecordTask(object):
+    """Task that calls a function on each record, and returns the non-None results.
+
+    Args:
+        function (callable): Called as ``function(record)`` for every record. Must be
+            picklable to run on a process pool.
+    """
+
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, path, records):
+        results = []
+        for record in records:
+            result = self.function(record)
+            if result is not None:
+                results.append(result)
+        return results
+
+
+def count_records(path, records):
+    """Task that counts records, by type, and the total size of their blocks.
+
+    Returns:
+        Dict with ``records``, ``block_bytes`` and ``types`` (a dict of record type to
+        number of records).
+    """
+    counts = {'records': 0, 'block_bytes': 0, 'types': {}}
+    types = counts['types']
+
+    for record in records:
+        counts['records'] += 1
+        counts['block_bytes'] += record.block.length()
+        types[record.record_type] = types.get(record.record_type, 0) + 1
+
+    return counts
+
+
+def _count(counts, key, size):
+    entry = counts.get(key)
+    if entry is None:
+        entry = counts[key] = {'records': 0, 'bytes': 0}
+    entry['records'] += 1
+    entry['bytes'] += size
+
+
+def record_stats(path, records):
+    """Task that counts records and block sizes by record type, MIME type and status.
+
+    MIME types are counted for ``response`` and ``resource`` records, using the HTTP
+    ``Content-Type`` of HTTP responses, and statuses are counted for HTTP responses.
+    Only the HTTP headers at the start of blocks are read.
+
+    Returns:
+        Dict with ``records`` and ``block_bytes`` totals, and ``types``, ``mime_types``
+        and ``statuses`` dicts, mapping each value to a dict of its ``records`` and
+        ``bytes``. Use :func:`add_stats` to combine the results for several files.
+    """
+    stats = {'records': 0, 'block_bytes': 0, 'types': {}, 'mime_types': {}, 'statuses': {}}
+
+    for record in records:
+        size = record.block.length()
+        stats['records'] += 1
+        stats['block_bytes'] += size
+        _count(stats['types'], record.record_type, size)
+
+        if record.record_type not in ('response', 'resource'):
+            continue
+
+        mime = record.header.fields.get('Content-Type')
+        if record.record_type == 'response' and record.has_http_payload():
+            status, headers = cdx.parse_http_header(cdx.read_http_header(record.block))
+            mime = headers.get('Content-Type') if headers is not None else None
+            _count(stats['statuses'], status or '-', size)
+
+        mime = mime.split(';', 1)[0].strip().lower() if mime else ''
+        _count(stats['mime_types'], mime or '-', size)
+
+    return stats
+
+
+def add_stats(total, stats):
+    """Add the results of :func:`record_stats` for one file to a running total.
+
+    Returns:
+        The updated total.
+    """
+    for name in ('records', 'block_bytes'):
+        total[name] = total.get(name, 0) + stats[name]
+    for name in ('types', 'mime_types', 'statuses'):
+        counts = total.setdefault(name, {})
+        for key, entry in stats[name].items():
+            if key not in counts:
+                counts[key] = {'records': 0, 'bytes': 0}
+            counts[key]['records'] += entry['records']
+            counts[key]['bytes'] += entry['bytes']
+    return total
+
+
+def _digest_bytes(value):
+    """Return the raw bytes of a base32 or hex encoded digest, or None if it's neither."""
+    try:
+        return base64.b32decode(value.upper())
+    except (binascii.Error, TypeError, ValueError):
+        pass
+    try:
+        return binascii.unhexlify(value)
+    except (binascii.Error, TypeError, ValueError):
+        return None
+
+
+def _digest_matches(expected, actual):
+    expected_algorithm, sep, expected_value = expected.partition(':')
+    actual_algorithm, sep, actual_value = actual.partition(':')
+    if expected_algorithm.lower() != actual_algorithm:
+        return False
+    return _digest_bytes(expected_value) == _digest_bytes(actual_value)
+
+
+def validate_records(path, records):
+    """Task that checks every record's block and payload digests.
+
+    Records with digests using an algorithm that isn't supported aren't checked.
+    Payload digests of ``revisit`` records and segments aren't checked, as their blocks
+    don't hold the whole payload.
+
+    Returns:
+        List of ``(offset, problem)`` tuples, empty if every record is fine.
+    """
+    problems = []
+
+    for record in records:
+        fields = record.header.fields
+        block_digest = fields.get('WARC-Block-Digest')
+        payload_digest = fields.get('WARC-Payload-Digest')
+
+        if (payload_digest is None or record.record_type in ('revisit', 'continuation') or
+                'WARC-Segment-Number' in fields or not record.has_http_payload()):
+            payload_digest = None
+        if block_digest is None and payload_digest is None:
+            continue
+
+        algorithm = (block_digest or payload_digest).partition(':')[0].lower()
+        if algorithm not in utils.DIGEST_ALGORITHMS:
+            continue
+
+        digester = utils.Digester(algorithm, payload=payload_digest is not None)
+        for chunk in record.block.chunks():
+            digester.update(chunk)
+
+        if block_digest is not None and not _digest_matches(block_digest,
+                                                            digester.block_digest()):
+            problems.append((record.offset, 'WARC-Block-Digest does not match'))
+        if payload_digest is not None and not _digest_matches(payload_digest,
+                                                              digester.payload_digest()):
+            problems.append((record.offset, 'WARC-Payload-Digest does not match'))
+
+    return problems
+
+
+def cdx_file(path, records, fields=cdx.DEFAULT_FIELDS, record_types=cdx.DEFAULT_RECORD_TYPES,
+             directory=None):
+    """Task that writes the CDX lines for a file to a temporary file, see
+    :func:`basc_warc.cdx.index_warc`.
+
+    Lines are written as they're made rather than sent back, so neither the worker nor
+    the caller holds a whole file's index in memory. Use :func:`functools.partial` to
+    pick other ``fields``, ``record_types`` or ``directory``.
+
+    Args:
+        directory (str): Directory to write the temporary file in, defaults to the
+            system's temporary directory.
+
+    Returns:
+        Path of the temporary file, holding the CDX lines without a header. The caller
+        should delete it once it's been read.
+    """
+    handle, cdx_path = tempfile.mkstemp(suffix='.cdx', dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as fileobj:
+            for line in cdx.index_records(records, os.path.basename(path), fields,
+                                          record_types):
+                fileobj.write(line.encode('utf8') + b'\n')
+    except Exception:
+        os.remove(cdx_path)
+        raise
+    return cdx_path
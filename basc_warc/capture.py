@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC HTTP capture
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Capture HTTP exchanges as request and response records."""
+import datetime
+import tempfile
+
+from basc_warc import CRLF, FileBlock, Record, RecordBlock, RecordHeader, utils
+
+SPOOL_SIZE = 1024 * 1024
+
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, int):
+        return str(value).encode('latin-1')
+    return value.encode('latin-1')
+
+
+def http_head(start_line, headers):
+    """Return the raw bytes of an HTTP message's start line and headers.
+
+    Args:
+        start_line (str or bytes): Request or status line, ie: ``'HTTP/1.1 200 OK'``.
+        headers (list of tuples or dict): Header names and values, in order.
+    """
+    if hasattr(headers, 'items'):
+        headers = headers.items()
+
+    lines = [_bytes(start_line), CRLF]
+    for name, value in headers:
+        lines.extend((_bytes(name), b': ', _bytes(value), CRLF))
+    lines.append(CRLF)
+
+    return bytes().join(lines)
+
+
+class _Spool(object):
+    """Holds data in memory until it grows past ``max_size``, then in a temporary file."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.length = 0
+        self._parts = []
+        self._file = None
+
+    def write(self, data):
+        self.length += len(data)
+        if self._file is None and self.length > self.max_size:
+            self._file = tempfile.TemporaryFile()
+            self._file.writelines(self._parts)
+            self._parts = None
+        if self._file is None:
+            self._parts.append(bytes(data))
+        else:
+            self._file.write(data)
+
+    def block(self):
+        if self._file is None:
+            return RecordBlock(bytes().join(self._parts))
+
+        self._file.flush()
+        return FileBlock(fileobj=self._file, offset=0, length=self.length)
+
+    def close(self):
+        self._parts = None
+        if self._file is not None:
+            self._file.close()
+
+
+class HttpCapture(object):
+    """Captures an HTTP exchange as a ``request`` and a ``response`` record.
+
+    The response is given as it arrives, and is never held in memory all at once.
+    Responses larger than ``spool_size`` are spooled to a temporary file. Digests are
+    calculated as the response arrives, with the payload digest calculated over the
+    de-chunked body when chunked transfer-encoding is used.
+
+    Both records are written together when :meth:`finish` is called, with the response
+    record referring to the request record with ``WARC-Concurrent-To``::
+
+        with HttpCapture(writer, url, request_bytes, ip_address=ip) as capture:
+            capture.write_response_head('HTTP/1.1 200 OK', response_headers)
+            for chunk in response_body:
+                capture.write_response(chunk)
+
+    Args:
+        writer: Writer with an ``add_records`` method, such as a
+            :class:`basc_warc.WarcWriter`.
+        url (str): Target URL of the exchange.
+        request (bytes): The raw HTTP request as sent, including any body.
+        ip_address (str): IP address of the server.
+        warcinfo_id (str): ``WARC-Record-ID`` of the warcinfo record these records
+            belong to.
+        date (datetime.datetime): When the exchange started, defaults to now.
+        spool_size (int): Maximum response size to hold in memory.
+    """
+
+    def __init__(self, writer, url, request, ip_address=None, warcinfo_id=None,
+                 date=None, spool_size=SPOOL_SIZE):
+        self.writer = writer
+        self.url = url
+        self.request = _bytes(request)
+        self.ip_address = ip_address
+        self.warcinfo_id = warcinfo_id
+        self.date = date or datetime.datetime.utcnow()
+        self.finished = False
+        self.result = None
+
+        self._spool = _Spool(spool_size)
+        self._digester = utils.Digester(payload=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.close()
+
+    def write_response_head(self, status_line, headers):
+        """Write the status line and headers of the response.
+
+        Args:
+            status_line (str or bytes): Status line, ie: ``'HTTP/1.1 200 OK'``.
+            headers (list of tuples or dict): Header names and values, as received.
+        """
+        self.write_response(http_head(status_line, headers))
+
+    def write_response(self, data):
+        """Write the next part of the raw response, as received.
+
+        Args:
+            data (bytes): Raw response data, including transfer-encoding if any.
+        """
+        self._digester.update(data)
+        self._spool.write(data)
+
+    def _header(self, msgtype):
+        header = RecordHeader({
+            'WARC-Record-ID': utils.uuid_urn(),
+            'WARC-Date': self.date,
+            'WARC-Target-URI': self.url,
+            'Content-Type': 'application/http;msgtype={}'.format(msgtype),
+        })
+        if self.ip_address:
+            header.set_field('WARC-IP-Address', self.ip_address)
+        if self.warcinfo_id:
+            header.set_field('WARC-Warcinfo-ID', self.warcinfo_id)
+        return header
+
+    def records(self):
+        """Return the ``(request, response)`` records for this exchange."""
+        request = Record('request', header=self._header('request'),
+                         block=RecordBlock(self.request))
+
+        response_header = self._header('response')
+        response_header.set_field('WARC-Concurrent-To', request.header.record_id)
+        response = Record('response', header=response_header, block=self._spool.block())
+        response.set_digests(self._digester)
+
+        return request, response
+
+    def finish(self):
+        """Write the request and response records.
+
+        A spooled response's temporary file is closed once the records are written. For
+        writers that queue records and return a :class:`concurrent.futures.Future`, such
+        as a :class:`basc_warc.queued.QueuedWarcWriter`, that's when the future is done.
+
+        Returns:
+            The result of the writer's ``add_records`` call.
+        """
+        if self.finished:
+            raise ValueError('Capture has already been finished')
+        self.finished = True
+
+        try:
+            self.result = self.writer.add_records(*self.records())
+        except Exception:
+            self.close()
+            raise
+
+        if hasattr(self.result, 'add_done_callback'):
+            self.result.add_done_callback(lambda future: self.close())
+        else:
+            self.close()
+        return self.result
+
+    def close(self):
+        """Release the spooled response data.
+
+        :meth:`finish` calls this once the records are written, so it only needs to be
+        called directly to discard a capture without writing records.
+        """
+        self._spool.close()
+
+
+def capture_exchange(writer, url, request, status_line, headers, body, **kwargs):
+    """Write an HTTP exchange whose response body is an iterable of chunks.
+
+    Args:
+        writer: Writer with an ``add_records`` method.
+        url (str): Target URL of the exchange.
+        request (bytes): The raw HTTP request as sent.
+        status_line (str or bytes): Response status line.
+        headers (list of tuples or dict): Response headers, as received.
+        body (iterable of bytes): Raw response body chunks, as received.
+        kwargs: Other arguments for :class:`HttpCapture`.
+
+    Returns:
+        The result of the writer's ``add_records`` call.
+    """
+    with HttpCapture(writer, url, request, **kwargs) as capture:
+        capture.write_response_head(status_line, headers)
+        for chunk in body:
+            capture.write_response(chunk)
+    return capture.result
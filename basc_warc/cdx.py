@@ -0,0 +1,578 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC CDX indexes
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Create and query CDX indexes of WARC files."""
+import datetime
+import heapq
+import mmap
+import os
+import re
+import tempfile
+
+from basc_warc import utils
+from basc_warc.reader import WarcReader
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+DEFAULT_FIELDS = 'a b a m s k r M V g u'
+SORTED_FIELDS = 'N b a m s k r M S V g'
+DEFAULT_RECORD_TYPES = ('response', 'revisit')
+HTTP_HEADER_LIMIT = 64 * 1024
+SORT_BUFFER_LINES = 1000000
+MAX_MERGE_FILES = 256
+
+_NON_DIGITS = re.compile(r'\D')
+
+
+# url canonicalization
+def surt(url):
+    """Return the SURT (Sort-friendly URI Reordering Transform) form of a URL.
+
+    The URL is canonicalized so that equivalent URLs sort together, and the host is
+    reversed, ie: ``http://www.Example.com/b?y=2&x=1`` becomes ``com,example)/b?x=1&y=2``.
+    URLs that aren't HTTP(S) are only lowercased.
+    """
+    if isinstance(url, bytes):
+        url = url.decode('utf8', 'replace')
+    url = url.strip()
+
+    parts = urlsplit(url)
+    if parts.scheme.lower() not in ('http', 'https') or not parts.hostname:
+        return url.lower()
+
+    host = parts.hostname.strip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    host = ','.join(reversed(host.split('.')))
+    if port and port not in (80, 443):
+        host += ':{}'.format(port)
+
+    path = parts.path or '/'
+    query = '&'.join(sorted(parts.query.split('&'))) if parts.query else ''
+
+    key = host + ')' + path
+    if query:
+        key += '?' + query
+    return key.lower()
+
+
+# field values
+def parse_http_header(data):
+    """Parse the status and headers from the start of an HTTP message.
+
+    Args:
+        data (bytes): The start of the HTTP message, including at least its headers.
+
+    Returns:
+        Tuple of ``(status, headers)``, where ``status`` is the response status code
+        (or None for requests) and ``headers`` is a
+        :class:`basc_warc.utils.CaseInsensitiveDict`. Returns ``(None, None)`` if the
+        headers are incomplete.
+    """
+    end = data.find(b'\r\n\r\n')
+    if end == -1:
+        end = data.find(b'\n\n')
+        if end == -1:
+            return None, None
+
+    lines = bytes(data[:end]).decode('latin-1').splitlines()
+    status = None
+    if lines and lines[0].startswith('HTTP/'):
+        parts = lines[0].split(None, 2)
+        if len(parts) > 1:
+            status = parts[1]
+
+    headers = utils.CaseInsensitiveDict()
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip()] = value.strip()
+
+    return status, headers
+
+
+def cdx_timestamp(date):
+    """Return a 14-digit CDX timestamp for the given ``WARC-Date`` value."""
+    if isinstance(date, datetime.datetime):
+        date = utils.datetime_to_ts(date)
+    elif isinstance(date, bytes):
+        date = date.decode('utf8')
+    return _NON_DIGITS.sub('', date)[:14] or '-'
+
+
+def _text(value):
+    if value is None or value == '':
+        return '-'
+    if isinstance(value, bytes):
+        value = value.decode('utf8', 'replace')
+    return str(value).replace(' ', '%20')
+
+
+def record_fields(record, offset, length=None, filename=None, http_header=None,
+                  digest=None):
+    """Return the CDX field values for a record, keyed by CDX field letter.
+
+    Args:
+        record (:class:`basc_warc.Record`): The record.
+        offset (int): Offset of the record (or its gzip member) in the WARC file.
+        length (int): Length of the record (or its gzip member) in the WARC file.
+        filename (str): Name of the WARC file.
+        http_header (bytes): Start of the record's block, used to find the HTTP status
+            and content type of HTTP records.
+        digest (str): Payload digest, if not given in the record's header.
+    """
+    fields = record.header.fields
+
+    status = None
+    mime = fields.get('Content-Type')
+    redirect = None
+
+    if http_header is not None and record.has_http_payload():
+        status, headers = parse_http_header(http_header)
+        if headers is not None:
+            mime = headers.get('Content-Type')
+            if status is not None and status.startswith('3'):
+                redirect = headers.get('Location')
+
+    if record.record_type == 'revisit':
+        mime = 'warc/revisit'
+    elif mime:
+        if isinstance(mime, bytes):
+            mime = mime.decode('utf8', 'replace')
+        mime = mime.split(';', 1)[0].strip().lower()
+
+    if digest is None:
+        digest = fields.get('WARC-Payload-Digest') or fields.get('WARC-Block-Digest')
+    if isinstance(digest, bytes):
+        digest = digest.decode('utf8')
+    if digest and ':' in digest:
+        digest = digest.split(':', 1)[1]
+
+    url = _text(fields.get('WARC-Target-URI'))
+
+    return {
+        'N': _text(surt(url)) if url != '-' else '-',
+        'a': url,
+        'b': cdx_timestamp(fields.get('WARC-Date', '')),
+        'm': _text(mime),
+        's': _text(status),
+        'k': _text(digest),
+        'r': _text(redirect),
+        'M': '-',
+        'V': _text(offset),
+        'S': _text(length),
+        'g': _text(filename),
+        'u': _text(fields.get('WARC-Record-ID')),
+    }
+
+
+def format_line(values, fields=DEFAULT_FIELDS):
+    """Return a CDX line for the given field values, in the given field order."""
+    return ' '.join(values.get(field, '-') for field in fields.split())
+
+
+def format_header(fields=DEFAULT_FIELDS):
+    """Return the header line of a CDX file with the given fields."""
+    return ' CDX ' + fields
+
+
+def _http_header_of(block):
+    """Return the start of a block, enough to hold its HTTP headers."""
+    if hasattr(block, 'write_to'):
+        # file-backed, only read the start of it
+        return next(iter(block.chunks(HTTP_HEADER_LIMIT)), b'')
+    return block.bytes()[:HTTP_HEADER_LIMIT]
+
+
+def read_http_header(block):
+    """Read the start of a block being read from a file, enough to hold its HTTP headers.
+
+    The rest of the block can still be read afterwards, see
+    :class:`basc_warc.reader.StreamBlock`.
+
+    Returns:
+        The bytes read.
+    """
+    http_header = bytes()
+    while len(http_header) < HTTP_HEADER_LIMIT and b'\r\n\r\n' not in http_header:
+        data = block.read(8192)
+        if not data:
+            break
+        http_header += data
+    return http_header
+
+
+# indexing
+class CdxWriter(object):
+    """Writes CDX lines for records as they're written to a WARC file.
+
+    Pass :meth:`add_record` as the ``on_write`` callback of a
+    :class:`basc_warc.WarcWriter` to index records while they are written, using the
+    offsets and digests the writer already knows::
+
+        cdx = CdxWriter(cdx_file, 'example.warc.gz')
+        writer = WarcWriter(warc_file, compress_records=True, on_write=cdx.add_record)
+
+    Args:
+        fileobj: Binary file-like object to write CDX lines to.
+        filename (str): Name of the WARC file being indexed.
+        fields (str): CDX fields to write, such as ``'a b a m s k r M V g u'``.
+        record_types (list of str): Types of records to index.
+        header (bool): Whether to write the CDX header line first.
+    """
+
+    def __init__(self, fileobj, filename, fields=DEFAULT_FIELDS,
+                 record_types=DEFAULT_RECORD_TYPES, header=True):
+        self.fileobj = fileobj
+        self.filename = filename
+        self.fields = fields
+        self.record_types = record_types
+
+        if header:
+            self.write_line(format_header(fields))
+
+    def write_line(self, line):
+        """Write a single CDX line."""
+        self.fileobj.write(line.encode('utf8') + b'\n')
+
+    def add_record(self, record, offset, length=None):
+        """Index the given record, written at the given offset.
+
+        Args:
+            record (:class:`basc_warc.Record`): The record.
+            offset (int): Offset of the record (or its gzip member) in the WARC file.
+            length (int): Length of the record (or its gzip member) in the WARC file.
+
+        Returns:
+            The CDX line written, or None if this type of record isn't indexed.
+        """
+        if record.record_type not in self.record_types:
+            return None
+
+        values = record_fields(record, offset, length, self.filename,
+                               http_header=_http_header_of(record.block))
+        line = format_line(values, self.fields)
+        self.write_line(line)
+        return line
+
+
+def index_warc(fileobj, filename, fields=DEFAULT_FIELDS, record_types=DEFAULT_RECORD_TYPES):
+    """Yield CDX lines for the records in a WARC file, in a single streaming pass.
+
+    Blocks are only read as far as their HTTP headers, unless a record has no payload
+    digest in its header and one needs to be calculated.
+
+    Args:
+        fileobj: Binary file-like object of the WARC file to index.
+        filename (str): Name of the WARC file.
+        fields (str): CDX fields to return.
+        record_types (list of str): Types of records to index.
+    """
+    return index_records(WarcReader(fileobj), filename, fields, record_types)
+
+
+def index_records(records, filename, fields=DEFAULT_FIELDS,
+                  record_types=DEFAULT_RECORD_TYPES):
+    """Yield CDX lines for records as they're read by a :class:`basc_warc.reader.WarcReader`.
+
+    See :func:`index_warc`.
+
+    Args:
+        records (iterator of :class:`basc_warc.Record`): Records being read.
+        filename (str): Name of the WARC file.
+        fields (str): CDX fields to return.
+        record_types (list of str): Types of records to index.
+    """
+    # lengths are only known once we've moved on to the next record
+    pending = None
+
+    for record in records:
+        if pending is not None:
+            pending[0]['S'] = _text(pending[1].length)
+            yield format_line(pending[0], fields)
+            pending = None
+
+        if record.record_type not in record_types:
+            continue
+
+        is_http = record.has_http_payload()
+        http_header = read_http_header(record.block) if is_http else None
+
+        digest = None
+        if is_http:
+            known_digest = record.header.fields.get('WARC-Payload-Digest')
+        else:
+            known_digest = record.header.fields.get('WARC-Block-Digest')
+        if not known_digest:
+            digester = utils.Digester(record.digest_algorithm, payload=is_http)
+            if http_header:
+                digester.update(http_header)
+            for chunk in record.block.chunks():
+                digester.update(chunk)
+            digest = digester.payload_digest() or digester.block_digest()
+
+        values = record_fields(record, record.offset, None, filename,
+                               http_header=http_header, digest=digest)
+        pending = (values, record)
+
+    if pending is not None:
+        pending[0]['S'] = _text(pending[1].length)
+        yield format_line(pending[0], fields)
+
+
+def write_cdx(fileobj, cdx_fileobj, filename, fields=DEFAULT_FIELDS,
+              record_types=DEFAULT_RECORD_TYPES):
+    """Write a CDX file for the given WARC file.
+
+    Args:
+        fileobj: Binary file-like object of the WARC file to index.
+        cdx_fileobj: Binary file-like object to write the CDX file to.
+        filename (str): Name of the WARC file.
+        fields (str): CDX fields to write.
+        record_types (list of str): Types of records to index.
+
+    Returns:
+        Number of records indexed.
+    """
+    writer = CdxWriter(cdx_fileobj, filename, fields, record_types)
+    count = 0
+    for line in index_warc(fileobj, filename, fields, record_types):
+        writer.write_line(line)
+        count += 1
+    return count
+
+
+# sorted indexes
+def _cdx_lines(fileobj):
+    """Yield the lines of a CDX file as bytes, skipping the header."""
+    for line in fileobj:
+        if not line.startswith(b' CDX') and line.strip():
+            yield line if line.endswith(b'\n') else line + b'\n'
+
+
+def _merge_to(inputs, out_fileobj):
+    for line in heapq.merge(*inputs):
+        out_fileobj.write(line)
+
+
+def sort_cdx(lines, out_fileobj, fields=SORTED_FIELDS, max_lines=SORT_BUFFER_LINES):
+    """Write the given CDX lines out in sorted order, with a header.
+
+    Sorting is done in runs of ``max_lines`` lines, which are written to temporary
+    files and then merged, so memory use is bounded no matter how many lines there are.
+
+    Args:
+        lines (iterable of bytes or str): CDX lines to sort.
+        out_fileobj: Binary file-like object to write the sorted CDX file to.
+        fields (str): CDX fields of the lines, for the header.
+        max_lines (int): Maximum number of lines to sort in memory at once.
+    """
+    out_fileobj.write(format_header(fields).encode('utf8') + b'\n')
+
+    runs = []
+    buffer = []
+    try:
+        for line in lines:
+            if not isinstance(line, bytes):
+                line = line.encode('utf8')
+            if not line.endswith(b'\n'):
+                line += b'\n'
+            buffer.append(line)
+
+            if len(buffer) >= max_lines:
+                buffer.sort()
+                run = tempfile.TemporaryFile()
+                run.writelines(buffer)
+                run.seek(0)
+                runs.append(run)
+                buffer = []
+
+        buffer.sort()
+        if not runs:
+            out_fileobj.writelines(buffer)
+            return
+
+        _merge_to([iter(buffer)] + runs, out_fileobj)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def merge_cdx(paths, out_fileobj, fields=SORTED_FIELDS, max_files=MAX_MERGE_FILES):
+    """Merge many sorted CDX files into one sorted CDX file.
+
+    This is a k-way merge that only holds one line from each file in memory. If there
+    are more than ``max_files`` files, they are merged in batches into temporary files
+    first, to stay under open file limits.
+
+    Args:
+        paths (list of str): Paths of the sorted CDX files to merge.
+        out_fileobj: Binary file-like object to write the merged CDX file to.
+        fields (str): CDX fields of the files, for the header.
+        max_files (int): Maximum number of files to have open at once.
+    """
+    paths = list(paths)
+    temp_paths = []
+
+    try:
+        while len(paths) > max_files:
+            batch, paths = paths[:max_files], paths[max_files:]
+            handle, temp_path = tempfile.mkstemp(suffix='.cdx')
+            with os.fdopen(handle, 'wb') as temp_file:
+                _merge_paths(batch, temp_file)
+            temp_paths.append(temp_path)
+            paths.append(temp_path)
+
+        out_fileobj.write(format_header(fields).encode('utf8') + b'\n')
+        _merge_paths(paths, out_fileobj)
+    finally:
+        for temp_path in temp_paths:
+            os.remove(temp_path)
+
+
+def _merge_paths(paths, out_fileobj):
+    files = [open(path, 'rb') for path in paths]
+    try:
+        _merge_to([_cdx_lines(fileobj) for fileobj in files], out_fileobj)
+    finally:
+        for fileobj in files:
+            fileobj.close()
+
+
+class CdxIndex(object):
+    """Fast lookups in a sorted CDX file.
+
+    The file is memory-mapped and searched with a binary search, so lookups only touch
+    a handful of pages no matter how large the index is. Lines must start with the
+    SURT of their URL followed by their timestamp, as with :data:`SORTED_FIELDS`.
+
+    Args:
+        path (str): Path of the sorted CDX file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fileobj:
+            self.map = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the index file."""
+        self.map.close()
+
+    def _line_start(self, offset):
+        """Return the offset of the first line starting at or after ``offset``."""
+        if offset == 0:
+            return 0
+        end = self.map.find(b'\n', offset - 1)
+        return len(self.map) if end == -1 else end + 1
+
+    def _bisect(self, key):
+        """Return the offset of the first line that sorts at or after ``key``."""
+        lo = 0
+        hi = len(self.map)
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._line_start(mid)
+            if start >= hi:
+                hi = mid
+                continue
+            end = self.map.find(b'\n', start)
+            if end == -1:
+                end = len(self.map)
+            if self.map[start:end] < key:
+                lo = end + 1
+            else:
+                hi = mid
+
+        return self._line_start(lo)
+
+    def _lines_from(self, offset):
+        size = len(self.map)
+        while offset < size:
+            end = self.map.find(b'\n', offset)
+            if end == -1:
+                end = size
+            yield self.map[offset:end]
+            offset = end + 1
+
+    def lookup(self, url, match='exact', from_ts=None, to_ts=None):
+        """Yield the CDX lines for a URL, in timestamp order.
+
+        Args:
+            url (str): URL to look up.
+            match (str): ``'exact'`` for captures of just this URL, or ``'prefix'`` for
+                captures of every URL that starts with it.
+            from_ts (str): Only return captures from this timestamp (inclusive).
+            to_ts (str): Only return captures up to this timestamp (inclusive).
+
+        Returns:
+            CDX lines as :class:`str`.
+        """
+        key = surt(url)
+        if match == 'prefix':
+            prefix = key.encode('utf8')
+            start = prefix
+        elif match == 'exact':
+            prefix = key.encode('utf8') + b' '
+            start = prefix + (from_ts.encode('utf8') if from_ts else b'')
+        else:
+            raise ValueError('Unknown match type: {}'.format(match))
+
+        for line in self._lines_from(self._bisect(start)):
+            if not line.startswith(prefix):
+                break
+
+            timestamp = line.split(b' ', 2)[1].decode('utf8')
+            if from_ts and timestamp < from_ts:
+                continue
+            if to_ts and timestamp[:len(to_ts)] > to_ts:
+                if match == 'exact':
+                    break
+                continue
+
+            yield line.decode('utf8')
+
+    def closest(self, url, timestamp):
+        """Return the CDX line for the capture of a URL closest to the given timestamp.
+
+        Args:
+            url (str): URL to look up.
+            timestamp (str): 14-digit timestamp, ie: ``'20150923013330'``.
+
+        Returns:
+            The closest CDX line as :class:`str`, or None if the URL isn't indexed.
+        """
+        target = int(timestamp.ljust(14, '0')[:14])
+        best = None
+        best_distance = None
+
+        for line in self.lookup(url):
+            distance = abs(int(line.split(' ', 2)[1]) - target)
+            if best is None or distance < best_distance:
+                best = line
+                best_distance = distance
+            elif distance > best_distance:
+                break
+
+        return best
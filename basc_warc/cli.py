@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC command-line tool
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""The ``basc-warc`` command-line tool.
+
+Usage: basc-warc {index,cat,extract,stats} [options] FILE...
+"""
+import argparse
+import errno
+import functools
+import json
+import os
+import shutil
+import sys
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+from basc_warc import CRLF, cdx, utils
+from basc_warc.batch import BatchProcessor, add_stats, cdx_file, record_stats
+from basc_warc.query import Query, query_warc
+
+# longest file name used when extracting payloads
+MAX_FILENAME_LENGTH = 200
+
+
+def _binary_stdout():
+    return getattr(sys.stdout, 'buffer', sys.stdout)
+
+
+def _error(message):
+    sys.stderr.write('basc-warc: {}\n'.format(message))
+
+
+def _query(args, record_types=None):
+    """Return a :class:`basc_warc.query.Query` for the filter options given."""
+    return Query(record_types=args.type or record_types, urls=args.url,
+                 url_prefixes=args.url_prefix, content_types=args.content_type,
+                 date_from=args.date_from, date_to=args.date_to)
+
+
+def _run(task, args):
+    """Run a task over every file, yielding the result for each one in order."""
+    processor = BatchProcessor(task, jobs=args.jobs)
+    for file_result in processor.run(args.files):
+        if file_result.error is not None:
+            _error('{}: {}'.format(file_result.path, file_result.error))
+            args.failed = True
+            continue
+        yield file_result
+
+
+# commands
+def index_command(args, out):
+    """Write a CDX index of every file."""
+    task = functools.partial(cdx_file, fields=args.fields,
+                             record_types=tuple(args.type or cdx.DEFAULT_RECORD_TYPES))
+
+    out.write(cdx.format_header(args.fields).encode('utf8') + b'\n')
+    for file_result in _run(task, args):
+        try:
+            with open(file_result.result, 'rb') as fileobj:
+                shutil.copyfileobj(fileobj, out)
+        finally:
+            os.remove(file_result.result)
+
+
+def cat_command(args, out):
+    """Write the header of every matching record."""
+    query = _query(args)
+    for path in args.files:
+        for record in query_warc(path, query):
+            out.write(record.header.bytes() + CRLF)
+
+
+def _extract_path(directory, url):
+    base = os.path.join(directory, quote(url, safe='')[:MAX_FILENAME_LENGTH] or '-')
+    path = base
+    number = 0
+    while os.path.exists(path):
+        number += 1
+        path = '{}.{}'.format(base, number)
+    return path
+
+
+def _write_payload(record, fileobj):
+    if hasattr(record.block, 'chunks'):
+        chunks = record.block.chunks()
+    else:
+        chunks = [record.block.bytes()]
+    if record.has_http_payload():
+        chunks = utils.http_payload(chunks)
+    for chunk in chunks:
+        fileobj.write(chunk)
+
+
+def extract_command(args, out):
+    """Write the payload of the first matching record, or of each one to a directory."""
+    query = _query(args, record_types=['response', 'resource'])
+    for path in args.files:
+        for record in query_warc(path, query):
+            if args.directory is None:
+                _write_payload(record, out)
+                return
+
+            url = record.header.fields.get('WARC-Target-URI') or ''
+            with open(_extract_path(args.directory, url.strip('<>')), 'wb') as fileobj:
+                _write_payload(record, fileobj)
+
+
+def _format_counts(title, counts):
+    lines = [title]
+    for key, entry in sorted(counts.items(), key=lambda item: (-item[1]['records'], item[0])):
+        lines.append('  {:<40} {:>12} {:>16}'.format(key, entry['records'], entry['bytes']))
+    return lines
+
+
+def stats_command(args, out):
+    """Write the number and size of records by type, MIME type and status."""
+    total = {'records': 0, 'block_bytes': 0, 'types': {}, 'mime_types': {}, 'statuses': {}}
+    for file_result in _run(record_stats, args):
+        add_stats(total, file_result.result)
+
+    if args.json:
+        out.write(json.dumps(total, indent=2, sort_keys=True).encode('utf8') + b'\n')
+        return
+
+    lines = ['records: {}'.format(total['records']),
+             'block bytes: {}'.format(total['block_bytes']),
+             '{:<42} {:>12} {:>16}'.format('', 'records', 'bytes')]
+    lines += _format_counts('types:', total['types'])
+    lines += _format_counts('MIME types:', total['mime_types'])
+    lines += _format_counts('statuses:', total['statuses'])
+    out.write('\n'.join(lines).encode('utf8') + b'\n')
+
+
+# arguments
+def _add_filters(parser):
+    group = parser.add_argument_group('filters')
+    group.add_argument('--type', action='append', metavar='TYPE',
+                       help='only records of this WARC-Type (can be repeated)')
+    group.add_argument('--url', action='append',
+                       help='only records with this WARC-Target-URI (can be repeated)')
+    group.add_argument('--url-prefix', action='append', metavar='PREFIX',
+                       help='only records whose WARC-Target-URI starts with this')
+    group.add_argument('--content-type', action='append', metavar='TYPE',
+                       help='only records whose content type starts with this')
+    group.add_argument('--from', dest='date_from', metavar='DATE',
+                       help='only records with a WARC-Date at or after this timestamp')
+    group.add_argument('--to', dest='date_to', metavar='DATE',
+                       help='only records with a WARC-Date before this timestamp')
+
+
+def _jobs(value):
+    jobs = int(value)
+    if jobs < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return jobs
+
+
+def make_parser():
+    """Return the :class:`argparse.ArgumentParser` for the ``basc-warc`` command."""
+    parser = argparse.ArgumentParser(
+        prog='basc-warc', description='Read, index and extract from WARC files.')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    index = commands.add_parser('index', help='write a CDX index of the files')
+    index.add_argument('--fields', default=cdx.DEFAULT_FIELDS,
+                       help="CDX fields to write (default: '%(default)s')")
+    index.add_argument('--type', action='append', metavar='TYPE',
+                       help='types of records to index (default: response and revisit)')
+    index.add_argument('-j', '--jobs', type=_jobs, default=1,
+                       help='number of files to index at once')
+    index.set_defaults(function=index_command)
+
+    cat = commands.add_parser('cat', help='write the headers of the records')
+    _add_filters(cat)
+    cat.set_defaults(function=cat_command)
+
+    extract = commands.add_parser(
+        'extract', help='write the payload of the first matching response or resource')
+    _add_filters(extract)
+    extract.add_argument('-d', '--directory',
+                         help='write the payload of every matching record to a file here, '
+                              'named after its URL')
+    extract.set_defaults(function=extract_command)
+
+    stats = commands.add_parser(
+        'stats', help='count records and their sizes by type, MIME type and status')
+    stats.add_argument('--json', action='store_true', help='write the counts as JSON')
+    stats.add_argument('-j', '--jobs', type=_jobs, default=1,
+                       help='number of files to read at once')
+    stats.set_defaults(function=stats_command)
+
+    for command in (index, cat, extract, stats):
+        command.add_argument('-o', '--output', help='file to write to, instead of stdout')
+        command.add_argument('files', nargs='+', metavar='FILE', help='WARC files to read')
+
+    return parser
+
+
+def main(argv=None):
+    """Run the ``basc-warc`` command, and return its exit status."""
+    args = make_parser().parse_args(argv)
+    args.failed = False
+
+    if getattr(args, 'directory', None) is not None and not os.path.isdir(args.directory):
+        os.makedirs(args.directory)
+
+    out = open(args.output, 'wb') if args.output else _binary_stdout()
+    try:
+        args.function(args, out)
+    except (IOError, OSError) as e:
+        if e.errno == errno.EPIPE:
+            return 1
+        _error(e)
+        return 1
+    except ValueError as e:
+        _error(e)
+        return 1
+    finally:
+        if args.output:
+            out.close()
+        else:
+            try:
+                out.flush()
+            except (IOError, OSError):
+                pass
+
+    return 1 if args.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
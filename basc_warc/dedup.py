@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC deduplication
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Write revisit records in place of responses whose payload has already been stored."""
+import collections
+import hashlib
+import math
+import sqlite3
+import struct
+import threading
+
+from basc_warc import CHUNK_SIZE, Record, RecordBlock, RecordHeader, utils
+
+# revisits are written as WARC/1.1 records, the first version with WARC-Refers-To-Target-URI
+# and WARC-Refers-To-Date
+REVISIT_VERSION = b'WARC/1.1'
+REVISIT_PROFILE = 'http://netpreserve.org/warc/1.1/revisit/identical-payload-digest'
+
+# where a payload was first stored
+DigestEntry = collections.namedtuple('DigestEntry', ('record_id', 'uri', 'date'))
+
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value
+    return utils.writable_field_value(value).decode('utf8')
+
+
+class BloomFilter(object):
+    """Set of strings that may have false positives, but never false negatives.
+
+    Args:
+        capacity (int): Number of items the filter is sized for.
+        error_rate (float): False positive rate once ``capacity`` items are added.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _indexes(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf8')
+        first, second = struct.unpack('<QQ', hashlib.md5(key).digest())
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, key):
+        """Add the given string to the filter."""
+        for index in self._indexes(key):
+            self._bits[index >> 3] |= 1 << (index & 7)
+
+    def __contains__(self, key):
+        for index in self._indexes(key):
+            if not self._bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+
+class DigestIndex(object):
+    """Persistent index of payload digests, and the records that first stored them.
+
+    Entries are kept in an SQLite database. Lookups first check a Bloom filter, so
+    payloads that have never been seen (the usual case) don't touch the database, and
+    then a cache of recently used entries.
+
+    New entries are committed in batches of ``commit_every``, and on :meth:`flush` and
+    :meth:`close`. Entries lost in a crash only mean those payloads are stored again.
+
+    Args:
+        path (str): Path of the SQLite database, created if it doesn't exist.
+        cache_size (int): Number of recently used entries to keep in memory.
+        bloom_capacity (int): Expected number of entries, used to size the Bloom filter.
+        commit_every (int): Number of new entries to add between commits.
+    """
+
+    def __init__(self, path, cache_size=10000, bloom_capacity=1000000, commit_every=1000):
+        self.path = path
+        self.cache_size = cache_size
+        self.commit_every = commit_every
+
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()
+        self._uncommitted = 0
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS digests ('
+                         'digest TEXT PRIMARY KEY, record_id TEXT, uri TEXT, date TEXT)')
+        self._db.commit()
+
+        count = self._db.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+        self._bloom = BloomFilter(max(bloom_capacity, count * 2))
+        for (digest,) in self._db.execute('SELECT digest FROM digests'):
+            self._bloom.add(digest)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+
+    def _remember(self, digest, entry):
+        self._cache[digest] = entry
+        self._cache.move_to_end(digest)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def lookup(self, digest):
+        """Return the :class:`DigestEntry` for the given payload digest, or None.
+
+        Args:
+            digest (str): Payload digest, ie: ``'sha1:...'``.
+        """
+        digest = _text(digest)
+        if digest not in self._bloom:
+            return None
+
+        with self._lock:
+            entry = self._cache.get(digest)
+            if entry is None:
+                row = self._db.execute('SELECT record_id, uri, date FROM digests '
+                                       'WHERE digest = ?', (digest,)).fetchone()
+                if row is None:
+                    return None
+                entry = DigestEntry(*row)
+            self._remember(digest, entry)
+
+        return entry
+
+    def add(self, digest, record_id, uri, date):
+        """Record that the payload with the given digest is stored in the given record.
+
+        Digests that are already in the index keep their original entry.
+
+        Args:
+            digest (str): Payload digest, ie: ``'sha1:...'``.
+            record_id (str): ``WARC-Record-ID`` of the record storing the payload.
+            uri (str): ``WARC-Target-URI`` of the record.
+            date (str or datetime.datetime): ``WARC-Date`` of the record.
+        """
+        digest = _text(digest)
+        entry = DigestEntry(_text(record_id), _text(uri), _text(date))
+
+        with self._lock:
+            cursor = self._db.execute('INSERT OR IGNORE INTO digests VALUES (?, ?, ?, ?)',
+                                      (digest,) + tuple(entry))
+            if cursor.rowcount:
+                self._bloom.add(digest)
+                self._remember(digest, entry)
+                self._uncommitted += 1
+                if self._uncommitted >= self.commit_every:
+                    self._commit()
+
+    def _commit(self):
+        self._db.commit()
+        self._uncommitted = 0
+
+    def flush(self):
+        """Commit new entries to the database."""
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        """Commit new entries and close the database."""
+        with self._lock:
+            self._commit()
+            self._db.close()
+
+
+def http_head_of(block):
+    """Return the HTTP status line and headers at the start of a block."""
+    if hasattr(block, 'chunks'):
+        head = bytes()
+        for chunk in block.chunks(CHUNK_SIZE):
+            head += bytes(chunk)
+            if b'\r\n\r\n' in head or len(head) > utils.MAX_HTTP_HEADER:
+                break
+    else:
+        head = block.bytes()
+
+    end = head.find(b'\r\n\r\n')
+    if end == -1:
+        return head[:utils.MAX_HTTP_HEADER]
+    return head[:end + 4]
+
+
+def revisit_record(record, entry):
+    """Return a revisit record to write in place of the given response record.
+
+    The revisit keeps the response's header fields and HTTP headers, and refers to the
+    record that stored the identical payload. It's a ``WARC/1.1`` record using the
+    WARC 1.1 ``identical-payload-digest`` profile, because ``WARC-Refers-To-Target-URI``
+    and ``WARC-Refers-To-Date`` were added in WARC 1.1.
+
+    Args:
+        record (:class:`basc_warc.Record`): Response record, with its digests prepared.
+        entry (:class:`DigestEntry`): Where the payload was first stored.
+    """
+    header = RecordHeader(record.header.fields, warc_version=REVISIT_VERSION)
+    for name in ('WARC-Block-Digest', 'Content-Length'):
+        if name in header.fields:
+            del header.fields[name]
+
+    header.set_field('WARC-Profile', REVISIT_PROFILE)
+    header.set_field('WARC-Truncated', 'length')
+    if entry.record_id:
+        header.set_field('WARC-Refers-To', entry.record_id)
+    if entry.uri:
+        header.set_field('WARC-Refers-To-Target-URI', entry.uri)
+    if entry.date:
+        header.set_field('WARC-Refers-To-Date', entry.date)
+
+    return Record('revisit', header=header, block=RecordBlock(http_head_of(record.block)),
+                  digest_algorithm=record.digest_algorithm)
+
+
+class DedupWarcWriter(object):
+    """Writes revisit records in place of responses whose payload is already stored.
+
+    Each response record's ``WARC-Payload-Digest`` is looked up in a
+    :class:`DigestIndex`. If it's there, a revisit record referring to the original is
+    written instead of the full response. Otherwise the response is written and added
+    to the index. Other records are written as they are.
+
+    Works with any writer that has an ``add_records`` method::
+
+        with DigestIndex('dedup.sqlite') as index:
+            writer = DedupWarcWriter(WarcWriter(warc_file, compress_records=True), index)
+            writer.add_records(request, response)
+
+    Args:
+        writer: Writer to write records with.
+        index (:class:`DigestIndex`): Index of stored payloads.
+        min_length (int): Responses with smaller blocks than this are always written in
+            full, as a revisit record wouldn't save much.
+    """
+
+    def __init__(self, writer, index, min_length=0):
+        self.writer = writer
+        self.index = index
+        self.min_length = min_length
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'responses': 0,
+            'revisits': 0,
+            'bytes_saved': 0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_record(self, record):
+        """Write the given Record, see :meth:`add_records`."""
+        return self.add_records(record)
+
+    def add_records(self, *records):
+        """Write the given Records, replacing duplicate responses with revisits.
+
+        Args:
+            records (list of :class:`basc_warc.Record`): Records to write.
+
+        Returns:
+            The result of the writer's ``add_records`` call.
+        """
+        to_write = []
+        to_index = []
+        # duplicates within this call, which aren't in the index until it's written
+        seen = {}
+        responses = revisits = saved = 0
+
+        for record in records:
+            if record.record_type != 'response' or not record.has_http_payload():
+                to_write.append(record)
+                continue
+
+            record.prepare()
+            responses += 1
+            fields = record.header.fields
+            digest = fields.get('WARC-Payload-Digest')
+
+            if digest is None or record.block.length() < self.min_length:
+                to_write.append(record)
+                continue
+
+            digest = _text(digest)
+            entry = seen.get(digest) or self.index.lookup(digest)
+            if entry is None:
+                entry = DigestEntry(_text(fields.get('WARC-Record-ID')),
+                                    _text(fields.get('WARC-Target-URI')),
+                                    _text(fields.get('WARC-Date')))
+                seen[digest] = entry
+                to_index.append((digest, entry))
+                to_write.append(record)
+                continue
+
+            revisit = revisit_record(record, entry)
+            revisits += 1
+            saved += record.block.length() - revisit.block.length()
+            to_write.append(revisit)
+
+        result = self.writer.add_records(*to_write)
+
+        for digest, entry in to_index:
+            self.index.add(digest, *entry)
+
+        with self._stats_lock:
+            self._stats['responses'] += responses
+            self._stats['revisits'] += revisits
+            self._stats['bytes_saved'] += saved
+
+        return result
+
+    def stats(self):
+        """Return a dict with the number of ``responses`` seen, how many were written as
+        ``revisits``, and the block bytes that saved (``bytes_saved``).
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def flush(self):
+        """Flush the writer, and commit new index entries."""
+        if hasattr(self.writer, 'flush'):
+            self.writer.flush()
+        self.index.flush()
+
+    def close(self):
+        """Close the writer, and commit new index entries.
+
+        The index is left open, as it's usually shared between writers.
+        """
+        if hasattr(self.writer, 'close'):
+            self.writer.close()
+        self.index.flush()
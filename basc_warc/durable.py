@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC durable writer
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Write WARC files that survive crashes, and carry on where they left off."""
+import mmap
+import os
+import time
+
+from basc_warc import WarcWriter
+from basc_warc.members import iter_members
+from basc_warc.reader import GZIP_MAGIC, WarcFormatError, parse_record
+
+JOURNAL_SUFFIX = '.journal'
+
+
+def read_journal(journal_path):
+    """Return the last synced offset saved in a journal, or 0 if there isn't one."""
+    try:
+        with open(journal_path, 'rb') as fileobj:
+            return int(fileobj.read().split()[0])
+    except (IOError, OSError, ValueError, IndexError):
+        return 0
+
+
+def write_journal(journal_path, offset):
+    """Save the last synced offset to a journal, replacing it atomically."""
+    temp_path = journal_path + '.tmp'
+    with open(temp_path, 'wb') as fileobj:
+        fileobj.write('{}\n'.format(offset).encode('ascii'))
+    os.rename(temp_path, journal_path)
+
+
+def _complete_end(fileobj, start, size):
+    """Return the offset just past the last complete record from ``start`` onwards."""
+    if start >= size:
+        return start
+
+    fileobj.seek(start)
+    if fileobj.read(2) == GZIP_MAGIC:
+        fileobj.seek(start)
+        good = start
+        try:
+            for offset, length, data in iter_members(fileobj, start):
+                record = parse_record(data)
+                if data[record.length - 4:record.length] != b'\r\n\r\n':
+                    break
+                good = offset + length
+        except WarcFormatError:
+            pass
+        return good
+
+    mapping = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        good = start
+        while good < size:
+            try:
+                record = parse_record(mapping, good)
+            except WarcFormatError:
+                break
+            end = good + record.length
+            if mapping[end - 4:end] != b'\r\n\r\n':
+                break
+            good = end
+            record = None
+        return good
+    finally:
+        try:
+            mapping.close()
+        except BufferError:
+            pass
+
+
+def recover(path, journal_path=None):
+    """Truncate any partly written record from the end of a WARC file.
+
+    Records are checked from the offset saved in the journal onwards (or from the
+    start of the file without one), and the file is truncated after the last complete
+    record, or gzip member.
+
+    Args:
+        path (str): Path of the WARC file.
+        journal_path (str): Path of its journal, defaults to ``path`` plus
+            ``'.journal'``.
+
+    Returns:
+        Number of bytes that were truncated.
+    """
+    journal_path = journal_path or path + JOURNAL_SUFFIX
+    size = os.path.getsize(path)
+
+    start = read_journal(journal_path)
+    if start > size:
+        start = 0
+
+    with open(path, 'r+b') as fileobj:
+        good = _complete_end(fileobj, start, size)
+        if good < size:
+            fileobj.truncate(good)
+            fileobj.flush()
+            os.fsync(fileobj.fileno())
+
+    return size - good
+
+
+class DurableWarcWriter(WarcWriter):
+    """Appends records to a WARC file so that a crash loses at most the last few.
+
+    Records are flushed and fsynced in groups, after ``sync_records`` records or
+    ``sync_bytes`` bytes, or once ``sync_interval`` seconds have passed since the last
+    sync (checked as records are written). Fewer, larger groups are faster, more
+    frequent ones lose less on a crash. After each sync, the offset of the end of the
+    last synced record is saved to a small journal file.
+
+    If the file already exists, any partly written record at its end (from a crash) is
+    truncated first, starting from the offset in the journal, and records are appended
+    after the last complete one.
+
+    Args:
+        path (str): Path of the WARC file.
+        compress_records (bool): Write each record as its own gzip member.
+        compression_level (int): gzip compression level, from 1 (fastest) to 9 (smallest).
+        executor (concurrent.futures.Executor): Thread or process pool to compress records on.
+        max_pending (int): Maximum number of records waiting on ``executor`` at once.
+        on_write (callable): Called as ``on_write(record, offset, length)`` after each
+            record is written.
+        sync_records (int): Sync after this many records are written.
+        sync_bytes (int): Sync after this many bytes are written.
+        sync_interval (float): Sync when a record is written this many seconds or more
+            after the last sync.
+        journal_path (str): Path of the journal, defaults to ``path`` plus ``'.journal'``.
+    """
+
+    def __init__(self, path, compress_records=True, compression_level=6, executor=None,
+                 max_pending=32, on_write=None, sync_records=None, sync_bytes=None,
+                 sync_interval=1.0, journal_path=None):
+        self.path = path
+        self.journal_path = journal_path or path + JOURNAL_SUFFIX
+        self.sync_interval = sync_interval
+        self.sync_count = 0
+
+        self.truncated_bytes = 0
+        if os.path.exists(path):
+            self.truncated_bytes = recover(path, self.journal_path)
+            fileobj = open(path, 'r+b')
+            fileobj.seek(0, os.SEEK_END)
+        else:
+            fileobj = open(path, 'w+b')
+
+        super(DurableWarcWriter, self).__init__(
+            fileobj, flush_records=sync_records, flush_bytes=sync_bytes,
+            compress_records=compress_records, compression_level=compression_level,
+            executor=executor, max_pending=max_pending, on_write=on_write)
+
+        self._last_sync = time.time()
+        self._synced_offset = self.offset
+
+    def _flush(self):
+        """Flush and fsync written records, then save their end offset to the journal."""
+        super(DurableWarcWriter, self)._flush()
+        if self.offset == self._synced_offset:
+            return
+
+        os.fsync(self.fileobj.fileno())
+        write_journal(self.journal_path, self.offset)
+
+        self._synced_offset = self.offset
+        self._last_sync = time.time()
+        self.sync_count += 1
+
+    def _written(self, record, length):
+        offset = super(DurableWarcWriter, self)._written(record, length)
+
+        if self.sync_interval is not None and (time.time() - self._last_sync >=
+                                               self.sync_interval):
+            self._flush()
+
+        return offset
+
+    def sync(self):
+        """Write any records still being compressed, and sync them to disk now."""
+        self.flush()
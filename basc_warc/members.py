@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC gzip member index
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Index the gzip members of a .warc.gz file, and read it on several cores at once."""
+import array
+import collections
+import os
+import sys
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from basc_warc import CHUNK_SIZE
+from basc_warc.cdx import DEFAULT_FIELDS, HTTP_HEADER_LIMIT
+from basc_warc.reader import GZIP_MAGIC, WarcFormatError, parse_header_bytes, parse_record
+
+INDEX_SUFFIX = '.members'
+RANGE_SIZE = 8 * 1024 * 1024
+
+# compressed bytes read at a time while looking for the end of a member's record header
+HEAD_READ_SIZE = 4096
+
+
+def iter_members(fileobj, start=0, end=None, keep_data=True):
+    """Yield ``(offset, length, data)`` for each gzip member starting in a range.
+
+    ``fileobj`` must be positioned at ``start``, the start of a member. ``data`` is
+    the decompressed member, or None if ``keep_data`` is False.
+    """
+    # compressed offsets of the current member, and of the next unused input byte
+    offset = position = start
+    unused = b''
+
+    while end is None or offset < end:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        parts = []
+
+        while not decompressor.eof:
+            if not unused:
+                unused = fileobj.read(CHUNK_SIZE)
+                if not unused:
+                    if position == offset:
+                        return
+                    raise WarcFormatError('Truncated gzip member at offset {}'.format(offset))
+
+            try:
+                data = decompressor.decompress(unused, CHUNK_SIZE)
+            except zlib.error as e:
+                raise WarcFormatError('Invalid gzip member at offset {}: {}'.format(offset, e))
+            if keep_data:
+                parts.append(data)
+
+            if decompressor.eof:
+                rest = decompressor.unused_data
+            else:
+                rest = decompressor.unconsumed_tail
+            position += len(unused) - len(rest)
+            unused = rest
+
+        yield offset, position - offset, b''.join(parts) if keep_data else None
+        offset = position
+
+
+def decompress_range(path, start, end):
+    """Decompress the gzip members starting in the given range of a file.
+
+    Args:
+        path (str): Path of the ``.warc.gz`` file.
+        start (int): Offset of the first member.
+        end (int): Stop at the first member starting at or after this offset.
+
+    Returns:
+        Tuple of ``(data, members)``, where ``data`` is the decompressed members and
+        ``members`` is a list of ``(offset, length, data_start, data_end)`` tuples,
+        giving where each member is in the file and in ``data``.
+    """
+    parts = []
+    members = []
+    data_start = 0
+
+    with open(path, 'rb') as fileobj:
+        fileobj.seek(start)
+        for offset, length, data in iter_members(fileobj, start, end):
+            parts.append(data)
+            members.append((offset, length, data_start, data_start + len(data)))
+            data_start += len(data)
+
+    return b''.join(parts), members
+
+
+def _header_end(data):
+    """Return the offsets of the version line and blank line of the header in ``data``."""
+    start = len(data) - len(data.lstrip(b'\r\n'))
+    return start, data.find(b'\r\n\r\n', start)
+
+
+def read_member_head(fileobj, offset, end, http_header=False):
+    """Parse the record header of a gzip member, decompressing as little as possible.
+
+    Only the start of the member is read and decompressed, up to the end of the record
+    header, or with ``http_header``, up to the end of the HTTP header at the start of
+    the block (if there is one).
+
+    Args:
+        fileobj: Binary file object of the ``.warc.gz`` file.
+        offset (int): Offset of the member.
+        end (int): Offset of the end of the member, or of the file.
+        http_header (bool): Also decompress the HTTP header.
+
+    Returns:
+        Tuple of ``(record_type, header, block_start)``, where ``block_start`` is the
+        start of the block that was decompressed along with the header.
+    """
+    fileobj.seek(offset)
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = b''
+    position = offset
+
+    while position < end and not decompressor.eof:
+        compressed = fileobj.read(min(HEAD_READ_SIZE, end - position))
+        if not compressed:
+            break
+        position += len(compressed)
+        try:
+            data += decompressor.decompress(compressed)
+        except zlib.error as e:
+            raise WarcFormatError('Invalid gzip member at offset {}: {}'.format(offset, e))
+
+        start, header_end = _header_end(data)
+        if header_end != -1:
+            if not http_header:
+                break
+            block_start = data[header_end + 4:]
+            if b'\r\n\r\n' in block_start or len(block_start) >= HTTP_HEADER_LIMIT:
+                break
+
+    start, header_end = _header_end(data)
+    if header_end == -1 or not data.startswith(b'WARC/', start):
+        raise WarcFormatError('No record header in gzip member at offset {}'.format(offset))
+
+    fields_start = data.find(b'\n', start, header_end + 2) + 1
+    record_type, header = parse_header_bytes(data[fields_start:header_end + 2],
+                                             data[start:fields_start])
+
+    try:
+        length = int(header.fields['Content-Length'])
+    except (KeyError, ValueError):
+        raise WarcFormatError('Record at offset {} has no valid Content-Length'
+                              .format(offset))
+
+    return record_type, header, data[header_end + 4:header_end + 4 + length]
+
+
+class MemberIndex(object):
+    """Offsets of the gzip members in a ``.warc.gz`` file.
+
+    Each record in a ``.warc.gz`` file is its own gzip member, so the file can be split
+    into ranges at member offsets and each range decompressed separately. The index
+    only has to be built once, and can be saved alongside the file, or the offsets can
+    be taken from a CDX file instead.
+
+    Args:
+        path (str): Path of the ``.warc.gz`` file.
+        offsets (list of int): Offsets of (at least some of) the members, in order.
+        size (int): Size of the file, defaults to its current size.
+        complete (bool): Whether ``offsets`` has every member, so the end of each member
+            is the start of the next.
+        mtime (int): Modification time of the file in nanoseconds, defaults to its
+            current one.
+    """
+
+    def __init__(self, path, offsets, size=None, complete=False, mtime=None):
+        self.path = path
+        self.offsets = array.array('Q', offsets)
+        if size is None or mtime is None:
+            stat = os.stat(path)
+        self.size = stat.st_size if size is None else size
+        self.mtime = stat.st_mtime_ns if mtime is None else mtime
+        self.complete = complete
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def build(cls, path):
+        """Build an index of every member, by decompressing the whole file once."""
+        with open(path, 'rb') as fileobj:
+            stat = os.fstat(fileobj.fileno())
+            if fileobj.read(2) != GZIP_MAGIC:
+                raise ValueError('{} is not gzipped'.format(path))
+            fileobj.seek(0)
+            offsets = [offset for offset, length, data
+                       in iter_members(fileobj, keep_data=False)]
+        return cls(path, offsets, size=stat.st_size, complete=True, mtime=stat.st_mtime_ns)
+
+    @classmethod
+    def from_cdx(cls, path, cdx_path):
+        """Build an index from the offsets of the records listed in a CDX file.
+
+        Only the records in the CDX file for this WARC file (by filename) are used, which
+        is enough to split the file into ranges.
+
+        Args:
+            path (str): Path of the ``.warc.gz`` file.
+            cdx_path (str): Path of the CDX file.
+        """
+        filename = os.path.basename(path).encode('utf8')
+        fields = DEFAULT_FIELDS.split()
+        offsets = set([0])
+
+        with open(cdx_path, 'rb') as fileobj:
+            for line in fileobj:
+                if line.startswith(b' CDX '):
+                    fields = line.decode('utf8').split()[1:]
+                    continue
+                values = line.split()
+                if len(values) != len(fields):
+                    continue
+                if 'g' in fields and values[fields.index('g')] != filename:
+                    continue
+                try:
+                    offsets.add(int(values[fields.index('V')]))
+                except ValueError:
+                    continue
+
+        return cls(path, sorted(offsets))
+
+    @classmethod
+    def load(cls, path, index_path=None):
+        """Load a saved index, or return None if there isn't one for the file as it is now.
+
+        An index is only used if the file's size and modification time are the ones it
+        was saved with.
+
+        Args:
+            path (str): Path of the ``.warc.gz`` file.
+            index_path (str): Path of the saved index, defaults to ``path`` plus
+                ``'.members'``.
+        """
+        index_path = index_path or path + INDEX_SUFFIX
+        if not os.path.exists(index_path):
+            return None
+
+        values = array.array('Q')
+        with open(index_path, 'rb') as fileobj:
+            values.frombytes(fileobj.read())
+        if sys.byteorder == 'big':
+            values.byteswap()
+
+        stat = os.stat(path)
+        if len(values) < 3 or values[0] != stat.st_size or values[1] != stat.st_mtime_ns:
+            return None
+        return cls(path, values[3:], size=values[0], complete=bool(values[2]),
+                   mtime=values[1])
+
+    def save(self, index_path=None):
+        """Save the index, by default to the WARC file's path plus ``'.members'``.
+
+        The index is written to a temporary file that's then renamed over the old one,
+        so readers never see a partly written index.
+        """
+        values = array.array('Q', [self.size, self.mtime, 1 if self.complete else 0])
+        values.extend(self.offsets)
+        if sys.byteorder == 'big':
+            values.byteswap()
+
+        index_path = index_path or self.path + INDEX_SUFFIX
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(index_path) or '.',
+                                             prefix=os.path.basename(index_path) + '.')
+        try:
+            with os.fdopen(handle, 'wb') as fileobj:
+                fileobj.write(values.tobytes())
+            os.replace(temp_path, index_path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def members(self):
+        """Yield ``(offset, length)`` for each indexed member.
+
+        Lengths are only those of single members if the index is complete.
+        """
+        ends = self.offsets[1:].tolist() + [self.size]
+        for offset, end in zip(self.offsets, ends):
+            yield offset, end - offset
+
+    def ranges(self, size=RANGE_SIZE):
+        """Split the file into ranges of about ``size`` bytes, starting at members.
+
+        Returns:
+            List of ``(path, start, end)`` tuples, which can also be given to
+            :meth:`basc_warc.batch.BatchProcessor.run`.
+        """
+        ranges = []
+        start = 0
+        for offset in self.offsets:
+            if offset - start >= size:
+                ranges.append((self.path, start, offset))
+                start = offset
+        if start < self.size or not ranges:
+            ranges.append((self.path, start, self.size))
+        return ranges
+
+
+class ParallelWarcReader(object):
+    """Reads the records of a ``.warc.gz`` file, decompressing it on several cores.
+
+    The file is split into ranges using a :class:`basc_warc.members.MemberIndex`, and
+    ranges are decompressed concurrently (zlib releases the GIL while it works), while
+    records are parsed and yielded in their original order. Each record's ``offset``
+    and ``length`` are those of its gzip member, and its block is a
+    :class:`basc_warc.reader.MappedBlock` slice of the decompressed range.
+
+    Args:
+        path (str): Path of the ``.warc.gz`` file.
+        index (MemberIndex): Index of the file's members. Defaults to a saved index, see
+            :meth:`MemberIndex.load`, or else one built by decompressing the file.
+        save_index (bool): Save the index next to the file if one had to be built, so
+            the file is only decompressed once the next time it's read. Failing to save
+            it is ignored.
+        jobs (int): Number of threads to decompress on, defaults to the number of CPUs.
+        range_size (int): Approximate compressed size of each range.
+        executor (concurrent.futures.Executor): Executor to decompress ranges on,
+            instead of a thread pool. A process pool also works.
+        max_pending (int): Maximum number of ranges decompressed ahead of the one being
+            read, defaults to two per job.
+    """
+
+    def __init__(self, path, index=None, jobs=None, range_size=RANGE_SIZE, executor=None,
+                 max_pending=None, save_index=False):
+        self.path = path
+        self.index = index or MemberIndex.load(path)
+        if self.index is None:
+            self.index = MemberIndex.build(path)
+            if save_index:
+                try:
+                    self.index.save()
+                except (IOError, OSError):
+                    pass
+        self.jobs = jobs or os.cpu_count() or 1
+        self.range_size = range_size
+        self.executor = executor
+        self.max_pending = max_pending or self.jobs * 2
+
+    def __iter__(self):
+        executor = self.executor or ThreadPoolExecutor(self.jobs)
+        pending = collections.deque()
+
+        try:
+            for path, start, end in self.index.ranges(self.range_size):
+                pending.append(executor.submit(decompress_range, path, start, end))
+                if len(pending) > self.max_pending:
+                    for record in self._records(*pending.popleft().result()):
+                        yield record
+
+            while pending:
+                for record in self._records(*pending.popleft().result()):
+                    yield record
+        finally:
+            for future in pending:
+                future.cancel()
+            if self.executor is None:
+                executor.shutdown(wait=True)
+
+    def _records(self, data, members):
+        for offset, length, data_start, data_end in members:
+            position = data_start
+            while position < data_end:
+                # skip stray blank lines between records
+                if data.startswith(b'\r\n', position):
+                    position += 2
+                    continue
+                if data.startswith(b'\n', position):
+                    position += 1
+                    continue
+
+                record = parse_record(data, position)
+                position += record.length
+
+                record.offset = offset
+                record.length = length
+                yield record
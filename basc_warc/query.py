@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC record queries
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Select records from WARC files by their headers, without reading the rest."""
+import datetime
+
+import iso8601
+
+from basc_warc import utils
+from basc_warc.members import MemberIndex, iter_members, read_member_head
+from basc_warc.reader import GZIP_MAGIC, WarcReader, parse_record
+
+
+def _as_datetime(value):
+    """Return the given datetime or WARC timestamp as an aware datetime in UTC."""
+    if value is None:
+        return None
+    if not isinstance(value, datetime.datetime):
+        return utils.ts_to_datetime(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=iso8601.UTC)
+    return value
+
+
+def _strip_uri(uri):
+    if uri.startswith('<') and uri.endswith('>'):
+        return uri[1:-1]
+    return uri
+
+
+class Query(object):
+    """Conditions on record headers, that records must all meet to be selected.
+
+    Every condition is checked on the record header alone, so records that don't match
+    can be skipped without reading their blocks. Conditions left as None match
+    anything::
+
+        query = Query(record_types=['response'], url_prefixes=['http://example.com/'],
+                      content_types=['text/html'], date_from='2015-06-01T00:00:00Z')
+        for record in query_warc('example.warc.gz', query):
+            print(record.header.fields.get('WARC-Target-URI'))
+
+    Args:
+        record_types (list of str): ``WARC-Type`` values to select.
+        urls (list of str): ``WARC-Target-URI`` values to select, exactly.
+        url_prefixes (list of str): Select records whose ``WARC-Target-URI`` starts with
+            one of these.
+        content_types (list of str): Select records whose content type starts with one of
+            these, ignoring case. The content type is ``WARC-Identified-Payload-Type`` if
+            the record has it, otherwise ``Content-Type`` (which is ``application/http``
+            for HTTP requests and responses).
+        date_from (datetime or str): Select records with a ``WARC-Date`` at or after this.
+        date_to (datetime or str): Select records with a ``WARC-Date`` before this.
+        predicate (callable): Called as ``predicate(record_type, header)`` once the other
+            conditions match, and the record is selected if it returns True.
+
+    Naive datetimes are taken to be in UTC, and strings are WARC timestamps.
+    """
+
+    def __init__(self, record_types=None, urls=None, url_prefixes=None, content_types=None,
+                 date_from=None, date_to=None, predicate=None):
+        self.record_types = frozenset(record_types) if record_types is not None else None
+        self.urls = frozenset(urls) if urls is not None else None
+        self.url_prefixes = tuple(url_prefixes) if url_prefixes is not None else None
+        self.content_types = (tuple(content_type.lower() for content_type in content_types)
+                              if content_types is not None else None)
+        self.date_from = _as_datetime(date_from)
+        self.date_to = _as_datetime(date_to)
+        self.predicate = predicate
+
+    def matches_header(self, record_type, header):
+        """Return True if a record with the given type and header is selected.
+
+        Args:
+            record_type (str): The record's ``WARC-Type``.
+            header (:class:`basc_warc.RecordHeader`): The record's header.
+        """
+        if self.record_types is not None and record_type not in self.record_types:
+            return False
+
+        fields = header.fields
+        if self.urls is not None or self.url_prefixes is not None:
+            uri = fields.get('WARC-Target-URI')
+            if uri is None:
+                return False
+            uri = _strip_uri(uri)
+            if self.urls is not None and uri not in self.urls:
+                return False
+            if self.url_prefixes is not None and not uri.startswith(self.url_prefixes):
+                return False
+
+        if self.content_types is not None:
+            content_type = (fields.get('WARC-Identified-Payload-Type') or
+                            fields.get('Content-Type'))
+            if content_type is None or not content_type.lower().startswith(self.content_types):
+                return False
+
+        if self.date_from is not None or self.date_to is not None:
+            date = _as_datetime(header.date)
+            if date is None:
+                return False
+            if self.date_from is not None and date < self.date_from:
+                return False
+            if self.date_to is not None and date >= self.date_to:
+                return False
+
+        if self.predicate is not None and not self.predicate(record_type, header):
+            return False
+
+        return True
+
+    def matches(self, record):
+        """Return True if the given :class:`basc_warc.Record` is selected."""
+        return self.matches_header(record.record_type, record.header)
+
+
+def filter_records(records, query):
+    """Yield the records that match a query.
+
+    With records from a :class:`basc_warc.reader.WarcReader`, the blocks of records that
+    don't match are skipped when the next record is read, seeking past them in
+    uncompressed files.
+
+    Args:
+        records (iterable): Records to filter.
+        query (Query): Query the records must match.
+    """
+    for record in records:
+        if query.matches(record):
+            yield record
+
+
+def _query_members(path, query, index):
+    """Yield the matching records of an indexed ``.warc.gz`` file, see :func:`query_warc`."""
+    with open(path, 'rb') as fileobj:
+        for offset, length in index.members():
+            record_type, header, block_start = read_member_head(fileobj, offset,
+                                                                offset + length)
+            if not query.matches_header(record_type, header):
+                continue
+
+            fileobj.seek(offset)
+            for member_offset, length, data in iter_members(fileobj, offset, offset + 1):
+                start = len(data) - len(data.lstrip(b'\r\n'))
+                record = parse_record(data, start)
+                record.offset = member_offset
+                record.length = length
+                yield record
+
+
+def query_warc(path, query, index=None):
+    """Yield the records of a WARC file that match a query.
+
+    Records are selected by their headers alone. In uncompressed files, the blocks of
+    records that don't match are seeked past. In ``.warc.gz`` files with a complete
+    :class:`basc_warc.members.MemberIndex` (given, or saved alongside the file), only
+    the start of each record's gzip member is decompressed to read its header, and the
+    rest of the member is only read if the record matches. Otherwise, records are read
+    with a :class:`basc_warc.reader.WarcReader`, and their blocks can only be read until
+    the next record is.
+
+    Indexed files are expected to have one record per gzip member, as the WARC standard
+    recommends.
+
+    Args:
+        path (str): Path of the WARC file.
+        query (Query): Query the records must match.
+        index (MemberIndex): Index of the file's gzip members.
+    """
+    with open(path, 'rb') as fileobj:
+        compressed = fileobj.read(2) == GZIP_MAGIC
+
+    if compressed:
+        if index is None:
+            index = MemberIndex.load(path)
+        if index is not None and index.complete:
+            for record in _query_members(path, query, index):
+                yield record
+            return
+
+    with open(path, 'rb') as fileobj:
+        for record in filter_records(WarcReader(fileobj), query):
+            yield record
+
+
+def copy_records(records, writer):
+    """Write records to a WARC writer as they're read, and return how many were written.
+
+    This streams records (such as those from :func:`query_warc`) into a new WARC file,
+    so ``writer`` must write records as they're added, like a
+    :class:`basc_warc.WarcWriter`. Each record is written before the next is read.
+
+    Args:
+        records (iterable): Records to write.
+        writer (:class:`basc_warc.WarcWriter`): Writer to add the records to.
+    """
+    count = 0
+    for record in records:
+        writer.add_record(record)
+        count += 1
+    return count
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC queued writer
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Accept records from many threads, and write them from a single thread."""
+import threading
+import time
+from concurrent.futures import Future
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+_STOP = object()
+
+
+class QueuedWarcWriter(object):
+    """Lets many threads add records without contending on the writer's lock.
+
+    Records are put on a bounded queue and written by a single background thread, using
+    any writer with an ``add_records`` method (a :class:`basc_warc.WarcWriter`,
+    :class:`basc_warc.rotating.RotatingWarcWriter`, etc). Records passed to one
+    :meth:`add_records` call are written with one ``add_records`` call on the writer, so
+    they stay adjacent.
+
+    When the queue is full, adding records blocks until there's room, which keeps
+    producers from running too far ahead of the disk.
+
+    Args:
+        writer: Writer to write records with.
+        max_queued (int): Maximum number of :meth:`add_records` calls waiting to be written.
+        prepare (bool): Calculate record digests on the adding thread, see
+            :meth:`basc_warc.Record.prepare`.
+    """
+
+    def __init__(self, writer, max_queued=1024, prepare=True):
+        self.writer = writer
+        self.prepare = prepare
+        self.closed = False
+
+        self._queue = queue.Queue(maxsize=max_queued)
+
+        # number of add_records calls past the closed check, which close() waits for
+        self._adding = 0
+        self._adding_lock = threading.Condition()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'groups_added': 0,
+            'records_added': 0,
+            'records_written': 0,
+            'write_errors': 0,
+            'max_queue_depth': 0,
+            'blocked_adds': 0,
+            'blocked_seconds': 0.0,
+            'writer_busy_seconds': 0.0,
+        }
+
+        self._thread = threading.Thread(target=self._run, name='QueuedWarcWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_record(self, record, timeout=None):
+        """Queue the given Record to be written.
+
+        See :meth:`add_records`.
+        """
+        return self.add_records(record, timeout=timeout)
+
+    def add_records(self, *records, **kwargs):
+        """Queue the given Records to be written together.
+
+        Args:
+            records (list of :class:`basc_warc.Record`): Records to write.
+            timeout (float): Maximum number of seconds to wait for room in the queue,
+                raises :class:`queue.Full` if there still isn't any.
+
+        Returns:
+            A :class:`concurrent.futures.Future` for the result of the writer's
+            ``add_records`` call (ie: the offsets of the records).
+        """
+        timeout = kwargs.pop('timeout', None)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: {}'.format(', '.join(kwargs)))
+        with self._adding_lock:
+            if self.closed:
+                raise ValueError('Writer is closed')
+            self._adding += 1
+
+        try:
+            if self.prepare:
+                for record in records:
+                    record.prepare()
+
+            future = Future()
+            item = (records, future)
+
+            blocked = 0.0
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                start = time.time()
+                self._queue.put(item, timeout=timeout)
+                blocked = time.time() - start
+        finally:
+            with self._adding_lock:
+                self._adding -= 1
+                self._adding_lock.notify_all()
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats['groups_added'] += 1
+            self._stats['records_added'] += len(records)
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], depth)
+            if blocked:
+                self._stats['blocked_adds'] += 1
+                self._stats['blocked_seconds'] += blocked
+
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+
+                records, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                start = time.time()
+                try:
+                    result = self.writer.add_records(*records)
+                except Exception as e:
+                    future.set_exception(e)
+                    error = 1
+                else:
+                    future.set_result(result)
+                    error = 0
+
+                with self._stats_lock:
+                    self._stats['writer_busy_seconds'] += time.time() - start
+                    self._stats['records_written'] += 0 if error else len(records)
+                    self._stats['write_errors'] += error
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        """Return a dict of counters showing how well writing is keeping up.
+
+        ``blocked_adds`` and ``blocked_seconds`` show how often and for how long adding
+        threads waited for room in the queue, and ``writer_busy_seconds`` how long the
+        writing thread spent writing. ``queue_depth`` is the current number of queued
+        :meth:`add_records` calls.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        return stats
+
+    def flush(self):
+        """Wait for every queued record to be written, then flush the writer."""
+        self._queue.join()
+        if hasattr(self.writer, 'flush'):
+            self.writer.flush()
+
+    def close(self):
+        """Write every queued record, stop the writing thread and close the writer.
+
+        Records that other threads are still adding are queued and written first.
+        """
+        with self._adding_lock:
+            if self.closed:
+                return
+            self.closed = True
+            while self._adding:
+                self._adding_lock.wait()
+
+        self._queue.put(_STOP)
+        self._thread.join()
+
+        if hasattr(self.writer, 'close'):
+            self.writer.close()
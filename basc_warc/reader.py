@@ -0,0 +1,602 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC reader
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Read WARC files."""
+import mmap
+import zlib
+
+from basc_warc import CHUNK_SIZE, WARC_VERSION, Record, RecordHeader, WarcFields
+
+MAX_LINE_LENGTH = 64 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class WarcFormatError(ValueError):
+    """The data being read is not a valid WARC file."""
+
+
+# streams
+class _PlainStream(object):
+    """Uncompressed WARC data, tracking the offset of the next unread byte."""
+
+    def __init__(self, fileobj, initial=b'', offset=0, chunk_size=CHUNK_SIZE):
+        self._fileobj = fileobj
+        self._chunk_size = chunk_size
+        self._buffer = initial
+        self._pos = 0
+        self._offset = offset
+
+    def _fill(self):
+        """Make sure there is unread data in the buffer, returns False at EOF."""
+        if self._pos < len(self._buffer):
+            return True
+        self._buffer = self._fileobj.read(self._chunk_size)
+        self._pos = 0
+        return bool(self._buffer)
+
+    def tell(self):
+        """Return the offset of the next unread byte."""
+        return self._offset
+
+    def read(self, size):
+        """Read up to ``size`` bytes."""
+        if not self._fill():
+            return b''
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+        self._offset += len(data)
+        return data
+
+    def readline(self, limit=MAX_LINE_LENGTH):
+        """Read a line, including the trailing ``\\n``."""
+        parts = []
+        length = 0
+        while length < limit and self._fill():
+            end = self._buffer.find(b'\n', self._pos, self._pos + limit - length)
+            if end == -1:
+                end = min(len(self._buffer), self._pos + limit - length)
+            else:
+                end += 1
+            parts.append(self._buffer[self._pos:end])
+            length += end - self._pos
+            self._offset += end - self._pos
+            self._pos = end
+            if parts[-1].endswith(b'\n'):
+                break
+        return b''.join(parts)
+
+    def read_header(self):
+        """Read header lines up to and including the blank line that ends them.
+
+        Returns None, without reading anything, if they aren't all buffered yet.
+        """
+        if self._buffer.startswith(b'\r\n', self._pos):
+            return self.read(2)
+        end = self._buffer.find(b'\r\n\r\n', self._pos)
+        if end == -1:
+            return None
+        return self.read(end + 4 - self._pos)
+
+    def skip(self, size):
+        """Skip ``size`` bytes, seeking past them if possible."""
+        buffered = min(size, len(self._buffer) - self._pos)
+        self._pos += buffered
+        self._offset += buffered
+        size -= buffered
+
+        if not size:
+            return
+        try:
+            self._fileobj.seek(size, 1)
+            self._offset += size
+        except (AttributeError, IOError, OSError, ValueError):
+            while size:
+                data = self.read(min(size, self._chunk_size))
+                if not data:
+                    break
+                size -= len(data)
+
+
+class _GzipStream(object):
+    """Decompressed data from multi-member gzip WARC data.
+
+    Offsets are the compressed offset of the gzip member that holds the next unread
+    byte, which is where a record starts in a ``.warc.gz`` file.
+    """
+
+    def __init__(self, fileobj, initial=b'', offset=0, chunk_size=CHUNK_SIZE):
+        self._fileobj = fileobj
+        self._chunk_size = chunk_size
+
+        # compressed data not yet given to the decompressor, and its offset
+        self._input = initial
+        self._input_offset = offset
+
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._member_offset = offset
+
+        self._buffer = b''
+        self._pos = 0
+
+    def _fill(self):
+        """Make sure there is unread data in the buffer, returns False at EOF."""
+        while self._pos >= len(self._buffer):
+            if self._decompressor.eof:
+                if not self._input:
+                    self._input = self._fileobj.read(self._chunk_size)
+                    if not self._input:
+                        return False
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self._member_offset = self._input_offset
+
+            data = self._input or self._fileobj.read(self._chunk_size)
+            if not data:
+                if self._member_offset == self._input_offset:
+                    return False
+                raise WarcFormatError('Truncated gzip member at offset {}'
+                                      .format(self._member_offset))
+
+            self._buffer = self._decompressor.decompress(data, self._chunk_size)
+            self._pos = 0
+
+            if self._decompressor.eof:
+                self._input = self._decompressor.unused_data
+            else:
+                self._input = self._decompressor.unconsumed_tail
+            self._input_offset += len(data) - len(self._input)
+        return True
+
+    def tell(self):
+        """Return the compressed offset of the member holding the next unread byte."""
+        if self._fill():
+            return self._member_offset
+        return self._input_offset
+
+    def read(self, size):
+        """Read up to ``size`` decompressed bytes."""
+        if not self._fill():
+            return b''
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def readline(self, limit=MAX_LINE_LENGTH):
+        """Read a line, including the trailing ``\\n``."""
+        parts = []
+        length = 0
+        while length < limit and self._fill():
+            end = self._buffer.find(b'\n', self._pos, self._pos + limit - length)
+            if end == -1:
+                end = min(len(self._buffer), self._pos + limit - length)
+            else:
+                end += 1
+            parts.append(self._buffer[self._pos:end])
+            length += end - self._pos
+            self._pos = end
+            if parts[-1].endswith(b'\n'):
+                break
+        return b''.join(parts)
+
+    def read_header(self):
+        """Read header lines up to and including the blank line that ends them.
+
+        Returns None, without reading anything, if they aren't all buffered yet.
+        """
+        if self._buffer.startswith(b'\r\n', self._pos):
+            return self.read(2)
+        end = self._buffer.find(b'\r\n\r\n', self._pos)
+        if end == -1:
+            return None
+        return self.read(end + 4 - self._pos)
+
+    def skip(self, size):
+        """Skip ``size`` decompressed bytes."""
+        while size:
+            data = self.read(min(size, self._chunk_size))
+            if not data:
+                break
+            size -= len(data)
+
+
+def open_stream(fileobj, offset=0, chunk_size=CHUNK_SIZE):
+    """Return a stream over the given WARC data, decompressing it if it's gzipped."""
+    initial = fileobj.read(chunk_size)
+    if initial.startswith(GZIP_MAGIC):
+        return _GzipStream(fileobj, initial, offset, chunk_size)
+    return _PlainStream(fileobj, initial, offset, chunk_size)
+
+
+# blocks
+class StreamBlock(object):
+    """Block for a record being read from a WARC file.
+
+    The content is read from the file on demand, rather than being copied into memory.
+    A block can only be read until the next record is read from the file.
+
+    Args:
+        stream: Stream the block is being read from.
+        length (int): Length of the block in bytes.
+    """
+
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._length = length
+        self._remaining = length
+        self._cache = None
+
+    def read(self, size=-1):
+        """Read up to ``size`` bytes from the block, or the rest of it if ``size`` is -1."""
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+
+        parts = []
+        while size:
+            data = self._stream.read(size)
+            if not data:
+                raise WarcFormatError('Unexpected end of file in record block')
+            parts.append(data)
+            size -= len(data)
+            self._remaining -= len(data)
+
+        return b''.join(parts)
+
+    def chunks(self, size=CHUNK_SIZE):
+        """Yield the rest of the block in chunks of at most ``size`` bytes."""
+        while self._remaining:
+            yield self.read(size)
+
+    def skip(self):
+        """Skip the rest of the block without reading it."""
+        self._stream.skip(self._remaining)
+        self._remaining = 0
+
+    def bytes(self):
+        """Return bytes to write.
+
+        This reads the whole block into memory, and can't be used after :meth:`read`.
+        """
+        if self._cache is None:
+            if self._remaining != self._length:
+                raise IOError('Block has already been partly read')
+            self._cache = self.read()
+        return self._cache
+
+    def length(self):
+        """Return length in bytes."""
+        return self._length
+
+
+class MappedBlock(object):
+    """Block for a record in a memory-mapped WARC file.
+
+    The content is a :class:`memoryview` slice of the mapping, so it is never copied.
+
+    Args:
+        content (memoryview): Content of the block.
+    """
+
+    def __init__(self, content):
+        self.content = content
+
+    def bytes(self):
+        """Return the content to write, as a :class:`memoryview`."""
+        return self.content
+
+    def length(self):
+        """Return length in bytes."""
+        return len(self.content)
+
+
+# headers
+def parse_header(lines):
+    """Parse the lines of a record header into a record type and header.
+
+    Args:
+        lines (list of bytes): Header lines, after the ``WARC/1.0`` line and without the
+            trailing blank line.
+
+    Returns:
+        Tuple of ``(record_type, RecordHeader)``.
+    """
+    return parse_header_bytes(b''.join(lines))
+
+
+def parse_header_bytes(data, warc_version=WARC_VERSION):
+    """Parse the field lines of a record header into a record type and header.
+
+    Field values are only decoded when they're accessed, see
+    :meth:`basc_warc.WarcFields.from_bytes`.
+
+    Args:
+        data (bytes or memoryview): Header lines, after the ``WARC/1.0`` line and
+            without the trailing blank line.
+        warc_version (bytes or memoryview): The header's version line.
+
+    Returns:
+        Tuple of ``(record_type, RecordHeader)``.
+    """
+    try:
+        fields = WarcFields.from_bytes(bytes(data))
+    except ValueError as e:
+        raise WarcFormatError(str(e))
+
+    header = RecordHeader(warc_version=bytes(warc_version).rstrip(b'\r\n'))
+    header.fields = fields
+
+    return fields.get('WARC-Type'), header
+
+
+class WarcReader(object):
+    """Reads records from a WARC file, one at a time.
+
+    Both uncompressed and gzipped (``.warc.gz``) files are supported. Records are
+    parsed lazily as you iterate over the reader, and their blocks are
+    :class:`basc_warc.reader.StreamBlock` objects that read from the file on demand.
+    Any part of a block you don't read is skipped over when moving to the next record.
+
+    Each record is given an ``offset`` attribute, the offset of the record in the file
+    (of its gzip member, for gzipped files). Once the next record has been read, it
+    also gets a ``length`` attribute, its length in the file.
+
+    Args:
+        fileobj: Binary file-like object to read from.
+        offset (int): Offset in the file ``fileobj`` is currently at.
+    """
+
+    def __init__(self, fileobj, offset=0, chunk_size=CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.stream = open_stream(fileobj, offset, chunk_size)
+        self.compressed = isinstance(self.stream, _GzipStream)
+        self._current = None
+        self._current_block = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        record = self.read_record()
+        if record is None:
+            raise StopIteration
+        return record
+
+    next = __next__
+
+    def _finish_current(self):
+        """Skip the rest of the current record, and fill in its length."""
+        record = self._current
+        if record is None:
+            return
+
+        self._current_block.skip()
+        trailer = self.stream.read(4)
+        while len(trailer) < 4:
+            data = self.stream.read(4 - len(trailer))
+            if not data:
+                break
+            trailer += data
+        if trailer != b'\r\n\r\n':
+            raise WarcFormatError('Record at offset {} does not end with CRLF CRLF'
+                                  .format(record.offset))
+
+        record.length = self.stream.tell() - record.offset
+        self._current = None
+
+    def read_record(self):
+        """Read the next record.
+
+        Returns:
+            The next :class:`basc_warc.Record`, or None at the end of the file.
+        """
+        self._finish_current()
+
+        # find the version line, skipping any stray blank lines between records
+        offset = self.stream.tell()
+        line = self.stream.readline()
+        while line in (b'\r\n', b'\n'):
+            offset = self.stream.tell()
+            line = self.stream.readline()
+        if not line:
+            return None
+        if not line.startswith(b'WARC/'):
+            raise WarcFormatError('Expected WARC version line at offset {}, got {!r}'
+                                  .format(offset, line[:40]))
+
+        # usually the whole header is buffered, and can be parsed in one go
+        data = self.stream.read_header()
+        if data is None:
+            lines = []
+            while True:
+                line = self.stream.readline()
+                if not line:
+                    raise WarcFormatError('Unexpected end of file in record header')
+                if line in (b'\r\n', b'\n'):
+                    break
+                lines.append(line)
+            data = b''.join(lines)
+
+        record_type, header = parse_header_bytes(data, line)
+
+        try:
+            length = int(header.fields['Content-Length'])
+        except (KeyError, ValueError):
+            raise WarcFormatError('Record at offset {} has no valid Content-Length'
+                                  .format(offset))
+
+        block = StreamBlock(self.stream, length)
+        record = Record(record_type, header=header, block=block)
+        record.offset = offset
+        record.length = None
+
+        self._current = record
+        self._current_block = block
+        return record
+
+    def close(self):
+        """Close the underlying file object."""
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MappedWarcFile(object):
+    """Random access to the records in a WARC file, by offset.
+
+    The file is memory-mapped. For uncompressed files, records are parsed straight
+    from the mapping and their blocks are :class:`basc_warc.reader.MappedBlock`
+    objects, so block content is never copied. For gzipped files, only the gzip member
+    at the given offset is decompressed.
+
+    :meth:`record_at` doesn't move a shared file position, so it can be called from
+    several threads at once.
+
+    Args:
+        path (str): Path of the WARC file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fileobj:
+            self.map = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the mapping.
+
+        If blocks of records from this file are still in use, the mapping is instead
+        released once they're no longer referenced.
+        """
+        try:
+            self.map.close()
+        except BufferError:
+            pass
+
+    def record_at(self, offset):
+        """Return the record at the given offset, such as one from a CDX file.
+
+        Args:
+            offset (int): Offset of the record (or its gzip member) in the file.
+
+        Returns:
+            A :class:`basc_warc.Record`.
+        """
+        if self.map[offset:offset + 2] == GZIP_MAGIC:
+            data, length = _decompress_member(self.map, offset)
+            record = parse_record(data, len(data) - len(data.lstrip(b'\r\n')))
+            record.offset = offset
+            record.length = length
+            return record
+
+        return parse_record(self.map, offset)
+
+
+def _decompress_member(buffer, offset):
+    """Decompress the gzip member at an offset of a buffer.
+
+    Returns:
+        Tuple of the decompressed data and the compressed length of the member.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    parts = []
+    position = offset
+    try:
+        while not decompressor.eof and position < len(buffer):
+            compressed = buffer[position:position + CHUNK_SIZE]
+            parts.append(decompressor.decompress(compressed))
+            position += len(compressed)
+    except zlib.error as e:
+        raise WarcFormatError('Invalid gzip member at offset {}: {}'.format(offset, e))
+    if not decompressor.eof:
+        raise WarcFormatError('Truncated gzip member at offset {}'.format(offset))
+
+    return b''.join(parts), position - len(decompressor.unused_data) - offset
+
+
+def parse_record(buffer, offset=0):
+    """Parse the uncompressed record at the given offset of a buffer.
+
+    The record's block is a :class:`basc_warc.reader.MappedBlock`, a slice of the
+    buffer rather than a copy.
+
+    Args:
+        buffer (bytes or mmap.mmap): Uncompressed WARC data.
+        offset (int): Offset of the record in the buffer.
+
+    Returns:
+        A :class:`basc_warc.Record`, with ``offset`` and ``length`` set to where it is
+        in the buffer.
+    """
+    header_end = buffer.find(b'\r\n\r\n', offset)
+    if header_end == -1:
+        raise WarcFormatError('No record header at offset {}'.format(offset))
+
+    fields_start = buffer.find(b'\n', offset, header_end + 2) + 1
+    if not buffer[offset:offset + 5] == b'WARC/':
+        raise WarcFormatError('Expected WARC version line at offset {}, got {!r}'
+                              .format(offset, buffer[offset:offset + 40]))
+
+    record_type, header = parse_header_bytes(buffer[fields_start:header_end + 2],
+                                             buffer[offset:fields_start])
+
+    try:
+        length = int(header.fields['Content-Length'])
+    except (KeyError, ValueError):
+        raise WarcFormatError('Record at offset {} has no valid Content-Length'
+                              .format(offset))
+
+    start = header_end + 4
+    if start + length > len(buffer):
+        raise WarcFormatError('Record at offset {} is truncated'.format(offset))
+
+    block = MappedBlock(memoryview(buffer)[start:start + length])
+    record = Record(record_type, header=header, block=block)
+    record.offset = offset
+    record.length = start + length + 4 - offset
+
+    return record
+
+
+def read_record_at(path, offset):
+    """Return the record at the given offset of the given WARC file.
+
+    See :meth:`basc_warc.reader.MappedWarcFile.record_at`. The file is mapped for each
+    call, and unmapped once the record's block is no longer in use, so open a
+    :class:`basc_warc.reader.MappedWarcFile` instead to read many records.
+    """
+    with MappedWarcFile(path) as warc:
+        return warc.record_at(offset)
+
+
+def read_range(path, start=0, end=None):
+    """Yield the records of a WARC file that start within the given byte range.
+
+    ``start`` must be the offset of a record (of its gzip member, for gzipped files),
+    such as one from a CDX file.
+
+    Args:
+        path (str): Path of the WARC file.
+        start (int): Offset of the first record to read.
+        end (int): Stop at the first record starting at or after this offset, defaults
+            to the end of the file.
+    """
+    with open(path, 'rb') as fileobj:
+        fileobj.seek(start)
+        for record in WarcReader(fileobj, offset=start):
+            if end is not None and record.offset >= end:
+                return
+            yield record
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC repacking
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Merge, split and extract from WARC files by copying their records as they are.
+
+Like `megawarc <https://github.com/alard/megawarc>`_, records are copied byte for byte,
+so the gzip members of ``.warc.gz`` files are never decompressed and compressed again.
+"""
+import bisect
+import os
+
+from basc_warc import Record, cdx, utils
+from basc_warc.members import MemberIndex, iter_members, read_member_head
+from basc_warc.reader import GZIP_MAGIC, parse_record
+
+COPY_SIZE = 1024 * 1024
+
+# every CDX field we know how to fill in, used when reading and rewriting CDX lines
+ALL_FIELDS = 'N b a m s k r M S V g u'
+
+
+def cdx_path_for(path):
+    """Return the path of the CDX file written for a WARC file, ie:
+    ``example.warc.gz.cdx`` for ``example.warc.gz``, as
+    :class:`basc_warc.rotating.RotatingWarcWriter` names them.
+    """
+    return path + '.cdx'
+
+
+def _find_cdx(path):
+    """Return the path of a WARC file's CDX file, or None if it doesn't have one.
+
+    Both ``example.warc.gz.cdx`` and ``example.cdx`` (as wget names them) are looked for.
+    """
+    base = path
+    for suffix in ('.gz', '.warc'):
+        if base.endswith(suffix):
+            base = base[:-len(suffix)]
+
+    for cdx_path in (cdx_path_for(path), base + '.cdx'):
+        if os.path.exists(cdx_path):
+            return cdx_path
+    return None
+
+
+def _copy(fileobj, out_fileobj, start, end):
+    """Copy bytes ``start`` to ``end`` of one file to the current position of another.
+
+    The copy is done inside the kernel where possible, see
+    :func:`basc_warc.utils.copy_fd_range`.
+    """
+    length = end - start
+    out_fileobj.flush()
+    position = out_fileobj.tell()
+
+    if not utils.copy_fd_range(fileobj.fileno(), out_fileobj.fileno(), start, length):
+        fileobj.seek(start)
+        copied = 0
+        while copied < length:
+            data = fileobj.read(min(COPY_SIZE, length - copied))
+            if not data:
+                raise IOError('Unexpected end of file copying bytes {}-{}'.format(start, end))
+            out_fileobj.write(data)
+            copied += len(data)
+
+    out_fileobj.seek(position + length)
+
+
+def _is_gzipped(path):
+    with open(path, 'rb') as fileobj:
+        return fileobj.read(2) == GZIP_MAGIC
+
+
+def _complete_index(path, index=None):
+    """Return a complete member index for a file, building one if needed."""
+    if index is None or not index.complete:
+        index = MemberIndex.load(path)
+    if index is None or not index.complete:
+        index = MemberIndex.build(path)
+    return index
+
+
+# cdx entries
+def _parse_cdx_line(line, fields):
+    values = dict(zip(fields, line.decode('utf8').split()))
+    if 'N' not in values and values.get('a', '-') != '-':
+        values['N'] = cdx.surt(values['a'])
+    return values
+
+
+def _read_cdx(cdx_path, filename):
+    """Return the CDX field values of each line in a CDX file for the given WARC file.
+
+    Returns None if the CDX file doesn't give the offset of every record.
+    """
+    fields = cdx.DEFAULT_FIELDS.split()
+    entries = []
+
+    with open(cdx_path, 'rb') as fileobj:
+        for line in fileobj:
+            if line.startswith(b' CDX '):
+                fields = line.decode('utf8').split()[1:]
+                continue
+            if 'V' not in fields:
+                return None
+            if len(line.split()) != len(fields):
+                continue
+            values = _parse_cdx_line(line, fields)
+            if values.get('g', filename) != filename:
+                continue
+            try:
+                int(values['V'])
+            except ValueError:
+                return None
+            entries.append(values)
+
+    return entries
+
+
+def _member_digest(fileobj, offset, record):
+    """Calculate the payload (or block) digest of the record in a member."""
+    fileobj.seek(offset)
+    for member_offset, length, data in iter_members(fileobj, offset, offset + 1):
+        block = parse_record(data, len(data) - len(data.lstrip(b'\r\n'))).block
+        digester = utils.Digester(record.digest_algorithm, payload=record.has_http_payload())
+        digester.update(block.bytes())
+        return digester.payload_digest() or digester.block_digest()
+
+
+def _member_values(fileobj, offset, length, record_type, header, block_start, filename):
+    """Return the CDX field values of the record in a member, from its header."""
+    record = Record(record_type, header=header)
+    fields = header.fields
+
+    digest = None
+    if record.has_http_payload():
+        known_digest = fields.get('WARC-Payload-Digest')
+    else:
+        known_digest = fields.get('WARC-Block-Digest')
+    if not known_digest:
+        digest = _member_digest(fileobj, offset, record)
+
+    return cdx.record_fields(record, offset, length, filename, http_header=block_start,
+                             digest=digest)
+
+
+def _scan(fileobj, path, index):
+    """Yield ``(offset, length, record_type, header, block_start)`` for each member."""
+    for offset, length in _complete_index(path, index).members():
+        record_type, header, block_start = read_member_head(
+            fileobj, offset, offset + length, http_header=True)
+        yield offset, length, record_type, header, block_start
+
+
+def scan_members(path, index=None, record_types=cdx.DEFAULT_RECORD_TYPES):
+    """Yield the gzip members of a ``.warc.gz`` file, and the CDX values of their records.
+
+    Only the record header and HTTP header at the start of each member are
+    decompressed, unless a record has no digest in its header.
+
+    Args:
+        path (str): Path of the ``.warc.gz`` file.
+        index (MemberIndex): Complete index of the file's members, defaults to a saved
+            one or else one built by decompressing the file.
+        record_types (list of str): Types of records to return CDX values for.
+
+    Yields:
+        ``(offset, length, record_type, header, values)`` tuples, where ``values`` is a
+        dict of CDX field values (see :func:`basc_warc.cdx.record_fields`), or None for
+        records of other types.
+    """
+    filename = os.path.basename(path)
+
+    with open(path, 'rb') as fileobj:
+        for offset, length, record_type, header, block_start in _scan(fileobj, path, index):
+            values = None
+            if record_type in record_types:
+                values = _member_values(fileobj, offset, length, record_type, header,
+                                        block_start, filename)
+
+            yield offset, length, record_type, header, values
+
+
+def cdx_entries(path, index=None, record_types=cdx.DEFAULT_RECORD_TYPES):
+    """Return the CDX field values of the records in a WARC file, in file order.
+
+    The values are taken from the file's CDX file if it has one that gives the offset of
+    every record, named either as :func:`cdx_path_for` names them or as wget does
+    (``example.cdx`` for ``example.warc.gz``). Otherwise, the headers of a ``.warc.gz``
+    file's members are scanned with :func:`scan_members`, or an uncompressed file is
+    indexed with :func:`basc_warc.cdx.index_warc`.
+
+    Returns:
+        List of dicts of CDX field values, keyed by field letter.
+    """
+    filename = os.path.basename(path)
+
+    entries = None
+    cdx_path = _find_cdx(path)
+    if cdx_path is not None:
+        entries = _read_cdx(cdx_path, filename)
+
+    if entries is None and _is_gzipped(path):
+        entries = [values for offset, length, record_type, header, values
+                   in scan_members(path, index, record_types) if values is not None]
+
+    if entries is None:
+        fields = ALL_FIELDS.split()
+        with open(path, 'rb') as fileobj:
+            entries = [_parse_cdx_line(line.encode('utf8'), fields) for line
+                       in cdx.index_warc(fileobj, filename, ALL_FIELDS, record_types)]
+
+    entries.sort(key=lambda values: int(values['V']))
+    return entries
+
+
+class _CdxOutput(object):
+    """CDX file for a WARC file being written, see :class:`basc_warc.cdx.CdxWriter`."""
+
+    def __init__(self, path, fields):
+        self.filename = os.path.basename(path)
+        self.fields = fields
+        self.fileobj = open(cdx_path_for(path), 'wb')
+        self.writer = cdx.CdxWriter(self.fileobj, self.filename, fields)
+
+    def add(self, values, offset):
+        """Write a CDX line for a record that was copied to the given offset."""
+        values = dict(values)
+        values['V'] = str(offset)
+        values['g'] = self.filename
+        self.writer.write_line(cdx.format_line(values, self.fields))
+
+    def close(self):
+        self.fileobj.close()
+
+
+# repacking
+def merge_warcs(paths, out_path, fields=cdx.DEFAULT_FIELDS,
+                record_types=cdx.DEFAULT_RECORD_TYPES, write_cdx=True):
+    """Combine WARC files into one, copying each file's bytes as they are.
+
+    A CDX file for the merged file is written alongside it (see :func:`cdx_path_for`),
+    with each record's new offset. Lines are taken from each input's own CDX file where
+    there is one, so the inputs don't have to be read at all, see :func:`cdx_entries`.
+
+    Args:
+        paths (list of str): Paths of the WARC files, either all gzipped or all
+            uncompressed.
+        out_path (str): Path of the merged WARC file.
+        fields (str): CDX fields to write.
+        record_types (list of str): Types of records to index, for inputs that don't
+            have a CDX file.
+        write_cdx (bool): Write a CDX file for the merged file.
+
+    Returns:
+        List of the offsets each input file was copied to.
+    """
+    if len(set(_is_gzipped(path) for path in paths)) > 1:
+        raise ValueError('Cannot merge gzipped and uncompressed WARC files together')
+
+    offsets = []
+    cdx_output = _CdxOutput(out_path, fields) if write_cdx else None
+
+    try:
+        with open(out_path, 'wb') as out_fileobj:
+            for path in paths:
+                start = out_fileobj.tell()
+                offsets.append(start)
+
+                with open(path, 'rb') as fileobj:
+                    _copy(fileobj, out_fileobj, 0, os.path.getsize(path))
+
+                if cdx_output is not None:
+                    for values in cdx_entries(path, record_types=record_types):
+                        cdx_output.add(values, start + int(values['V']))
+    finally:
+        if cdx_output is not None:
+            cdx_output.close()
+
+    return offsets
+
+
+def _size_parts(index, max_size):
+    """Return ``(start, end)`` ranges of at most ``max_size`` bytes, split at members.
+
+    Ranges are only larger if they hold a single larger member.
+    """
+    parts = []
+    start = 0
+    previous = 0
+    for offset in index.offsets:
+        if offset - start > max_size and previous > start:
+            parts.append((start, previous))
+            start = previous
+        previous = offset
+    if index.size - start > max_size and previous > start:
+        parts.append((start, previous))
+        start = previous
+    parts.append((start, index.size))
+    return parts
+
+
+def split_warc(path, out_template, max_size=None, by_type=False, index=None,
+               fields=cdx.DEFAULT_FIELDS, record_types=cdx.DEFAULT_RECORD_TYPES,
+               write_cdx=True):
+    """Split a ``.warc.gz`` file into smaller ones, by size or by record type.
+
+    Gzip members are copied as they are, and each new file gets a CDX file alongside
+    it, see :func:`cdx_path_for`. Splitting only by size doesn't decompress anything if
+    the file has a CDX file or a saved :class:`basc_warc.members.MemberIndex`.
+    Splitting by record type decompresses the record header at the start of each
+    member, see :func:`scan_members`.
+
+    Args:
+        path (str): Path of the ``.warc.gz`` file.
+        out_template (str): Path of each new file, formatted with ``number`` (counting
+            from 1, for each record type) and ``type``, ie:
+            ``'example-{type}-{number:05d}.warc.gz'``.
+        max_size (int): Maximum size of each new file. Files are only larger if they
+            hold a single larger record (or, with an index taken from a CDX file, a run
+            of records that aren't in it).
+        by_type (bool): Put each type of record in separate files.
+        index (MemberIndex): Index of the file's gzip members.
+        fields (str): CDX fields to write.
+        record_types (list of str): Types of records to index.
+        write_cdx (bool): Write a CDX file for each new file.
+
+    Returns:
+        List of the paths of the new files.
+    """
+    if not _is_gzipped(path):
+        raise ValueError('{} is not gzipped'.format(path))
+    if by_type:
+        return _split_by_type(path, out_template, max_size, index, fields, record_types,
+                              write_cdx)
+    if max_size is None:
+        raise ValueError('Either max_size or by_type must be given')
+
+    if index is None:
+        index = MemberIndex.load(path)
+    if index is None and _find_cdx(path) is not None:
+        index = MemberIndex.from_cdx(path, _find_cdx(path))
+    if index is None:
+        index = MemberIndex.build(path)
+
+    parts = _size_parts(index, max_size)
+    entries = cdx_entries(path, index, record_types) if write_cdx else []
+    entry_offsets = [int(values['V']) for values in entries]
+
+    out_paths = []
+    with open(path, 'rb') as fileobj:
+        for number, (start, end) in enumerate(parts, 1):
+            out_path = out_template.format(number=number, type='all')
+            out_paths.append(out_path)
+
+            with open(out_path, 'wb') as out_fileobj:
+                _copy(fileobj, out_fileobj, start, end)
+
+            if write_cdx:
+                cdx_output = _CdxOutput(out_path, fields)
+                try:
+                    first = bisect.bisect_left(entry_offsets, start)
+                    last = bisect.bisect_left(entry_offsets, end)
+                    for values in entries[first:last]:
+                        cdx_output.add(values, int(values['V']) - start)
+                finally:
+                    cdx_output.close()
+
+    return out_paths
+
+
+class _Output(object):
+    """New file being written by :func:`split_warc` or :func:`extract_records`."""
+
+    def __init__(self, out_path, fields, write_cdx):
+        self.path = out_path
+        self.fileobj = open(out_path, 'wb')
+        self.cdx_output = _CdxOutput(out_path, fields) if write_cdx else None
+
+    def close(self):
+        self.fileobj.close()
+        if self.cdx_output is not None:
+            self.cdx_output.close()
+
+
+def _copy_member(fileobj, output, offset, length, record_type, header, block_start,
+                 filename, record_types):
+    """Copy a member to an output, and index it if it's one of ``record_types``."""
+    new_offset = output.fileobj.tell()
+    _copy(fileobj, output.fileobj, offset, offset + length)
+
+    if output.cdx_output is not None and record_type in record_types:
+        values = _member_values(fileobj, offset, length, record_type, header, block_start,
+                                filename)
+        output.cdx_output.add(values, new_offset)
+
+
+def _split_by_type(path, out_template, max_size, index, fields, record_types, write_cdx):
+    filename = os.path.basename(path)
+
+    # record type -> (number, output)
+    outputs = {}
+    out_paths = []
+
+    try:
+        with open(path, 'rb') as fileobj:
+            for offset, length, record_type, header, block_start in _scan(fileobj, path,
+                                                                          index):
+                number, output = outputs.get(record_type, (0, None))
+
+                if output is None or (max_size is not None and output.fileobj.tell() and
+                                      output.fileobj.tell() + length > max_size):
+                    if output is not None:
+                        output.close()
+                    number += 1
+                    output = _Output(out_template.format(number=number, type=record_type),
+                                     fields, write_cdx)
+                    outputs[record_type] = (number, output)
+                    out_paths.append(output.path)
+
+                _copy_member(fileobj, output, offset, length, record_type, header,
+                             block_start, filename, record_types)
+    finally:
+        for number, output in outputs.values():
+            output.close()
+
+    return out_paths
+
+
+def extract_records(path, out_path, query, index=None, fields=cdx.DEFAULT_FIELDS,
+                    record_types=cdx.DEFAULT_RECORD_TYPES, write_cdx=True):
+    """Copy the records of a ``.warc.gz`` file that match a query into a new file.
+
+    Records are selected by their headers, see :class:`basc_warc.query.Query`, and
+    their gzip members are copied as they are. A CDX file is written alongside the new
+    file, see :func:`cdx_path_for`.
+
+    Args:
+        path (str): Path of the ``.warc.gz`` file.
+        out_path (str): Path of the new file.
+        query (:class:`basc_warc.query.Query`): Query the records must match.
+        index (MemberIndex): Complete index of the file's gzip members.
+        fields (str): CDX fields to write.
+        record_types (list of str): Types of records to index.
+        write_cdx (bool): Write a CDX file for the new file.
+
+    Returns:
+        Number of records copied.
+    """
+    if not _is_gzipped(path):
+        raise ValueError('{} is not gzipped'.format(path))
+
+    filename = os.path.basename(path)
+    count = 0
+    output = _Output(out_path, fields, write_cdx)
+
+    try:
+        with open(path, 'rb') as fileobj:
+            for offset, length, record_type, header, block_start in _scan(fileobj, path,
+                                                                          index):
+                if not query.matches_header(record_type, header):
+                    continue
+
+                _copy_member(fileobj, output, offset, length, record_type, header,
+                             block_start, filename, record_types)
+                count += 1
+    finally:
+        output.close()
+
+    return count
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC rotating writer
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Write a stream of records into a series of size-limited WARC files."""
+import datetime
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from basc_warc import WarcWriter
+from basc_warc.cdx import CdxWriter
+from basc_warc.segments import segment_record
+
+DEFAULT_TEMPLATE = '{prefix}-{timestamp}-{serial:05d}.warc{extension}'
+OPEN_SUFFIX = '.open'
+
+
+class RotatingWarcWriter(object):
+    """Writes records into a series of WARC files, starting a new one as each fills up.
+
+    Each file starts with its own ``warcinfo`` record. Files are written with an
+    ``.open`` suffix, and once a file is full it's finalized (flushed, fsynced, closed,
+    and renamed to drop the suffix) on a background thread, so adding records doesn't
+    stall while the old file is being finished off.
+
+    Records passed to a single :meth:`add_records` call are always written to the same
+    file, so related records stay together.
+
+    With ``segment_size`` set, records with larger blocks are split into segments (see
+    :func:`basc_warc.segments.segment_record`). The first segment is written with the
+    other records, and each continuation record after it, starting a new file whenever
+    one fills up. Other threads can add records between continuations, so a huge record
+    doesn't hold up rotation or other writers.
+
+    Args:
+        prefix (string): Prefix for filenames.
+        directory (string): Directory to write files into.
+        max_size (int): Start a new file once the current one is at least this many bytes.
+        max_records (int): Start a new file once the current one has this many records.
+        compress_records (bool): Write each record as its own gzip member.
+        compression_level (int): gzip compression level, from 1 (fastest) to 9 (smallest).
+        executor (concurrent.futures.Executor): Thread or process pool to compress records on.
+        warcinfo (dict): Keyword arguments for the
+            :meth:`basc_warc.WarcFile.add_warcinfo_record` call that starts each file.
+        cdx (bool): Also write a CDX file alongside each WARC file, as records are written.
+        template (string): Format string for filenames, given ``prefix``, ``timestamp``,
+            ``serial`` and ``extension``.
+        on_finalize (callable): Called as ``on_finalize(path)`` on the background thread
+            once a file is finalized.
+        segment_size (int): Split records with blocks larger than this many bytes into
+            segments.
+    """
+
+    def __init__(self, prefix, directory='.', max_size=1000000000, max_records=None,
+                 compress_records=True, compression_level=6, executor=None,
+                 warcinfo=None, cdx=False, template=DEFAULT_TEMPLATE, on_finalize=None,
+                 segment_size=None):
+        self.prefix = prefix
+        self.directory = directory
+        self.max_size = max_size
+        self.max_records = max_records
+        self.compress_records = compress_records
+        self.compression_level = compression_level
+        self.executor = executor
+        self.warcinfo = warcinfo or {}
+        self.cdx = cdx
+        self.template = template
+        self.on_finalize = on_finalize
+        self.segment_size = segment_size
+
+        self.serial = 0
+        self.writer = None
+        self.path = None
+        self._cdx_file = None
+
+        self._lock = threading.Lock()
+        self._finalizer = ThreadPoolExecutor(max_workers=1)
+        self._finalizing = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _next_filename(self):
+        self.serial += 1
+        return self.template.format(
+            prefix=self.prefix,
+            timestamp=datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S'),
+            serial=self.serial,
+            extension='.gz' if self.compress_records else '',
+        )
+
+    def _open(self):
+        """Start a new WARC file."""
+        filename = self._next_filename()
+        self.path = os.path.join(self.directory, filename)
+
+        on_write = None
+        if self.cdx:
+            self._cdx_file = open(self.path + '.cdx' + OPEN_SUFFIX, 'wb')
+            on_write = CdxWriter(self._cdx_file, filename).add_record
+
+        fileobj = open(self.path + OPEN_SUFFIX, 'wb')
+        self.writer = WarcWriter(fileobj, compress_records=self.compress_records,
+                                 compression_level=self.compression_level,
+                                 executor=self.executor, on_write=on_write)
+        self.writer.add_warcinfo_record(filename=filename, **self.warcinfo)
+
+    def _full(self):
+        if self.max_size and self.writer.offset >= self.max_size:
+            return True
+        if self.max_records and self.writer.record_count >= self.max_records:
+            return True
+        return False
+
+    def _rotate(self):
+        """Hand the current file off to be finalized in the background."""
+        if self.writer is None:
+            return
+        future = self._finalizer.submit(_finalize, self.writer, self.path, self._cdx_file,
+                                        self.on_finalize)
+        self._finalizing.append(future)
+        self._finalizing = [f for f in self._finalizing if not f.done() or f.exception()]
+
+        self.writer = None
+        self.path = None
+        self._cdx_file = None
+
+    def add_record(self, record):
+        """Add the given Record to the current WARC file.
+
+        Returns:
+            Tuple of ``(path, offset)`` of the written record.
+        """
+        path, offsets = self.add_records(record)
+        return path, offsets[0]
+
+    def add_records(self, *records):
+        """Add the given Records to the current WARC file, keeping them together.
+
+        Returns:
+            Tuple of ``(path, offsets)`` of the written records (of their first
+            segments, for segmented records).
+        """
+        continuations = []
+        if self.segment_size:
+            first_segments = []
+            for record in records:
+                segments = segment_record(record, self.segment_size)
+                first_segments.append(next(segments))
+                continuations.append(segments)
+            records = first_segments
+
+        path, offsets = self._write(records)
+
+        for segments in continuations:
+            for segment in segments:
+                self._write((segment,))
+
+        return path, offsets
+
+    def _write(self, records):
+        with self._lock:
+            if self.writer is None:
+                self._open()
+
+            path = self.path
+            offsets = self.writer.add_records(*records)
+
+            if self._full():
+                self._rotate()
+
+        return path, offsets
+
+    def rotate(self):
+        """Finish the current WARC file now, the next record will start a new one."""
+        with self._lock:
+            self._rotate()
+
+    def close(self):
+        """Finalize the current WARC file and wait for all files to be finalized.
+
+        Raises the first error encountered while finalizing any file.
+        """
+        with self._lock:
+            self._rotate()
+            finalizing = self._finalizing
+            self._finalizing = []
+
+        self._finalizer.shutdown(wait=True)
+        for future in finalizing:
+            future.result()
+
+
+def _finalize(writer, path, cdx_file, on_finalize):
+    """Flush, fsync, close and rename a finished WARC file (and its CDX file)."""
+    writer.flush()
+    os.fsync(writer.fileobj.fileno())
+    writer.fileobj.close()
+    os.rename(path + OPEN_SUFFIX, path)
+
+    if cdx_file is not None:
+        cdx_file.flush()
+        os.fsync(cdx_file.fileno())
+        cdx_file.close()
+        os.rename(path + '.cdx' + OPEN_SUFFIX, path + '.cdx')
+
+    if on_finalize is not None:
+        on_finalize(path)
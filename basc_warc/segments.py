@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC segmented records
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Split large records into segments, and put them back together when reading."""
+from basc_warc import CHUNK_SIZE, FileBlock, Record, RecordBlock, RecordHeader, utils
+from basc_warc.reader import MappedWarcFile, WarcReader
+
+# fields describing a segment, rather than the whole record
+SEGMENT_FIELDS = ('WARC-Segment-Number', 'WARC-Segment-Origin-ID',
+                  'WARC-Segment-Total-Length', 'WARC-Block-Digest', 'Content-Length')
+
+
+def _slice_block(block, start, length):
+    """Return a block holding ``length`` bytes of the given block, from ``start``."""
+    if isinstance(block, FileBlock):
+        return FileBlock(path=block.path, fileobj=block.fileobj,
+                         offset=block.offset + start, length=length)
+    return RecordBlock(memoryview(block.bytes())[start:start + length])
+
+
+def segment_record(record, segment_size):
+    """Split a record into segments with blocks of at most ``segment_size`` bytes.
+
+    Yields the first segment, a record of the original type with
+    ``WARC-Segment-Number: 1``, followed by ``continuation`` records. The first segment
+    keeps the ``WARC-Payload-Digest`` of the whole payload, and the last continuation
+    has the ``WARC-Segment-Total-Length`` of the whole block. File-backed blocks are
+    split without being read into memory.
+
+    Records whose blocks already fit are yielded unchanged.
+
+    Args:
+        record (:class:`basc_warc.Record`): Record to split.
+        segment_size (int): Maximum length of each segment's block.
+    """
+    total = record.block.length()
+    if total <= segment_size:
+        yield record
+        return
+
+    # digests of the whole block, so the payload digest can be kept
+    record.prepare()
+    fields = record.header.fields
+
+    header = RecordHeader(fields)
+    for name in SEGMENT_FIELDS:
+        if name in header.fields:
+            del header.fields[name]
+    header.set_field('WARC-Segment-Number', 1)
+
+    origin_id = header.record_id
+    yield Record(record.record_type, header=header,
+                 block=_slice_block(record.block, 0, segment_size),
+                 digest_algorithm=record.digest_algorithm)
+
+    number = 1
+    for start in range(segment_size, total, segment_size):
+        number += 1
+        length = min(segment_size, total - start)
+
+        header = RecordHeader({
+            'WARC-Record-ID': utils.uuid_urn(),
+            'WARC-Date': fields.get('WARC-Date'),
+            'WARC-Segment-Origin-ID': origin_id,
+            'WARC-Segment-Number': number,
+        })
+        if fields.get('WARC-Target-URI'):
+            header.set_field('WARC-Target-URI', fields.get('WARC-Target-URI'))
+        if start + length == total:
+            header.set_field('WARC-Segment-Total-Length', total)
+
+        yield Record('continuation', header=header,
+                     block=_slice_block(record.block, start, length),
+                     digest_algorithm=record.digest_algorithm)
+
+
+class SegmentedBlock(object):
+    """Block of a reassembled segmented record.
+
+    Nothing is read until the block is, then each segment's block is read from its
+    WARC file in turn.
+
+    Args:
+        segments (list of tuples): ``(path, offset, length)`` of each segment record,
+            in order, where ``length`` is the length of its block.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self._digests = {}
+
+    def chunks(self, size=CHUNK_SIZE):
+        """Yield the content in chunks of at most ``size`` bytes."""
+        for path, offset, length in self.segments:
+            with MappedWarcFile(path) as warc:
+                block = warc.record_at(offset).block
+                if hasattr(block, 'chunks'):
+                    for chunk in block.chunks(size):
+                        yield chunk
+                else:
+                    view = memoryview(block.bytes())
+                    for start in range(0, len(view), size):
+                        yield view[start:start + size]
+
+    def write_to(self, fileobj):
+        """Write the content to the given file object.
+
+        Returns:
+            Number of bytes written.
+        """
+        for chunk in self.chunks():
+            fileobj.write(chunk)
+        return self.length()
+
+    def digests(self, algorithm, payload):
+        """Return the ``(block digest, payload digest)`` of the content.
+
+        See :meth:`basc_warc.FileBlock.digests`.
+        """
+        key = (algorithm, payload)
+        if key not in self._digests:
+            digester = utils.Digester(algorithm, payload=payload)
+            for chunk in self.chunks():
+                digester.update(chunk)
+            self._digests[key] = (digester.block_digest(), digester.payload_digest())
+        return self._digests[key]
+
+    def bytes(self):
+        """Return bytes to write.
+
+        This reads the whole block into memory, so :meth:`chunks` should be used instead
+        where possible.
+        """
+        return bytes().join(bytes(chunk) for chunk in self.chunks())
+
+    def length(self):
+        """Return length in bytes."""
+        return sum(length for path, offset, length in self.segments)
+
+
+def _reassemble(origin, segments):
+    header = RecordHeader(origin.header.fields)
+    for name in SEGMENT_FIELDS:
+        if name in header.fields:
+            del header.fields[name]
+
+    segments.sort()
+    block = SegmentedBlock([segment[1:] for segment in segments])
+    header.set_field('Content-Length', block.length())
+
+    record = Record(origin.record_type, header=header, block=block)
+    record.offset = origin.offset
+    return record
+
+
+def read_reassembled(paths):
+    """Yield the records in a series of WARC files, reassembling segmented records.
+
+    Segmented records are yielded once their last continuation record has been read,
+    with a :class:`basc_warc.segments.SegmentedBlock` that reads their content from
+    each segment when needed. The first segment's ``offset`` is kept. Other records are
+    yielded as they're read, as with a :class:`basc_warc.reader.WarcReader`.
+
+    Segmented records that are missing their last continuation are yielded at the end,
+    with the segments that were found. Continuation records whose first segment wasn't
+    found are yielded as they are.
+
+    Args:
+        paths (list of str): Paths of the WARC files, in the order they were written.
+    """
+    # origin record id -> [origin record, [(number, path, offset, length), ...]]
+    pending = {}
+
+    for path in paths:
+        with open(path, 'rb') as fileobj:
+            for record in WarcReader(fileobj):
+                fields = record.header.fields
+                number = fields.get('WARC-Segment-Number')
+                if number is None:
+                    yield record
+                    continue
+
+                segment = (int(number), path, record.offset, record.block.length())
+
+                if record.record_type != 'continuation':
+                    pending[fields.get('WARC-Record-ID')] = [record, [segment]]
+                    continue
+
+                origin_id = fields.get('WARC-Segment-Origin-ID')
+                if origin_id not in pending:
+                    yield record
+                    continue
+
+                pending[origin_id][1].append(segment)
+                if 'WARC-Segment-Total-Length' in fields:
+                    origin, segments = pending.pop(origin_id)
+                    yield _reassemble(origin, segments)
+
+    for origin, segments in pending.values():
+        yield _reassemble(origin, segments)
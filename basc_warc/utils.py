@@ -12,11 +12,40 @@
 # <http://creativecommons.org/publicdomain/zero/1.0/>.
 """Utility functions used by basc_warc."""
 from datetime import datetime
-import collections
+import base64
+import errno
+import hashlib
+import os
+import re
+import struct
 import uuid
+import zlib
+
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:
+    from collections import Mapping, MutableMapping
 
 import iso8601
 
+try:
+    from sys import intern as _intern
+except ImportError:
+    _intern = intern
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+# strings
+def intern(string):
+    """Intern the given string if possible, so repeated names share memory."""
+    if type(string) is str:
+        return _intern(string)
+    return string
+
 
 # identifiers
 def uuid_urn():
@@ -25,41 +54,419 @@ def uuid_urn():
 
 
 # content digest
-def content_digest(content):
-    raise NotImplementedError
+class _Crc32(object):
+    """hashlib-style wrapper around :func:`zlib.crc32`."""
+
+    name = 'crc32'
+
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = zlib.crc32(data, self._value)
+
+    def digest(self):
+        return struct.pack('>I', self._value & 0xffffffff)
+
+
+DIGEST_ALGORITHMS = {
+    'sha1': hashlib.sha1,
+    'sha256': hashlib.sha256,
+    'crc32': _Crc32,
+}
+if xxhash is not None:
+    DIGEST_ALGORITHMS['xxh64'] = xxhash.xxh64
+
+
+def new_hash(algorithm='sha1'):
+    """Return a new hash object for the given digest algorithm.
+
+    Args:
+        algorithm (str): One of ``'sha1'``, ``'sha256'``, ``'crc32'`` or ``'xxh64'`` (if
+            `xxhash <https://pypi.python.org/pypi/xxhash>`_ is installed). ``'crc32'`` and
+            ``'xxh64'`` are not cryptographic, and are only useful for quickly screening
+            content for duplicates.
+    """
+    try:
+        return DIGEST_ALGORITHMS[algorithm]()
+    except KeyError:
+        raise ValueError('Unknown digest algorithm: {}'.format(algorithm))
+
+
+def format_digest(algorithm, digest):
+    """Return a WARC-style digest string (``algorithm:BASE32``) for the given raw digest."""
+    return '{}:{}'.format(algorithm, base64.b32encode(digest).decode('ascii'))
+
+
+def content_digest(content, algorithm='sha1'):
+    """Return a WARC-style digest of the given content, ie: ``sha1:BASE32DIGEST``.
+
+    Args:
+        content (bytes or iterable of bytes): Content to digest. An iterable of chunks is
+            hashed incrementally, so the content never needs to be in memory all at once.
+        algorithm (str): Digest algorithm to use, see :func:`new_hash`.
+    """
+    digest = new_hash(algorithm)
+
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        digest.update(content)
+    else:
+        for chunk in content:
+            digest.update(chunk)
+
+    return format_digest(algorithm, digest.digest())
+
+
+MAX_CHUNK_LINE = 8192
+MAX_HTTP_HEADER = 64 * 1024
+_CHUNKED_RE = re.compile(br'(?im)^transfer-encoding:[ \t]*(?:[^\r\n]*,[ \t]*)?chunked[ \t]*\r?$')
+
+
+class ChunkedDecoder(object):
+    """Incrementally removes HTTP chunked transfer-encoding from a message body."""
+
+    def __init__(self):
+        self._state = 'size'
+        self._line = bytes()
+        self._remaining = 0
+
+    @property
+    def done(self):
+        """Whether the last chunk (and any trailer) has been seen."""
+        return self._state == 'done'
+
+    def decode(self, data):
+        """Decode the given part of a chunked body.
+
+        Returns:
+            List of decoded pieces of the body.
+        """
+        data = memoryview(data)
+        out = []
+        pos = 0
+
+        while pos < len(data) and self._state != 'done':
+            if self._state == 'data':
+                piece = data[pos:pos + self._remaining]
+                out.append(piece)
+                pos += len(piece)
+                self._remaining -= len(piece)
+                if not self._remaining:
+                    self._state = 'data-end'
+                continue
+
+            # the other states are all line-based
+            end = bytes(data[pos:pos + MAX_CHUNK_LINE]).find(b'\n')
+            if end == -1:
+                self._line += bytes(data[pos:])
+                if len(self._line) > MAX_CHUNK_LINE:
+                    raise ValueError('Chunk size line is too long')
+                break
+            line = (self._line + bytes(data[pos:pos + end])).strip()
+            self._line = bytes()
+            pos += end + 1
+
+            if self._state == 'size':
+                try:
+                    size = int(line.split(b';', 1)[0], 16)
+                except ValueError:
+                    raise ValueError('Invalid chunk size: {!r}'.format(line[:40]))
+                if size:
+                    self._remaining = size
+                    self._state = 'data'
+                else:
+                    self._state = 'trailer'
+            elif self._state == 'data-end':
+                self._state = 'size'
+            elif self._state == 'trailer' and not line:
+                self._state = 'done'
+
+        return out
+
+
+class Digester(object):
+    """Incrementally calculates block and payload digests in a single pass.
+
+    The payload of a block is everything after the first blank line (the end of the
+    HTTP headers), as used for ``WARC-Payload-Digest``. If the headers say the body uses
+    chunked transfer-encoding, the payload digest is of the de-chunked body.
+
+    Args:
+        algorithm (str): Digest algorithm to use, see :func:`new_hash`.
+        payload (bool): Whether to calculate a payload digest as well.
+    """
+
+    def __init__(self, algorithm='sha1', payload=False):
+        self.algorithm = algorithm
+        self._block = new_hash(algorithm)
+        self._payload = new_hash(algorithm) if payload else None
+
+        # the HTTP headers seen so far, while we look for the blank line that ends them
+        self._in_payload = False
+        self._head = bytearray()
+        self._dechunker = None
+
+    @property
+    def calculates_payload(self):
+        """Whether a payload digest is being calculated."""
+        return self._payload is not None
+
+    def update(self, chunk):
+        """Add a chunk of the block to the digests."""
+        self._block.update(chunk)
+
+        if self._payload is None:
+            return
+
+        if self._in_payload:
+            self._update_payload(chunk)
+            return
+
+        if len(self._head) > MAX_HTTP_HEADER:
+            # not an HTTP message we understand, so there's no payload
+            return
+
+        searched = max(0, len(self._head) - 3)
+        self._head += chunk
+        end = self._head.find(b'\r\n\r\n', searched)
+        if end != -1:
+            self._in_payload = True
+            if _CHUNKED_RE.search(bytes(self._head[:end])):
+                self._dechunker = ChunkedDecoder()
+            self._update_payload(bytes(self._head[end + 4:]))
+            self._head = None
+
+    def _update_payload(self, data):
+        if self._dechunker is None:
+            self._payload.update(data)
+        else:
+            for piece in self._dechunker.decode(data):
+                self._payload.update(piece)
+
+    def block_digest(self):
+        """Return the WARC-style digest of the block."""
+        return format_digest(self.algorithm, self._block.digest())
+
+    def payload_digest(self):
+        """Return the WARC-style digest of the payload, or None if there isn't one."""
+        if self._payload is None or not self._in_payload:
+            return None
+        return format_digest(self.algorithm, self._payload.digest())
+
+
+def http_payload(chunks):
+    """Yield the payload of an HTTP message, given the chunks of a record's block.
+
+    The payload is everything after the HTTP headers, de-chunked if the headers say it
+    uses chunked transfer-encoding. Nothing is yielded if the headers don't end.
+    """
+    head = bytearray()
+    dechunker = None
+    in_payload = False
+
+    for chunk in chunks:
+        if in_payload:
+            data = chunk
+        else:
+            searched = max(0, len(head) - 3)
+            head += chunk
+            end = head.find(b'\r\n\r\n', searched)
+            if end == -1:
+                if len(head) > MAX_HTTP_HEADER:
+                    return
+                continue
+            in_payload = True
+            if _CHUNKED_RE.search(bytes(head[:end])):
+                dechunker = ChunkedDecoder()
+            data = bytes(head[end + 4:])
+            head = None
+
+        if dechunker is None:
+            if data:
+                yield data
+        else:
+            for piece in dechunker.decode(data):
+                yield piece
+
+
+# compression
+def gzip_member(data, level=6):
+    """Compress the given bytes into a single gzip member.
+
+    Args:
+        data (bytes): Data to compress.
+        level (int): Compression level, from 1 (fastest) to 9 (smallest).
+
+    Returns:
+        Bytes of a complete gzip member.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def write_gzip_member(chunks, fileobj, level=6):
+    """Compress the given chunks into a single gzip member, writing it as it's compressed.
+
+    Args:
+        chunks (iterable of bytes): Data to compress.
+        fileobj: Binary file-like object to write to.
+        level (int): Compression level, from 1 (fastest) to 9 (smallest).
+
+    Returns:
+        Length of the compressed member.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    length = 0
+
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            fileobj.write(data)
+            length += len(data)
+
+    data = compressor.flush()
+    fileobj.write(data)
+    return length + len(data)
+
+
+# file copying
+def copy_fd_range(in_fd, out_fd, offset, length):
+    """Copy part of one file to the current position of another, inside the kernel.
+
+    Uses :func:`os.copy_file_range` or :func:`os.sendfile`, whichever is available and
+    works for these files.
+
+    Returns:
+        True if the data was copied, or False if neither could be used, in which case
+        nothing has been written.
+    """
+    copiers = []
+    if hasattr(os, 'copy_file_range'):
+        copiers.append(lambda count: os.copy_file_range(in_fd, out_fd, count,
+                                                        offset + copied))
+    if hasattr(os, 'sendfile'):
+        copiers.append(lambda count: os.sendfile(out_fd, in_fd, offset + copied, count))
+
+    copied = 0
+    for copier in copiers:
+        try:
+            while copied < length:
+                sent = copier(length - copied)
+                if not sent:
+                    raise IOError('File is shorter than the block length')
+                copied += sent
+            return True
+        except OSError as e:
+            # not supported for these files, fall back to the next method
+            if copied or e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EXDEV,
+                                         errno.EBADF, errno.ENOTSUP, errno.EOPNOTSUPP):
+                raise
+
+    return False
 
 
 # key sorting
 def sort_manual_keys(*sorted_keys):
-    """Create a key function that sorts the given keys first."""
-    _key_order = []
-    for key in sorted_keys:
+    """Create a key function that sorts the given keys first.
+
+    Other keys are sorted alphabetically after them, ignoring case.
+    """
+    _key_ranks = {}
+    for i, key in enumerate(sorted_keys):
         if hasattr(key, 'lower'):
             key = key.lower()
-        _key_order.append(key)
+        _key_ranks[key] = i
+
+    _other_rank = len(_key_ranks)
+
+    # sort keys of names we've seen, since the same few names are used over and over
+    _seen = {}
 
     def key_fn(key):
-        if hasattr(key, 'lower'):
-            key = key.lower()
+        try:
+            return _seen[key]
+        except (KeyError, TypeError):
+            pass
 
-        for i, sorted_key in enumerate(_key_order):
-            if key == sorted_key:
-                return '{}_{}'.format(i, key)
+        lowered = key.lower() if hasattr(key, 'lower') else key
+        sort_key = (_key_ranks.get(lowered, _other_rank), lowered)
 
-        return '{}_{}'.format(len(_key_order), key)
+        if len(_seen) < 1024:
+            try:
+                _seen[key] = sort_key
+            except TypeError:
+                pass
+
+        return sort_key
 
     return key_fn
 
 
 # timestamps
+MAX_CACHED_TIMESTAMPS = 4096
+_TIMESTAMP_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d+))?Z$')
+
+# timestamp -> datetime, as records read together tend to share timestamps
+_parsed_timestamps = {}
+
+# (second, formatted timestamp) of the last second formatted, as records written
+# together tend to share it
+_last_formatted = (None, None)
+
+
 def ts_to_datetime(timestamp):
-    """Convert a WARC timestamp (ISO8601 subset) to a DateTime object."""
-    return iso8601.parse_date(timestamp)
+    """Convert a WARC timestamp (ISO8601 subset) to a DateTime object in UTC.
+
+    WARC 1.1 timestamps with fractional seconds are supported. Recently converted
+    timestamps are cached.
+    """
+    if isinstance(timestamp, bytes):
+        timestamp = timestamp.decode('utf8')
+
+    date_time = _parsed_timestamps.get(timestamp)
+    if date_time is None:
+        match = _TIMESTAMP_RE.match(timestamp)
+        if match is None:
+            date_time = iso8601.parse_date(timestamp)
+        else:
+            fraction = match.group(7) or '0'
+            date_time = datetime(*[int(part) for part in match.group(1, 2, 3, 4, 5, 6)],
+                                 microsecond=int(fraction[:6].ljust(6, '0')),
+                                 tzinfo=iso8601.UTC)
+
+        if len(_parsed_timestamps) >= MAX_CACHED_TIMESTAMPS:
+            _parsed_timestamps.clear()
+        _parsed_timestamps[timestamp] = date_time
 
+    return date_time
 
-def datetime_to_ts(date_time):
-    """Convert a DateTime object into a WARC 1.0 timestamp."""
-    return date_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def datetime_to_ts(date_time, subsecond=False):
+    """Convert a DateTime object into a WARC timestamp.
+
+    Naive DateTime objects are taken to already be in UTC.
+
+    Args:
+        date_time (datetime): Date and time to convert.
+        subsecond (bool): Include microseconds, as allowed by WARC 1.1. WARC 1.0
+            timestamps are only precise to the second.
+    """
+    global _last_formatted
+
+    offset = date_time.utcoffset()
+    if offset:
+        date_time = date_time - offset
+
+    second = (date_time.year, date_time.month, date_time.day,
+              date_time.hour, date_time.minute, date_time.second)
+    last_second, formatted = _last_formatted
+    if second != last_second:
+        formatted = '{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}'.format(*second)
+        _last_formatted = (second, formatted)
+
+    if subsecond:
+        return '{}.{:06d}Z'.format(formatted, date_time.microsecond)
+    return formatted + 'Z'
 
 
 # field names / values
@@ -73,14 +480,19 @@ def writable_field_name(name):
     return out
 
 
-def writable_field_value(value):
-    """Given a field value, return a writable series of bytes."""
+def writable_field_value(value, subsecond=False):
+    """Given a field value, return a writable series of bytes.
+
+    Args:
+        value (str, int, datetime or bytes): Field value.
+        subsecond (bool): Write datetimes with microseconds, as allowed by WARC 1.1.
+    """
     if isinstance(value, str):
         out = bytes(value.encode('utf8'))
     elif isinstance(value, int):
         out = bytes(str(value).encode('utf8'))
     elif isinstance(value, datetime):
-        out = bytes(datetime_to_ts(value).encode('utf8'))
+        out = bytes(datetime_to_ts(value, subsecond=subsecond).encode('utf8'))
     elif isinstance(value, bytes):
         out = value
 
@@ -102,7 +514,7 @@ def writable_field_value(value):
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
-class CaseInsensitiveDict(collections.MutableMapping):
+class CaseInsensitiveDict(MutableMapping):
     """
     A case-insensitive ``dict``-like object.
     Implements all methods and operations of
@@ -157,7 +569,7 @@ class CaseInsensitiveDict(collections.MutableMapping):
         )
 
     def __eq__(self, other):
-        if isinstance(other, collections.Mapping):
+        if isinstance(other, Mapping):
             other = CaseInsensitiveDict(other)
         else:
             return NotImplemented
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC benchmark helpers
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Timing helpers shared by the benchmark scripts."""
+import time
+
+
+def time_call(fn):
+    """Call ``fn``, and return how many seconds it took."""
+    start = time.time()
+    fn()
+    return time.time() - start
+
+
+def report(label, count, seconds):
+    """Print how long something took, in total and per record."""
+    print('{:<36} {:>10.3f}s {:>10.3f}us/record'.format(
+        label, seconds, seconds / count * 1000000))
+
+
+def timed(label, count, fn):
+    """Call ``fn``, print how long it took for ``count`` records, and return the seconds."""
+    seconds = time_call(fn)
+    report(label, count, seconds)
+    return seconds
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# BASC-WARC synthetic corpus generator
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Generate synthetic WARC files shaped like the ones wget writes.
+
+The records are modelled on those in ``examples/wget/``: a warcinfo record, then
+request and response pairs, with response bodies whose sizes follow a configurable
+distribution. Some bodies are HTML-like text and the rest are random bytes, so
+compression behaves roughly as it does on a real crawl. The same seed always gives
+the same file.
+
+Usage: python benchmarks/corpus.py OUTPUT [--records N] [--sizes SPEC] [--no-compress]
+       [--seed SEED] [--binary-fraction FRACTION]
+
+Size specs are ``fixed:SIZE``, ``uniform:MIN-MAX`` or ``lognormal:MU,SIGMA`` (of the
+natural log of the size in bytes, so ``lognormal:9,1.5`` has a median of about 8KB).
+"""
+import argparse
+import datetime
+import os
+import random
+import re
+import sys
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import basc_warc  # noqa: E402
+from basc_warc.reader import WarcReader  # noqa: E402
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), '..', 'examples', 'wget',
+                       'test-uncompressed.warc')
+DEFAULT_RECORDS = 10000
+DEFAULT_SIZES = 'lognormal:9,1.5'
+DEFAULT_BINARY_FRACTION = 0.25
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+# bodies are slices of these pools, which are built once per file
+POOL_SIZE = 4 * 1024 * 1024
+
+
+class SizeDistribution(object):
+    """Random body sizes, from a spec such as ``'uniform:1000-50000'``.
+
+    Args:
+        spec (str): ``fixed:SIZE``, ``uniform:MIN-MAX`` or ``lognormal:MU,SIGMA``.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        kind, sep, params = spec.partition(':')
+        numbers = [float(value) for value in re.split(r'[-,]', params) if value]
+
+        if kind == 'fixed' and len(numbers) == 1:
+            self._sample = lambda rng: numbers[0]
+        elif kind == 'uniform' and len(numbers) == 2:
+            self._sample = lambda rng: rng.uniform(numbers[0], numbers[1])
+        elif kind == 'lognormal' and len(numbers) == 2:
+            self._sample = lambda rng: rng.lognormvariate(numbers[0], numbers[1])
+        else:
+            raise ValueError('Invalid size distribution: {!r}'.format(spec))
+
+    def sample(self, rng):
+        """Return a random size in bytes."""
+        return max(0, min(MAX_BODY_SIZE, int(self._sample(rng))))
+
+    def mean(self):
+        """Return the (approximate) mean size in bytes."""
+        rng = random.Random(0)
+        return sum(self.sample(rng) for i in range(10000)) / 10000.0
+
+
+def load_templates(path=EXAMPLE):
+    """Return the header fields and block of the first record of each type in a file."""
+    templates = {}
+    with open(path, 'rb') as fileobj:
+        for record in WarcReader(fileobj):
+            if record.record_type not in templates:
+                fields = dict(record.header.fields.cased_items())
+                templates[record.record_type] = (fields, record.block.bytes())
+    return templates
+
+
+def _text_pool(rng, html):
+    """Return HTML-like text to take text bodies from, using the words of ``html``."""
+    words = html.split()
+    parts = []
+    size = 0
+    while size < POOL_SIZE:
+        line = b' '.join(rng.choice(words) for i in range(12)) + b'\n'
+        parts.append(line)
+        size += len(line)
+    return b''.join(parts)
+
+
+def _binary_pool(rng):
+    return bytes(bytearray(rng.getrandbits(8) for i in range(64 * 1024))) * (
+        POOL_SIZE // (64 * 1024))
+
+
+def _body(rng, pool, size):
+    """Return ``size`` bytes from a random place in a pool, wrapping around."""
+    start = rng.randrange(len(pool))
+    body = pool[start:start + size]
+    while len(body) < size:
+        body += pool[:size - len(body)]
+    return body
+
+
+def _record_id(rng):
+    return '<urn:uuid:{}>'.format(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _record(record_type, template_fields, block, **fields):
+    header = basc_warc.RecordHeader()
+    for name, value in template_fields.items():
+        if name not in ('WARC-Block-Digest', 'WARC-Payload-Digest', 'Content-Length'):
+            header.set_field(name, value)
+    for name, value in fields.items():
+        header.set_field(name.replace('_', '-'), value)
+    return basc_warc.Record(record_type, header=header, block=basc_warc.RecordBlock(block))
+
+
+def generate_records(records=DEFAULT_RECORDS, sizes=DEFAULT_SIZES, seed=0,
+                     binary_fraction=DEFAULT_BINARY_FRACTION, filename='corpus.warc'):
+    """Yield synthetic records, see the module docstring.
+
+    Args:
+        records (int): Approximate number of records, a warcinfo record followed by
+            request and response pairs.
+        sizes (str): Size distribution of response bodies, see
+            :class:`SizeDistribution`.
+        seed (int): Random seed.
+        binary_fraction (float): Fraction of response bodies that are random bytes
+            rather than text.
+        filename (str): ``WARC-Filename`` of the warcinfo record.
+    """
+    rng = random.Random(seed)
+    distribution = SizeDistribution(sizes)
+    templates = load_templates()
+
+    request_fields, request_block = templates['request']
+    response_fields, response_block = templates['response']
+    http_head, sep, html = response_block.partition(b'\r\n\r\n')
+    http_head = re.sub(br'\r\nContent-(Type|Length): [^\r]*', b'', http_head)
+
+    text_pool = _text_pool(rng, html)
+    binary_pool = _binary_pool(rng)
+
+    date = datetime.datetime(2015, 9, 23, 1, 33, 52)
+    warcinfo_id = _record_id(rng)
+    warcinfo_fields, warcinfo_block = templates['warcinfo']
+    yield _record('warcinfo', warcinfo_fields, warcinfo_block, WARC_Record_ID=warcinfo_id,
+                  WARC_Date=date, WARC_Filename=filename)
+
+    for number in range((records - 1) // 2):
+        url = 'http://example.com/{}/{}'.format(number % 97, number)
+        path = url[len('http://example.com'):].encode('utf8')
+        date += datetime.timedelta(seconds=1)
+
+        request_id = _record_id(rng)
+        yield _record('request', request_fields,
+                      request_block.replace(b'GET / ', b'GET ' + path + b' ', 1),
+                      WARC_Record_ID=request_id, WARC_Date=date, WARC_Target_URI=url,
+                      WARC_Warcinfo_ID=warcinfo_id)
+
+        size = distribution.sample(rng)
+        if rng.random() < binary_fraction:
+            content_type, body = b'image/jpeg', _body(rng, binary_pool, size)
+        else:
+            content_type, body = b'text/html', _body(rng, text_pool, size)
+        head = b''.join((http_head, b'\r\nContent-Type: ', content_type,
+                         b'\r\nContent-Length: ', str(size).encode('ascii'), b'\r\n\r\n'))
+
+        yield _record('response', response_fields, head + body,
+                      WARC_Record_ID=_record_id(rng), WARC_Date=date, WARC_Target_URI=url,
+                      WARC_Concurrent_To=request_id, WARC_Warcinfo_ID=warcinfo_id)
+
+
+def generate(path, records=DEFAULT_RECORDS, sizes=DEFAULT_SIZES, compress=True, seed=0,
+             binary_fraction=DEFAULT_BINARY_FRACTION):
+    """Write a synthetic WARC file, and return the number of records written.
+
+    See :func:`generate_records` for the arguments. With ``compress``, each record is
+    its own gzip member.
+    """
+    count = 0
+    with open(path, 'wb') as fileobj:
+        writer = basc_warc.WarcWriter(fileobj, compress_records=compress)
+        for record in generate_records(records, sizes, seed, binary_fraction,
+                                       os.path.basename(path)):
+            writer.add_record(record)
+            count += 1
+        writer.flush()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic WARC file.')
+    parser.add_argument('output', help='path of the WARC file to write')
+    parser.add_argument('--records', type=int, default=DEFAULT_RECORDS,
+                        help='approximate number of records (default: %(default)s)')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help='response body size distribution (default: %(default)s)')
+    parser.add_argument('--no-compress', dest='compress', action='store_false',
+                        help='write an uncompressed WARC file')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--binary-fraction', type=float, default=DEFAULT_BINARY_FRACTION,
+                        help='fraction of bodies that are random bytes (default: '
+                             '%(default)s)')
+    args = parser.parse_args(argv)
+
+    count = generate(args.output, args.records, args.sizes, args.compress, args.seed,
+                     args.binary_fraction)
+    print('{} records, {} bytes, mean body about {:.0f} bytes'.format(
+        count, os.path.getsize(args.output), SizeDistribution(args.sizes).mean()))
+
+
+if __name__ == '__main__':
+    main()
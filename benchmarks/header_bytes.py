@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# BASC-WARC header serialization benchmark
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Measure the per-record cost of serializing record headers.
+
+Usage: python benchmarks/header_bytes.py [number of records]
+"""
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import basc_warc  # noqa: E402
+from basc_warc import utils  # noqa: E402
+from common import timed  # noqa: E402
+
+DEFAULT_RECORDS = 1000000
+
+
+def make_headers(count):
+    """Return ``count`` headers shaped like the response records wget writes."""
+    date = datetime.datetime(2015, 9, 23, 1, 33, 52)
+    headers = []
+    for i in range(count):
+        headers.append(basc_warc.RecordHeader({
+            'WARC-Type': 'response',
+            'WARC-Record-ID': utils.uuid_urn(),
+            'WARC-Warcinfo-ID': '<urn:uuid:5bf9ec92-57e1-4415-8bf2-f405e2e839d6>',
+            'WARC-Concurrent-To': '<urn:uuid:a4ed7c68-fd49-4fed-b71d-441ba756d682>',
+            'WARC-Target-URI': 'http://example.com/{}'.format(i),
+            'WARC-Date': date,
+            'WARC-IP-Address': '93.184.216.34',
+            'WARC-Block-Digest': 'sha1:VSTR54JTQNSXS4ZVI6NVOZ3XZ7QIP3SR',
+            'WARC-Payload-Digest': 'sha1:B2LTWWPUOYAH7UIPQ7ZUPQ4VMBSVC36A',
+            'Content-Type': 'application/http;msgtype=response',
+            'Content-Length': 1591,
+        }))
+    return headers
+
+
+def serialize(headers):
+    """Serialize every header."""
+    for header in headers:
+        header.bytes()
+
+
+def serialize_records(headers):
+    """Serialize a record with each header twice, as writing and indexing it would."""
+    for header in headers:
+        record = basc_warc.Record('response', header=header,
+                                  block=basc_warc.RecordBlock(b'x' * 64))
+        record.bytes()
+        record.bytes()
+
+
+def main(count):
+    headers = []
+
+    def build():
+        headers.extend(make_headers(count))
+
+    print('{} records'.format(count))
+    timed('build headers', count, build)
+    timed('RecordHeader.bytes() (cold)', count, lambda: serialize(headers))
+    timed('RecordHeader.bytes() (cached)', count, lambda: serialize(headers))
+    timed('Record.bytes() x2', count, lambda: serialize_records(headers))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RECORDS)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# BASC-WARC header parsing benchmark
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Measure the per-record cost of parsing record headers while reading.
+
+The example wget WARC files are repeated to make larger files to read.
+
+Usage: python benchmarks/header_parsing.py [number of copies]
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from basc_warc import reader  # noqa: E402
+from common import report, time_call, timed  # noqa: E402
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'examples', 'wget')
+DEFAULT_COPIES = 20000
+
+
+def scaled_copy(path, copies, directory):
+    """Write the given WARC file repeated ``copies`` times, and return its path."""
+    with open(path, 'rb') as fileobj:
+        data = fileobj.read()
+
+    out_path = os.path.join(directory, '{}x{}'.format(copies, os.path.basename(path)))
+    with open(out_path, 'wb') as out:
+        for i in range(copies):
+            out.write(data)
+    return out_path
+
+
+def header_lines(path):
+    """Return the header field lines of every record in an uncompressed WARC file."""
+    with open(path, 'rb') as fileobj:
+        data = fileobj.read()
+        fileobj.seek(0)
+        offsets = [record.offset for record in reader.WarcReader(fileobj)]
+
+    headers = []
+    for offset in offsets:
+        end = data.index(b'\r\n\r\n', offset)
+        lines = data[offset:end + 2].splitlines(True)
+        headers.append(lines[1:])
+    return headers
+
+
+def parse_lines(headers):
+    """Parse headers given as lists of lines."""
+    for lines in headers:
+        reader.parse_header(lines)
+
+
+def parse_bytes(joined, dates=False):
+    """Parse headers given as bytes, and with ``dates``, convert their dates."""
+    for data in joined:
+        header = reader.parse_header_bytes(data)[1]
+        if dates:
+            header.date
+
+
+def read_records(path):
+    """Read every record of a file, and the one field a CDX indexer would look at."""
+    with open(path, 'rb') as fileobj:
+        for record in reader.WarcReader(fileobj):
+            record.header.fields.get('WARC-Target-URI')
+
+
+def record_offsets(path):
+    """Return the offsets of the records in an uncompressed WARC file."""
+    with open(path, 'rb') as fileobj:
+        return [record.offset for record in reader.WarcReader(fileobj)]
+
+
+def records_at(warc, offsets):
+    """Parse the record at each offset of a :class:`basc_warc.reader.MappedWarcFile`."""
+    for offset in offsets:
+        warc.record_at(offset)
+
+
+def main(copies):
+    directory = tempfile.mkdtemp()
+    try:
+        plain = scaled_copy(os.path.join(EXAMPLES, 'test-uncompressed.warc'), copies,
+                            directory)
+        compressed = scaled_copy(os.path.join(EXAMPLES, 'test.warc.gz'), copies, directory)
+
+        headers = header_lines(os.path.join(EXAMPLES, 'test-uncompressed.warc')) * copies
+        joined = [b''.join(lines) for lines in headers]
+        count = len(headers)
+
+        print('{} records'.format(count))
+        timed('parse_header(lines)', count, lambda: parse_lines(headers))
+        timed('parse_header_bytes(data)', count, lambda: parse_bytes(joined))
+        timed('parse_header_bytes(data).date', count, lambda: parse_bytes(joined, True))
+        timed('WarcReader (uncompressed)', count, lambda: read_records(plain))
+        timed('WarcReader (gzip)', count, lambda: read_records(compressed))
+
+        offsets = record_offsets(plain)
+        with reader.MappedWarcFile(plain) as warc:
+            report('MappedWarcFile.record_at', count,
+                   time_call(lambda: records_at(warc, offsets)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COPIES)
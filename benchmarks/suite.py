@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# BASC-WARC benchmark suite
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Measure records/sec and MB/sec for writing, digesting, compressing, reading and
+indexing WARC files, on a synthetic corpus (see ``corpus.py``). This includes the
+header benchmarks of ``header_bytes.py`` and ``header_parsing.py``, so one run covers
+everything.
+
+Each benchmark is run ``--repeat`` times and the fastest run is kept. Results are
+written as JSON, and can be compared against an earlier run to find regressions.
+
+Usage: python benchmarks/suite.py [--records N] [--sizes SPEC] [--seed SEED]
+       [--repeat N] [--only NAME,...] [--output results.json]
+       [--compare old.json] [--threshold PERCENT]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import basc_warc  # noqa: E402
+import corpus  # noqa: E402
+import header_bytes as header_bytes_benchmark  # noqa: E402
+import header_parsing  # noqa: E402
+from basc_warc import cdx, utils  # noqa: E402
+from basc_warc.members import INDEX_SUFFIX, MemberIndex, ParallelWarcReader  # noqa: E402
+from basc_warc.query import Query, query_warc  # noqa: E402
+from basc_warc.reader import MappedWarcFile, WarcReader  # noqa: E402
+from common import time_call  # noqa: E402
+
+DEFAULT_RECORDS = 5000
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 10.0
+
+# name -> setup function, in the order they run
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """Register a benchmark.
+
+    The decorated function is called as ``setup(bench)`` with the :class:`Corpus` before
+    each run, and returns ``(run, records, bytes)``, where ``run`` is the function to
+    time and ``records`` and ``bytes`` are how much it processes.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+class Corpus(object):
+    """The synthetic files and records the benchmarks run on.
+
+    Args:
+        directory (str): Directory to write the files to.
+        records (int): Approximate number of records.
+        sizes (str): Size distribution of response bodies.
+        seed (int): Random seed.
+    """
+
+    def __init__(self, directory, records, sizes, seed):
+        self.plain_path = os.path.join(directory, 'corpus.warc')
+        self.gzip_path = os.path.join(directory, 'corpus.warc.gz')
+        corpus.generate(self.plain_path, records, sizes, compress=False, seed=seed)
+        corpus.generate(self.gzip_path, records, sizes, compress=True, seed=seed)
+
+        MemberIndex.build(self.gzip_path).save()
+
+        # (record type, header fields, block) of every record, to build records from
+        self.records = []
+        with open(self.plain_path, 'rb') as fileobj:
+            for record in WarcReader(fileobj):
+                self.records.append((record.record_type,
+                                     list(record.header.fields.cased_items()),
+                                     record.block.bytes()))
+
+        self.serialized = [record.bytes() for record in self.new_records()]
+        self.total_bytes = sum(len(data) for data in self.serialized)
+        self.header_bytes = sum(len(record.header.bytes()) for record in self.new_records())
+
+    def new_records(self):
+        """Return new :class:`basc_warc.Record` objects for the corpus, with nothing cached."""
+        records = []
+        for record_type, fields, block in self.records:
+            header = basc_warc.RecordHeader()
+            for name, value in fields:
+                header.set_field(name, value)
+            records.append(basc_warc.Record(record_type, header=header,
+                                            block=basc_warc.RecordBlock(block)))
+        return records
+
+
+# writing
+@benchmark('RecordHeader.bytes')
+def header_bytes(bench):
+    headers = [record.header for record in bench.new_records()]
+
+    def run():
+        for header in headers:
+            header.bytes()
+
+    return run, len(headers), bench.header_bytes
+
+
+@benchmark('Record.bytes')
+def record_bytes(bench):
+    records = bench.new_records()
+
+    def run():
+        for record in records:
+            record.bytes()
+
+    return run, len(records), bench.total_bytes
+
+
+@benchmark('WarcFile.bytes')
+def warcfile_bytes(bench):
+    warc = basc_warc.WarcFile(records=bench.new_records())
+    return warc.bytes, len(warc.records), bench.total_bytes
+
+
+@benchmark('WarcFile.bytes (gzip)')
+def warcfile_bytes_gzip(bench):
+    warc = basc_warc.WarcFile(records=bench.new_records())
+    return (lambda: warc.bytes(compress_records=True)), len(warc.records), bench.total_bytes
+
+
+@benchmark('Digester')
+def digester(bench):
+    blocks = [block for record_type, fields, block in bench.records]
+
+    def run():
+        for block in blocks:
+            digester = utils.Digester(payload=True)
+            digester.update(block)
+            digester.block_digest()
+            digester.payload_digest()
+
+    return run, len(blocks), sum(len(block) for block in blocks)
+
+
+@benchmark('gzip_member')
+def gzip_member(bench):
+    def run():
+        for data in bench.serialized:
+            utils.gzip_member(data)
+
+    return run, len(bench.serialized), bench.total_bytes
+
+
+# header serialization, from header_bytes.py
+def _header_size(headers):
+    return sum(len(header.bytes()) for header in headers)
+
+
+@benchmark('RecordHeader.bytes (cold)')
+def header_bytes_cold(bench):
+    headers = header_bytes_benchmark.make_headers(len(bench.records))
+    size = _header_size(header_bytes_benchmark.make_headers(len(bench.records)))
+    return (lambda: header_bytes_benchmark.serialize(headers)), len(headers), size
+
+
+@benchmark('RecordHeader.bytes (cached)')
+def header_bytes_cached(bench):
+    headers = header_bytes_benchmark.make_headers(len(bench.records))
+    size = _header_size(headers)
+    return (lambda: header_bytes_benchmark.serialize(headers)), len(headers), size
+
+
+@benchmark('Record.bytes x2')
+def record_bytes_twice(bench):
+    headers = header_bytes_benchmark.make_headers(len(bench.records))
+    size = 2 * sum(len(basc_warc.Record('response', header=header,
+                                        block=basc_warc.RecordBlock(b'x' * 64)).bytes())
+                   for header in header_bytes_benchmark.make_headers(len(bench.records)))
+    return (lambda: header_bytes_benchmark.serialize_records(headers)), len(headers), size
+
+
+# header parsing, from header_parsing.py
+@benchmark('parse_header')
+def parse_header(bench):
+    headers = header_parsing.header_lines(bench.plain_path)
+    size = sum(len(line) for lines in headers for line in lines)
+    return (lambda: header_parsing.parse_lines(headers)), len(headers), size
+
+
+@benchmark('parse_header_bytes')
+def parse_header_bytes(bench):
+    joined = [b''.join(lines) for lines in header_parsing.header_lines(bench.plain_path)]
+    size = sum(len(data) for data in joined)
+    return (lambda: header_parsing.parse_bytes(joined)), len(joined), size
+
+
+@benchmark('parse_header_bytes + date')
+def parse_header_dates(bench):
+    joined = [b''.join(lines) for lines in header_parsing.header_lines(bench.plain_path)]
+    size = sum(len(data) for data in joined)
+    return (lambda: header_parsing.parse_bytes(joined, True)), len(joined), size
+
+
+# reading
+def _read(path, read_blocks):
+    def run():
+        with open(path, 'rb') as fileobj:
+            for record in WarcReader(fileobj):
+                if read_blocks:
+                    for chunk in record.block.chunks():
+                        pass
+    return run
+
+
+@benchmark('WarcReader (headers)')
+def read_headers(bench):
+    return _read(bench.plain_path, False), len(bench.records), bench.total_bytes
+
+
+@benchmark('WarcReader')
+def read_plain(bench):
+    return _read(bench.plain_path, True), len(bench.records), bench.total_bytes
+
+
+@benchmark('WarcReader (gzip)')
+def read_gzip(bench):
+    return _read(bench.gzip_path, True), len(bench.records), bench.total_bytes
+
+
+@benchmark('ParallelWarcReader (gzip)')
+def read_parallel(bench):
+    def run():
+        for record in ParallelWarcReader(bench.gzip_path):
+            pass
+
+    return run, len(bench.records), bench.total_bytes
+
+
+@benchmark('ParallelWarcReader (unindexed gzip)')
+def read_parallel_unindexed(bench):
+    # the reader has to build the index first, compare with the run above
+    if os.path.exists(bench.gzip_path + INDEX_SUFFIX):
+        os.remove(bench.gzip_path + INDEX_SUFFIX)
+
+    def run():
+        for record in ParallelWarcReader(bench.gzip_path):
+            pass
+
+    return run, len(bench.records), bench.total_bytes
+
+
+@benchmark('MappedWarcFile.record_at')
+def record_at(bench):
+    offsets = header_parsing.record_offsets(bench.plain_path)
+    warc = MappedWarcFile(bench.plain_path)
+    return (lambda: header_parsing.records_at(warc, offsets)), len(offsets), bench.total_bytes
+
+
+@benchmark('query_warc (indexed gzip)')
+def query_indexed(bench):
+    def run():
+        for record in query_warc(bench.gzip_path, Query(record_types=['warcinfo'])):
+            pass
+
+    return run, len(bench.records), bench.total_bytes
+
+
+# indexing
+def _index(path):
+    def run():
+        with open(path, 'rb') as fileobj:
+            for line in cdx.index_warc(fileobj, os.path.basename(path)):
+                pass
+    return run
+
+
+@benchmark('index_warc')
+def index_plain(bench):
+    return _index(bench.plain_path), len(bench.records), bench.total_bytes
+
+
+@benchmark('index_warc (gzip)')
+def index_gzip(bench):
+    return _index(bench.gzip_path), len(bench.records), bench.total_bytes
+
+
+# running
+def run_benchmark(setup, bench, repeat):
+    """Run a benchmark ``repeat`` times, and return the result of the fastest run."""
+    best = None
+    for i in range(repeat):
+        run, records, size = setup(bench)
+        seconds = time_call(run)
+        if best is None or seconds < best:
+            best = seconds
+
+    best = max(best, 1e-9)
+    return {
+        'seconds': best,
+        'records': records,
+        'bytes': size,
+        'records_per_second': records / best,
+        'mb_per_second': size / best / 1000000.0,
+    }
+
+
+def _git_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def compare(results, old_results, threshold):
+    """Print how each benchmark changed since an earlier run.
+
+    Returns:
+        Names of the benchmarks that got more than ``threshold`` percent slower.
+    """
+    regressions = []
+    print('')
+    if old_results.get('corpus', {}).get('records') != results['corpus']['records'] or (
+            old_results.get('corpus', {}).get('sizes') != results['corpus']['sizes']):
+        print('note: the old results are for a different corpus')
+    print('{:<36} {:>14} {:>14} {:>9}'.format('compared to ' + (old_results.get('git_commit') or
+                                                                 'old results')[:12],
+                                              'old MB/s', 'new MB/s', 'change'))
+    for name, result in results['results'].items():
+        old = old_results['results'].get(name)
+        if old is None:
+            continue
+        change = (result['mb_per_second'] / old['mb_per_second'] - 1) * 100
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('{:<36} {:>14.2f} {:>14.2f} {:>+8.1f}%{}'.format(
+            name, old['mb_per_second'], result['mb_per_second'], change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the BASC-WARC benchmarks.')
+    parser.add_argument('--records', type=int, default=DEFAULT_RECORDS,
+                        help='approximate number of records (default: %(default)s)')
+    parser.add_argument('--sizes', default=corpus.DEFAULT_SIZES,
+                        help='response body size distribution (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='runs of each benchmark, the fastest is kept')
+    parser.add_argument('--only', help='comma-separated names of benchmarks to run')
+    parser.add_argument('--output', help='file to write the results to, as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='results to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='percent slowdown counted as a regression (default: '
+                             '%(default)s)')
+    args = parser.parse_args(argv)
+
+    benchmarks = BENCHMARKS
+    if args.only:
+        names = set(name.strip() for name in args.only.split(','))
+        benchmarks = [(name, setup) for name, setup in BENCHMARKS if name in names]
+
+    results = {
+        'basc_warc_version': basc_warc.__version__,
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'date': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'corpus': {'records': args.records, 'sizes': args.sizes, 'seed': args.seed},
+        'repeat': args.repeat,
+        'results': {},
+    }
+
+    directory = tempfile.mkdtemp()
+    try:
+        print('generating corpus...')
+        bench_corpus = Corpus(directory, args.records, args.sizes, args.seed)
+        results['corpus']['bytes'] = bench_corpus.total_bytes
+        results['corpus']['gzip_bytes'] = os.path.getsize(bench_corpus.gzip_path)
+        print('{} records, {:.1f}MB uncompressed, {:.1f}MB gzipped'.format(
+            len(bench_corpus.records), bench_corpus.total_bytes / 1000000.0,
+            results['corpus']['gzip_bytes'] / 1000000.0))
+        print('')
+        print('{:<36} {:>10} {:>14} {:>10}'.format('', 'seconds', 'records/s', 'MB/s'))
+
+        for name, setup in benchmarks:
+            result = run_benchmark(setup, bench_corpus, args.repeat)
+            results['results'][name] = result
+            print('{:<36} {:>10.3f} {:>14.0f} {:>10.2f}'.format(
+                name, result['seconds'], result['records_per_second'],
+                result['mb_per_second']))
+    finally:
+        shutil.rmtree(directory)
+
+    if args.output:
+        with open(args.output, 'w') as fileobj:
+            json.dump(results, fileobj, indent=2, sort_keys=True)
+            fileobj.write('\n')
+
+    if args.compare:
+        with open(args.compare) as fileobj:
+            old_results = json.load(fileobj)
+        if compare(results, old_results, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
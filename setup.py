@@ -24,6 +24,11 @@ setup(
     package_dir={
         'basc_warc': 'basc_warc',
     },
+    entry_points={
+        'console_scripts': [
+            'basc-warc = basc_warc.cli:main',
+        ],
+    },
     keywords='warc archive archiving',
     classifiers=[
         'Development Status :: 1 - Planning',
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC test fixtures
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""WARC files for the tests, written byte by byte so nothing is normalized."""
+import os
+
+import pytest
+
+from basc_warc import CRLF, utils
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'examples', 'wget')
+
+HTTP_RESPONSE = (b'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n'
+                 b'<html>hello</html>')
+
+# non-UTF-8 bytes, and a field that's repeated
+ODD_VALUE = b'caf\xe9'
+CONCURRENT_TO = ['<urn:uuid:00000000-0000-0000-0000-000000000001>',
+                 '<urn:uuid:00000000-0000-0000-0000-000000000002>']
+
+
+def raw_record(record_type, number, block, warc_version=b'WARC/1.1', extra=b''):
+    """Return the bytes of a record, exactly as given."""
+    return bytes().join((
+        warc_version, CRLF,
+        b'WARC-Type: ', record_type, CRLF,
+        b'WARC-Record-ID: <urn:uuid:00000000-0000-0000-0000-1000000000%02d>' % number, CRLF,
+        b'WARC-Date: 2020-01-02T03:04:05.123456Z', CRLF,
+        b'WARC-Target-URI: http://example.com/%d' % number, CRLF,
+        b'Content-Type: application/http;msgtype=response', CRLF,
+        extra,
+        b'Content-Length: %d' % len(block), CRLF,
+        CRLF, block, CRLF, CRLF))
+
+
+def odd_response(number):
+    """Return a WARC/1.1 response with repeated fields and a non-UTF-8 value."""
+    extra = bytes().join(b'WARC-Concurrent-To: ' + value.encode('ascii') + CRLF
+                         for value in CONCURRENT_TO)
+    extra += b'X-Note: ' + ODD_VALUE + CRLF
+    return raw_record(b'response', number, HTTP_RESPONSE, extra=extra)
+
+
+def records_bytes(count=4):
+    """Return the bytes of each record of a small WARC file."""
+    return [odd_response(number) for number in range(count)]
+
+
+@pytest.fixture
+def warc_path(tmp_path):
+    """Path of an uncompressed WARC file of odd responses."""
+    path = str(tmp_path / 'odd.warc')
+    with open(path, 'wb') as fileobj:
+        fileobj.write(bytes().join(records_bytes()))
+    return path
+
+
+@pytest.fixture
+def warc_gz_path(tmp_path):
+    """Path of a ``.warc.gz`` file of odd responses, one gzip member per record."""
+    path = str(tmp_path / 'odd.warc.gz')
+    with open(path, 'wb') as fileobj:
+        for data in records_bytes():
+            fileobj.write(utils.gzip_member(data))
+    return path
+
+
+def assert_odd_header(header):
+    """Check a header still has what :func:`odd_response` gave it."""
+    assert header.warc_version == b'WARC/1.1'
+    assert header.fields.get_all('WARC-Concurrent-To') == CONCURRENT_TO
+    assert b'X-Note: ' + ODD_VALUE + CRLF in header.bytes()
+    assert b'WARC-Date: 2020-01-02T03:04:05.123456Z' + CRLF in header.bytes()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC CDX tests
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""CDX files, checked against the ones wget wrote for the example WARC files."""
+import io
+import os
+import shutil
+
+import pytest
+
+from basc_warc import cdx
+from basc_warc.cli import main
+
+from conftest import EXAMPLES
+
+
+@pytest.mark.parametrize('name', ['test.warc.gz', 'test-uncompressed.warc'])
+def test_write_cdx_matches_wget(name):
+    with open(os.path.join(EXAMPLES, name.split('.')[0] + '.cdx'), 'rb') as fileobj:
+        expected = fileobj.read()
+
+    out = io.BytesIO()
+    with open(os.path.join(EXAMPLES, name), 'rb') as fileobj:
+        cdx.write_cdx(fileobj, out, name)
+
+    assert out.getvalue() == expected
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_index_command_matches_wget(tmp_path, jobs):
+    paths = []
+    for name in ('test.warc.gz', 'test-uncompressed.warc'):
+        paths.append(str(tmp_path / name))
+        shutil.copy(os.path.join(EXAMPLES, name), paths[-1])
+    out_path = str(tmp_path / 'out.cdx')
+
+    assert main(['index', '-j', jobs, '-o', out_path] + paths) == 0
+
+    with open(os.path.join(EXAMPLES, 'test.cdx'), 'rb') as fileobj:
+        expected = fileobj.read()
+    with open(os.path.join(EXAMPLES, 'test-uncompressed.cdx'), 'rb') as fileobj:
+        # only one header line for both files
+        expected += fileobj.read().split(b'\n', 1)[1]
+    with open(out_path, 'rb') as fileobj:
+        assert fileobj.read() == expected
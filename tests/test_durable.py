@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC durable writer tests
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Recovering WARC files that were being written when a crawler crashed."""
+import os
+
+import pytest
+
+from basc_warc import Record, RecordBlock, RecordHeader, utils
+from basc_warc.durable import DurableWarcWriter, read_journal, recover
+from basc_warc.reader import WarcReader
+
+from conftest import HTTP_RESPONSE
+
+
+def _record(number):
+    header = RecordHeader({
+        'WARC-Record-ID': utils.uuid_urn(),
+        'WARC-Target-URI': 'http://example.com/{}'.format(number),
+        'Content-Type': 'application/http;msgtype=response',
+    })
+    return Record('response', header=header, block=RecordBlock(HTTP_RESPONSE))
+
+
+def _uris(path):
+    with open(path, 'rb') as fileobj:
+        return [record.header.fields['WARC-Target-URI'] for record in WarcReader(fileobj)]
+
+
+@pytest.mark.parametrize('compress_records', [False, True])
+def test_recover_truncates_partial_record(tmp_path, compress_records):
+    path = str(tmp_path / 'crawl.warc')
+    with DurableWarcWriter(path, compress_records=compress_records,
+                           sync_records=1) as writer:
+        writer.add_records(_record(0), _record(1))
+    size = os.path.getsize(path)
+    assert read_journal(path + '.journal') == size
+
+    # a crash part way through writing the next record
+    partial = _record(2).bytes()
+    if compress_records:
+        partial = utils.gzip_member(partial)
+    with open(path, 'ab') as fileobj:
+        fileobj.write(partial[:len(partial) // 2])
+
+    assert recover(path) == len(partial) // 2
+    assert os.path.getsize(path) == size
+    assert recover(path) == 0
+
+    # reopening recovers too, and appends after the last complete record
+    with open(path, 'ab') as fileobj:
+        fileobj.write(partial[:len(partial) // 2])
+    with DurableWarcWriter(path, compress_records=compress_records) as writer:
+        assert writer.truncated_bytes == len(partial) // 2
+        writer.add_record(_record(3))
+
+    assert _uris(path) == ['http://example.com/0', 'http://example.com/1',
+                           'http://example.com/3']
+
+
+def test_recover_without_journal(tmp_path):
+    path = str(tmp_path / 'crawl.warc.gz')
+    with DurableWarcWriter(path) as writer:
+        writer.add_record(_record(0))
+    os.remove(path + '.journal')
+    size = os.path.getsize(path)
+
+    with open(path, 'ab') as fileobj:
+        fileobj.write(utils.gzip_member(_record(1).bytes())[:-4])
+
+    assert recover(path) > 0
+    assert os.path.getsize(path) == size
+    assert _uris(path) == ['http://example.com/0']
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC record tests
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Writing records and reading them back."""
+import datetime
+import io
+
+import pytest
+
+from basc_warc import (Record, RecordBlock, RecordHeader, WarcFields, WarcFile, WarcWriter,
+                       utils)
+from basc_warc.capture import HttpCapture
+from basc_warc.dedup import DigestEntry, revisit_record
+from basc_warc.reader import MappedWarcFile, WarcReader, read_record_at
+
+from conftest import HTTP_RESPONSE, assert_odd_header, odd_response
+
+
+def _records(count=3):
+    records = []
+    for number in range(count):
+        header = RecordHeader({
+            'WARC-Record-ID': utils.uuid_urn(),
+            'WARC-Date': datetime.datetime(2020, 1, 2, 3, 4, 5),
+            'WARC-Target-URI': 'http://example.com/{}'.format(number),
+            'Content-Type': 'application/http;msgtype=response',
+        })
+        records.append(Record('response', header=header,
+                              block=RecordBlock(HTTP_RESPONSE + b'%d' % number)))
+    return records
+
+
+@pytest.mark.parametrize('compress_records', [False, True])
+def test_write_read_round_trip(compress_records):
+    records = _records()
+    data = WarcFile(records).bytes(compress_records=compress_records)
+
+    read = [(record.header.bytes(), record.block.bytes())
+            for record in WarcReader(io.BytesIO(data))]
+    assert read == [(record.header.bytes(), record.block.bytes()) for record in records]
+
+
+@pytest.mark.parametrize('compress_records', [False, True])
+def test_writer_matches_warc_file(compress_records):
+    records = _records()
+    out = io.BytesIO()
+    with WarcWriter(out, compress_records=compress_records) as writer:
+        offsets = writer.add_records(*records)
+        expected = WarcFile(records).bytes(compress_records=compress_records)
+        assert out.getvalue() == expected
+
+    assert offsets == [record.offset for record in WarcReader(io.BytesIO(expected))]
+
+
+def test_writer_has_no_bytes():
+    writer = WarcWriter(io.BytesIO())
+    with pytest.raises(TypeError):
+        writer.bytes(compress_records=True, compression_level=9)
+    with pytest.raises(TypeError):
+        writer.write_to(io.BytesIO())
+
+
+def test_replacing_fields_clears_cached_bytes():
+    header = RecordHeader({'WARC-Type': 'response'})
+    assert b'response' in header.bytes()
+
+    # a new WarcFields starts at the same version the old one was cached at
+    header.fields = WarcFields({'WARC-Type': 'request'})
+    assert b'request' in header.bytes()
+
+    header.warc_version = b'WARC/1.1'
+    assert header.bytes().startswith(b'WARC/1.1\r\n')
+
+
+def test_repeated_and_non_utf8_fields():
+    record = next(iter(WarcReader(io.BytesIO(odd_response(0)))))
+    assert_odd_header(record.header)
+
+    # copies, and changes to other fields, keep them too
+    header = RecordHeader(record.header.fields, warc_version=record.header.warc_version)
+    header.set_field('WARC-Target-URI', 'http://example.com/other')
+    assert_odd_header(header)
+
+    header.fields['WARC-Concurrent-To'] = 'one'
+    assert header.fields.get_all('WARC-Concurrent-To') == ['one']
+
+
+def test_subsecond_dates_in_warc_1_1():
+    date = datetime.datetime(2020, 1, 2, 3, 4, 5, 123456)
+    header = RecordHeader({'WARC-Date': date})
+    assert b'WARC-Date: 2020-01-02T03:04:05Z' in header.bytes()
+
+    header.warc_version = b'WARC/1.1'
+    assert b'WARC-Date: 2020-01-02T03:04:05.123456Z' in header.bytes()
+
+
+@pytest.mark.parametrize('fixture', ['warc_path', 'warc_gz_path'])
+def test_read_record_at(request, fixture):
+    path = request.getfixturevalue(fixture)
+    with open(path, 'rb') as fileobj:
+        expected = [(record.offset, record.block.bytes()) for record in WarcReader(fileobj)]
+
+    with MappedWarcFile(path) as warc:
+        for offset, block in expected:
+            record = warc.record_at(offset)
+            assert_odd_header(record.header)
+            assert bytes(record.block.bytes()) == block
+
+    offset, block = expected[-1]
+    assert bytes(read_record_at(path, offset).block.bytes()) == block
+
+
+def test_revisit_is_warc_1_1():
+    record = _records(1)[0]
+    record.prepare()
+    entry = DigestEntry('<urn:uuid:original>', 'http://example.com/',
+                        datetime.datetime(2019, 1, 1))
+
+    header = revisit_record(record, entry).header
+    assert header.warc_version == b'WARC/1.1'
+    assert '/1.1/' in header.fields['WARC-Profile']
+    assert header.fields['WARC-Refers-To-Target-URI'] == 'http://example.com/'
+
+
+@pytest.mark.parametrize('spool_size', [1024, 10])
+def test_capture_closes_spool(spool_size):
+    out = io.BytesIO()
+    capture = HttpCapture(WarcWriter(out), 'http://example.com/', b'GET / HTTP/1.1\r\n\r\n',
+                          spool_size=spool_size)
+    capture.write_response(HTTP_RESPONSE)
+    capture.finish()
+
+    spool_file = capture._spool._file
+    assert spool_file is None or spool_file.closed
+
+    (request, _), (response, block) = [(record.header, record.block.bytes())
+                                       for record in WarcReader(io.BytesIO(out.getvalue()))]
+    assert block == HTTP_RESPONSE
+    assert response.fields['WARC-Payload-Digest'] == utils.content_digest(
+        b'<html>hello</html>')
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# BASC-WARC rewriting tests
+#
+# To the extent possible under law, the author(s) have dedicated all copyright
+# and related and neighboring rights to this software to the public domain
+# worldwide. This software is distributed without any warranty.
+#
+# You should have received a copy of the CC0 Public Domain Dedication along
+# with this software. If not, see
+# <http://creativecommons.org/publicdomain/zero/1.0/>.
+"""Reading records and writing them to new files, without changing them."""
+import os
+
+import pytest
+
+from basc_warc import WarcWriter
+from basc_warc.cli import main
+from basc_warc.members import MemberIndex, ParallelWarcReader
+from basc_warc.query import Query, copy_records, query_warc
+from basc_warc.reader import MappedWarcFile, WarcReader
+from basc_warc.repack import cdx_path_for, extract_records, merge_warcs, split_warc
+
+from conftest import CONCURRENT_TO, assert_odd_header, records_bytes
+
+
+def _read(path):
+    with open(path, 'rb') as fileobj:
+        return [(record.header, record.block.bytes()) for record in WarcReader(fileobj)]
+
+
+def _check_cdx(path):
+    """Check that every offset in a file's CDX file is the start of a record there."""
+    with open(cdx_path_for(path), 'rb') as fileobj:
+        lines = fileobj.read().decode('utf8').splitlines()[1:]
+    offsets = [int(line.split(' ')[8]) for line in lines]
+
+    with MappedWarcFile(path) as warc:
+        for offset in offsets:
+            assert_odd_header(warc.record_at(offset).header)
+    return offsets
+
+
+@pytest.mark.parametrize('compress_records', [False, True])
+@pytest.mark.parametrize('fixture', ['warc_path', 'warc_gz_path'])
+def test_copy_records(request, tmp_path, fixture, compress_records):
+    path = request.getfixturevalue(fixture)
+    out_path = str(tmp_path / 'copy.warc')
+
+    with open(out_path, 'wb') as fileobj:
+        with WarcWriter(fileobj, compress_records=compress_records) as writer:
+            assert copy_records(query_warc(path, Query()), writer) == len(records_bytes())
+
+    copied = _read(out_path)
+    assert [block for header, block in copied] == [block for header, block in _read(path)]
+    for header, block in copied:
+        assert_odd_header(header)
+
+
+def test_copy_records_with_member_index(tmp_path, warc_gz_path):
+    MemberIndex.build(warc_gz_path).save()
+    out_path = str(tmp_path / 'copy.warc')
+
+    query = Query(urls=['http://example.com/2'])
+    with open(out_path, 'wb') as fileobj:
+        with WarcWriter(fileobj) as writer:
+            assert copy_records(query_warc(warc_gz_path, query), writer) == 1
+
+    (header, block), = _read(out_path)
+    assert_odd_header(header)
+    assert header.fields['WARC-Target-URI'] == 'http://example.com/2'
+
+
+@pytest.mark.parametrize('fixture', ['warc_path', 'warc_gz_path'])
+def test_merge_warcs(request, tmp_path, fixture):
+    path = request.getfixturevalue(fixture)
+    suffix = '.warc.gz' if path.endswith('.gz') else '.warc'
+    out_path = str(tmp_path / ('merged' + suffix))
+
+    offsets = merge_warcs([path, path], out_path)
+
+    with open(path, 'rb') as fileobj:
+        data = fileobj.read()
+    with open(out_path, 'rb') as fileobj:
+        assert fileobj.read() == data + data
+    assert offsets == [0, len(data)]
+    assert len(_check_cdx(out_path)) == 2 * len(records_bytes())
+
+
+@pytest.mark.parametrize('by_type', [False, True])
+def test_split_warc(tmp_path, warc_gz_path, by_type):
+    template = str(tmp_path / 'part-{type}-{number}.warc.gz')
+    max_size = os.path.getsize(warc_gz_path) // 2 + 1
+
+    out_paths = split_warc(warc_gz_path, template, max_size=max_size, by_type=by_type)
+
+    assert len(out_paths) == 2
+    data = b''
+    for out_path in out_paths:
+        assert len(_check_cdx(out_path)) == len(_read(out_path))
+        with open(out_path, 'rb') as fileobj:
+            data += fileobj.read()
+    with open(warc_gz_path, 'rb') as fileobj:
+        assert data == fileobj.read()
+
+
+def test_extract_records(tmp_path, warc_gz_path):
+    out_path = str(tmp_path / 'extracted.warc.gz')
+    extract_records(warc_gz_path, out_path, Query(url_prefixes=['http://example.com/']))
+
+    assert [block for header, block in _read(out_path)] == [
+        block for header, block in _read(warc_gz_path)]
+    _check_cdx(out_path)
+
+
+def test_parallel_reader(warc_gz_path):
+    records = [(record.header, record.block.bytes())
+               for record in ParallelWarcReader(warc_gz_path, jobs=2, range_size=1)]
+    assert [block for header, block in records] == [
+        block for header, block in _read(warc_gz_path)]
+    for header, block in records:
+        assert_odd_header(header)
+
+    # the index is only saved when asked for
+    assert MemberIndex.load(warc_gz_path) is None
+
+
+def test_member_index_invalidated_by_changes(warc_gz_path):
+    index = MemberIndex.build(warc_gz_path)
+    index.save()
+    assert list(MemberIndex.load(warc_gz_path).members()) == list(index.members())
+
+    # same size, different content and modification time
+    with open(warc_gz_path, 'r+b') as fileobj:
+        data = fileobj.read()
+        fileobj.seek(0)
+        fileobj.write(data)
+    stat = os.stat(warc_gz_path)
+    os.utime(warc_gz_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert MemberIndex.load(warc_gz_path) is None
+
+
+@pytest.mark.parametrize('fixture', ['warc_path', 'warc_gz_path'])
+def test_cat_keeps_warc_version(request, tmp_path, fixture):
+    path = request.getfixturevalue(fixture)
+    out_path = str(tmp_path / 'headers')
+
+    assert main(['cat', '-o', out_path, path]) == 0
+
+    with open(out_path, 'rb') as fileobj:
+        headers = fileobj.read().split(b'\r\n\r\n')[:-1]
+    assert len(headers) == len(records_bytes())
+    for header in headers:
+        assert header.startswith(b'WARC/1.1\r\n')
+        assert header.count(b'WARC-Concurrent-To: ') == len(CONCURRENT_TO)